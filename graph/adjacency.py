@@ -0,0 +1,281 @@
+# graph/adjacency.py
+"""
+関心事のグラフをメモリ上で扱うための配列ベースの表現
+
+    ・ノードの ID は 0 から始まる連番 ( インデックス ) に変換する
+    ・接続先 ( targets ) と接続元 ( sources ) は CSR 形式で持つ
+    ・node_type / to_root は型付きの配列で持つ
+
+配列は標準ライブラリの array で持つため、NumPy があれば
+np.frombuffer() でコピーせずに ndarray として扱える
+"""
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .models import Node
+
+
+class ConcernGraph(object):
+    """関心事のグラフ ( CSR 形式の隣接リスト )"""
+
+    def __init__(self, concern_id, version, rows, edges):
+        """
+        rows  .. (id, content, node_type, to_root) のタプルの配列
+            ( 並び順がノードのインデックスになる )
+        edges .. (接続元 ID, 接続先 ID) のタプルの配列
+        """
+        self.concern_id = concern_id
+        self.version = version
+
+        # ノードの情報
+        self.node_ids = array("q", (row[0] for row in rows))
+        self.contents = [row[1] for row in rows]
+        self.node_types = array("b", (row[2] for row in rows))
+        self.to_root = array("b", (row[3] for row in rows))
+
+        # ノードの ID => インデックス ( ID の昇順 + 二分探索 )
+        order = sorted(range(len(rows)), key=self.node_ids.__getitem__)
+        self._sorted_ids = array("q", (self.node_ids[i] for i in order))
+        self._sorted_index = array("l", order)
+
+        # 接続情報をインデックスに変換する
+        # ( 他の関心事のノードへの接続は無視する )
+        id2index = dict(zip(self.node_ids, range(len(rows))))
+        sources = array("l")
+        targets = array("l")
+        for source_id, target_id in edges:
+            source = id2index.get(source_id)
+            target = id2index.get(target_id)
+            if source is not None and target is not None:
+                sources.append(source)
+                targets.append(target)
+
+        self.targets_indptr, self.targets_indices = \
+            _to_csr(len(rows), sources, targets)
+        self.sources_indptr, self.sources_indices = \
+            _to_csr(len(rows), targets, sources)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def num_links(self):
+        """接続の数 ( ルートへの接続は含まない )"""
+        return len(self.targets_indices)
+
+    def index_of(self, node_id):
+        """ノードの ID をインデックスに変換する ( なければ None )"""
+        i = bisect_left(self._sorted_ids, node_id)
+        if i < len(self._sorted_ids) and self._sorted_ids[i] == node_id:
+            return self._sorted_index[i]
+        return None
+
+    def targets_of(self, index):
+        """接続先のノードのインデックス"""
+        return self.targets_indices[
+            self.targets_indptr[index]:self.targets_indptr[index + 1]]
+
+    def sources_of(self, index):
+        """接続元のノードのインデックス"""
+        return self.sources_indices[
+            self.sources_indptr[index]:self.sources_indptr[index + 1]]
+
+    def edges(self):
+        """(接続元, 接続先) のインデックスを接続元の順に返す"""
+        indptr = self.targets_indptr
+        indices = self.targets_indices
+        for source in range(len(self)):
+            for k in range(indptr[source], indptr[source + 1]):
+                yield source, indices[k]
+
+    @property
+    def nbytes(self):
+        """メモリ使用量 ( バイト数の目安 )"""
+        arrays = (
+            self.node_ids, self.node_types, self.to_root,
+            self._sorted_ids, self._sorted_index,
+            self.targets_indptr, self.targets_indices,
+            self.sources_indptr, self.sources_indices,
+        )
+        size = sum(a.itemsize * len(a) for a in arrays)
+        size += sys.getsizeof(self.contents)
+        size += sum(sys.getsizeof(c) for c in self.contents)
+        return size
+
+    def to_payload(self, concern_content):
+        """D3.js ( ForceConcern ) 用の nodes/links を作成する"""
+
+        # ノード情報を作成 ( concern 自体)
+        # concern 自体を 1 個目のノードとするため、
+        # D3.js が使用するノード ID はインデックス + 1
+        node_dicts = [{
+            "id": 0,
+            "content": concern_content,
+            "is_root": True,
+            "node_type": 0,
+        }]
+
+        # ノード情報を作成 ( ノード全体 )
+        node_dicts += [
+            {
+                "id": i + 1,
+                "content": self.contents[i],
+                "is_root": False,
+                "nid": self.node_ids[i],
+                "node_type": self.node_types[i],
+            } for i in range(len(self))
+        ]
+
+        # 接続情報を作成する
+        links = []
+        indptr = self.targets_indptr
+        indices = self.targets_indices
+        for i in range(len(self)):
+            node_type = self.node_types[i]
+            if self.to_root[i]:
+                links.append({
+                    "source": i + 1,
+                    "target": 0,    # ルートに接続
+                    "node_type": 0,
+                })
+            for k in range(indptr[i], indptr[i + 1]):
+                links.append({
+                    "source": i + 1,
+                    "target": indices[k] + 1,
+                    "node_type": node_type,
+                })
+
+        payload = {
+            "nodes": node_dicts,
+            "links": links,
+        }
+
+        return payload
+
+
+def _to_csr(n, rows, cols):
+    """(行, 列) の配列を CSR 形式 ( indptr, indices ) に変換する"""
+
+    # 行ごとの要素数を数えて累積和をとる
+    indptr = array("l", [0] * (n + 1))
+    for row in rows:
+        indptr[row + 1] += 1
+    for i in range(n):
+        indptr[i + 1] += indptr[i]
+
+    # 元の並び順を保ったまま列を詰める
+    indices = array("l", [0] * len(cols))
+    offset = array("l", indptr[:-1])
+    for row, col in zip(rows, cols):
+        indices[offset[row]] = col
+        offset[row] += 1
+
+    return indptr, indices
+
+
+def load_nodes(concern_id):
+    """関連するノード一覧 ( id, content, node_type, to_root )"""
+    return list(
+        Node.objects.filter(
+            concern_id=concern_id
+        ).order_by(
+            "created_at", "id"
+        ).values_list(
+            "id", "content", "node_type", "to_root"
+        )
+    )
+
+
+def load_edges(concern_id):
+    """中間テーブルのレコード ( 接続元 ID, 接続先 ID ) を 1 回のクエリで"""
+    Through = Node.targets.through
+    return list(
+        Through.objects.filter(
+            from_node__concern_id=concern_id
+        ).order_by(
+            "id"
+        ).values_list(
+            "from_node_id", "to_node_id"
+        )
+    )
+
+
+def load_concern_graph(concern_id, version):
+    """
+    データベースから関心事のグラフを作成する
+    ※2 つのクエリは互いに独立している
+      ( graph/asgi.py では並行して発行する )
+    """
+    rows = load_nodes(concern_id)
+    edges = load_edges(concern_id)
+    return ConcernGraph(concern_id, version, rows, edges)
+
+
+class GraphLRUCache(object):
+    """(関心事の ID, グラフのバージョン) をキーとする LRU キャッシュ"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._graphs = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is not None:
+                self._graphs.move_to_end(key)
+            return graph
+
+    def set(self, key, graph):
+        with self._lock:
+            # 同じ関心事の古いバージョンは不要
+            for old in [k for k in self._graphs if k[0] == key[0]]:
+                del self._graphs[old]
+
+            self._graphs[key] = graph
+            while len(self._graphs) > self.max_entries:
+                self._graphs.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._graphs.clear()
+
+    def info(self):
+        """キャッシュしているグラフとメモリ使用量"""
+        with self._lock:
+            graphs = list(self._graphs.values())
+        return {
+            "entries": len(graphs),
+            "max_entries": self.max_entries,
+            "nbytes": sum(g.nbytes for g in graphs),
+            "graphs": [
+                {
+                    "concern_id": g.concern_id,
+                    "version": g.version,
+                    "nodes": len(g),
+                    "links": g.num_links,
+                    "nbytes": g.nbytes,
+                } for g in graphs
+            ],
+        }
+
+
+graphs = GraphLRUCache(
+    getattr(settings, "GRAPH_ADJACENCY_CACHE_SIZE", 64))
+
+
+def get_concern_graph(concern):
+    """関心事のグラフを取得する ( プロセスごとにキャッシュする )"""
+    key = (concern.id, concern.graph_version)
+
+    graph = graphs.get(key)
+    if graph is None:
+        graph = load_concern_graph(*key)
+        graphs.set(key, graph)
+
+    return graph
@@ -0,0 +1,183 @@
+# graph/analytics.py
+"""
+関心事のグラフ全体のノードごとの指標をまとめて計算する
+
+    ・depth        .. ルートまでの最短の距離 ( 届かなければ None )
+    ・in_degree    .. 接続元の数
+    ・out_degree   .. 接続先の数 ( ルートへの接続を含む )
+    ・subtree_size .. ルートまでの最短経路木で、そのノードより
+                      末端側にあるノードの数
+                      ( 厳密な到達可能数は NodeClosure を使う )
+    ・influence    .. ルートに向かう PageRank
+    ・scc          .. 強連結成分の番号 ( 同じ番号のノードは循環している )
+
+graph/adjacency.py の ConcernGraph ( CSR 形式 ) から NumPy /
+SciPy の疎行列で計算し、結果は ConcernGraph ごと ( = 関心事と
+グラフのバージョンごと ) にキャッシュする
+"""
+try:
+    import numpy as np
+    from scipy import sparse
+    from scipy.sparse import csgraph
+except ImportError:    # NumPy / SciPy がなければ計算しない
+    np = None
+
+
+# PageRank の減衰率と反復回数の上限
+DAMPING = 0.85
+MAX_ITERATIONS = 100
+TOLERANCE = 1e-8
+
+
+def available():
+    """指標を計算できるかどうか"""
+    return np is not None
+
+
+def _as_numpy(a):
+    """array.array をコピーせずに ndarray として扱う"""
+    return np.frombuffer(a, dtype="i%d" % a.itemsize) if len(a) else \
+        np.zeros(0, dtype=np.intp)
+
+
+def adjacency_matrix(graph):
+    """
+    接続 ( 接続元 => 接続先 ) の疎行列 ( ( n + 1 ) x ( n + 1 ) )
+    最後の行/列はルート ( 関心事自体 ) を表す
+    """
+    n = len(graph)
+    indptr = _as_numpy(graph.targets_indptr)
+    indices = _as_numpy(graph.targets_indices)
+    to_root = np.flatnonzero(_as_numpy(graph.to_root))
+
+    rows = np.concatenate([
+        np.repeat(np.arange(n), np.diff(indptr)) if n else indices,
+        to_root,
+    ])
+    cols = np.concatenate([indices, np.full(len(to_root), n)])
+    data = np.ones(len(rows), dtype=np.float64)
+
+    matrix = sparse.csr_matrix((data, (rows, cols)), shape=(n + 1, n + 1))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1.0
+
+    return matrix
+
+
+def compute_metrics(graph):
+    """ノードごとの指標 ( 長さ n の配列の辞書 ) を計算する"""
+    n = len(graph)
+    root = n
+    matrix = adjacency_matrix(graph)
+
+    out_degree = np.diff(matrix.indptr)[:n]
+    in_degree = np.bincount(matrix.indices, minlength=n + 1)[:n]
+
+    # ルートからの幅優先探索 ( 接続を逆向きにたどる )
+    distance, parent = csgraph.shortest_path(
+        matrix.T.tocsr(), directed=True, unweighted=True,
+        indices=root, return_predecessors=True)
+    distance = distance[:n]
+    parent = parent[:n]
+
+    # 最短経路木の部分木のサイズ ( 深い方から親に足し込む )
+    reached = np.isfinite(distance)
+    subtree = np.ones(n + 1, dtype=np.int64)
+    subtree[root] = 0
+    levels = distance[reached].astype(np.int64)
+    nodes = np.flatnonzero(reached)
+    for level in range(levels.max() if len(levels) else 0, 1, -1):
+        at_level = nodes[levels == level]
+        np.add.at(subtree, parent[at_level], subtree[at_level])
+    subtree = subtree[:n] - 1
+    subtree[~reached] = 0
+
+    # ルートに向かう PageRank ( 接続先のないノードは全体に配る )
+    total = n + 1
+    out = np.asarray(matrix.sum(axis=1)).ravel()
+    dangling = out == 0
+    out[dangling] = 1.0
+    transition = sparse.diags(1.0 / out) @ matrix
+    transition_t = transition.T.tocsr()
+    rank = np.full(total, 1.0 / total)
+    for _ in range(MAX_ITERATIONS):
+        spread = rank[dangling].sum() / total
+        new_rank = (1 - DAMPING) / total + \
+            DAMPING * (transition_t @ rank + spread)
+        converged = np.abs(new_rank - rank).sum() < TOLERANCE
+        rank = new_rank
+        if converged:
+            break
+
+    # 強連結成分 ( 成分の大きさが 2 以上、または自分自身への接続が
+    # あれば循環している )
+    count, labels = csgraph.connected_components(
+        matrix, directed=True, connection="strong")
+    sizes = np.bincount(labels, minlength=count)
+    labels = labels[:n]
+    in_cycle = (sizes[labels] > 1) | (matrix.diagonal()[:n] != 0)
+
+    return {
+        "depth": distance,
+        "in_degree": in_degree,
+        "out_degree": out_degree,
+        "subtree_size": subtree,
+        "influence": rank[:n],
+        "scc": labels,
+        "in_cycle": in_cycle,
+    }
+
+
+def get_metrics(graph):
+    """ノードごとの指標 ( ConcernGraph ごとにキャッシュする )"""
+    metrics = getattr(graph, "_metrics", None)
+    if metrics is None:
+        metrics = compute_metrics(graph)
+        graph._metrics = metrics
+    return metrics
+
+
+def metrics_as_lists(graph):
+    """指標を JSON に変換できる形 ( リスト ) にする"""
+    metrics = get_metrics(graph)
+    reached = np.isfinite(metrics["depth"])
+    depth = np.where(reached, metrics["depth"], -1).astype(int).tolist()
+    depth = [None if d < 0 else d for d in depth]
+    return {
+        "nid": list(graph.node_ids),
+        "depth": depth,
+        "in_degree": metrics["in_degree"].tolist(),
+        "out_degree": metrics["out_degree"].tolist(),
+        "subtree_size": metrics["subtree_size"].tolist(),
+        "influence": metrics["influence"].round(6).tolist(),
+        "scc": metrics["scc"].tolist(),
+        "in_cycle": metrics["in_cycle"].tolist(),
+    }
+
+
+def attach_metrics(graph, payload):
+    """
+    concern_detail_json のペイロードのノードに指標を追加する
+    ( payload["nodes"][0] はルートなので、i + 1 番目がノード i )
+    """
+    if not available():
+        return payload
+
+    columns = metrics_as_lists(graph)
+    names = [name for name in columns if name != "nid"]
+    for i, node in enumerate(payload["nodes"][1:]):
+        for name in names:
+            node[name] = columns[name][i]
+
+    return payload
+
+
+def cycles(graph):
+    """循環している強連結成分ごとのノードの ID のリスト"""
+    metrics = get_metrics(graph)
+    in_cycle = np.flatnonzero(metrics["in_cycle"])
+    labels = metrics["scc"][in_cycle]
+    groups = {}
+    for i, label in zip(in_cycle.tolist(), labels.tolist()):
+        groups.setdefault(label, []).append(graph.node_ids[i])
+    return sorted(groups.values())
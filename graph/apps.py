@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class GraphConfig(AppConfig):
     name = 'graph'
+
+    def ready(self):
+        # シグナルを登録する
+        from . import signals    # noqa: F401
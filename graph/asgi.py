@@ -0,0 +1,436 @@
+# graph/asgi.py
+"""
+ASGI アプリケーション ( mindgraph/asgi.py から使う )
+
+Django 2.2 には非同期のビューがないため、次のように振り分ける
+    ・ASYNC_VIEWS の URL .. イベントループ上のコルーチンで処理する
+      ORM の呼び出しは上限付きのスレッドプール ( GRAPH_ASYNC_WORKERS )
+      で行い、独立したクエリ ( ノード一覧と中間テーブル ) は並行して発行する
+      変更の通知 ( Server-Sent Events ) はイベントループ上で待つ
+      ( 長く開いたままのストリームがスレッドプールを占有しない )
+    ・それ以外 .. Django のハンドラー ( ミドルウェアを含めて WSGI と同じ )
+      をスレッドプールで呼び出す
+
+待ち時間の間はスレッドを占有しないので、1 プロセスで多くの閲覧者を扱える
+※ASYNC_VIEWS はセッションと認証以外のミドルウェアを通らない
+  ( メトリクス、クエリの記録、プロファイルの対象外 )
+"""
+import asyncio
+import io
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core import signals
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest, \
+get_script_name
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, close_old_connections
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, \
+HttpResponseNotModified, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.urls import Resolver404, resolve, set_script_prefix
+from django.utils.cache import patch_vary_headers
+
+from . import events, pagination, routers
+from .adjacency import ConcernGraph, graphs as adjacency_graphs, \
+load_edges, load_nodes
+from .cache import etag_matches, get_graph_version, graph_etag, \
+lookup_graph, store_graph
+from .layout import layout_available
+from .models import Concern
+from .views import concern_graph_format, concern_index_page, \
+encode_concern_graph, event_stream_response, event_stream_timeout, \
+hub_full_response, stream_concern_graph, streams_concern_graph
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """ORM を呼び出すスレッドプール ( プロセスごとに 1 つ )"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, "GRAPH_ASYNC_WORKERS", 8),
+                thread_name_prefix="graph-asgi")
+        return _executor
+
+
+def shutdown_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    同期の関数 ( ORM の呼び出しなど ) をスレッドプールで実行する
+    ※データベースの接続はスレッドごとなので、呼び出しの後に
+      CONN_MAX_AGE に従って閉じる
+    """
+    def call():
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(get_executor(), call)
+
+
+async def request_replica(request):
+    """
+    リクエストで使うレプリカ ( 書き込みの直後なら None )
+    最初の呼び出しで 1 度だけ選ぶ ( 並行した呼び出しも同じ結果を待つ )
+    """
+    if routers.is_pinned(request):
+        return None
+    future = getattr(request, "_graph_replica", None)
+    if future is None:
+        future = request._graph_replica = asyncio.ensure_future(
+            run_sync(routers.choose_replica))
+    return await future
+
+
+async def run_read(request, func, *args, **kwargs):
+    """
+    読み取りだけの関数をスレッドプールで実行する
+    ( 書き込みの直後でなければレプリカから読む、graph/routers.py )
+    ※スレッドが違っても、リクエストの間は同じレプリカを使う
+    レプリカの読み取りが DatabaseError になれば primary で読み直す
+    """
+    replica = await request_replica(request)
+
+    def call(replica):
+        routers.use_replicas(replica is not None, replica=replica)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            routers.use_replicas(False)
+
+    try:
+        return await run_sync(call, replica)
+    except DatabaseError:
+        if replica in (None, DEFAULT_DB_ALIAS):
+            raise
+
+    # レプリカが使えなければ、リクエストの残りも primary から読む
+    await run_sync(routers.mark_unhealthy, replica)
+    future = request._graph_replica = asyncio.get_event_loop().create_future()
+    future.set_result(None)
+    return await run_sync(call, None)
+
+
+def authenticate(request):
+    """request.session と request.user を設定する ( 読み取りのみ )"""
+    SessionMiddleware().process_request(request)
+    request.user = auth.get_user(request)
+
+
+# # # # # 非同期のビュー # # # # #
+
+async def load_concern_graph(request, concern_id, version):
+    """ノード一覧と中間テーブルのクエリを並行して発行する"""
+    key = (concern_id, version)
+    graph = adjacency_graphs.get(key)
+    if graph is None:
+        rows, edges = await asyncio.gather(
+            run_read(request, load_nodes, concern_id),
+            run_read(request, load_edges, concern_id),
+        )
+        graph = await run_sync(ConcernGraph, concern_id, version, rows, edges)
+        adjacency_graphs.set(key, graph)
+    return graph
+
+
+async def concern_detail_json(request, pk):
+    """views.concern_detail_json の非同期版"""
+
+    version = await run_read(request, get_graph_version, pk)
+    if version is None:
+        raise Http404("No Concern matches the given query.")
+
+    fmt, content_type = concern_graph_format(request)
+
+    etag = graph_etag(pk, version, fmt, weak=layout_available())
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    # views.concern_detail_json と同じ ( 作成の途中で await するため )
+    content = await run_sync(lookup_graph, pk, version, fmt)
+    if content is None:
+        concern = await run_read(request, get_object_or_404, Concern, pk=pk)
+        if streams_concern_graph(concern, fmt):
+            return stream_concern_graph(concern, version)
+        graph = await load_concern_graph(request, pk, version)
+        content = await run_sync(encode_concern_graph, concern, version,
+            graph, fmt)
+        await run_sync(store_graph, pk, version, content, fmt)
+
+    response = HttpResponse(content, content_type=content_type)
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Accept"])
+
+    return response
+
+
+async def concern_index_json(request):
+    """views.concern_index_json の非同期版"""
+
+    await run_sync(authenticate, request)
+
+    try:
+        payload = await run_read(request, concern_index_page, request.user,
+            request.GET.get("cursor"))
+    except pagination.InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return JsonResponse(payload, encoder=DjangoJSONEncoder)
+
+
+async def concern_events(request, pk):
+    """
+    views.concern_events の非同期版
+    通知はイベントループ上で待つ ( スレッドプールを使うのは最初の 1 回だけ )
+    ※本体は async_content ( 非同期のイテレーター ) で、
+      ASGIHandler.send_response() がイベントループ上で送る
+    """
+
+    version = await run_read(request, get_graph_version, pk)
+    if version is None:
+        raise Http404("No Concern matches the given query.")
+
+    timeout = event_stream_timeout(request)
+    if timeout is None:
+        return HttpResponseBadRequest("timeout must be a number")
+
+    loop = asyncio.get_event_loop()
+    try:
+        subscription = events.hub.subscribe(pk, loop=loop)
+    except events.HubFull:
+        return hub_full_response()
+
+    heartbeat = getattr(settings, "GRAPH_EVENTS_HEARTBEAT_SECONDS", 15)
+
+    async def stream():
+        try:
+            for chunk in events.stream_preamble(version):
+                yield chunk
+
+            deadline = loop.time() + timeout
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                message = await subscription.get_async(
+                    min(heartbeat, remaining))
+                if message is None:
+                    yield b": keepalive\n\n"
+                else:
+                    yield message
+        finally:
+            subscription.close()
+
+    response = event_stream_response(())
+    response.async_content = stream()
+    return response
+
+
+# URL の名前 => 非同期のビュー
+ASYNC_VIEWS = {
+    "graph:concern-detail-json": concern_detail_json,
+    "graph:concern-index-json": concern_index_json,
+    "graph:concern-events": concern_events,
+}
+
+
+# # # # # ASGI # # # # #
+
+def build_environ(scope, body):
+    """ASGI の scope から WSGI の environ を作成する"""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("127.0.0.1", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        # WSGI では UTF-8 のバイト列を latin-1 で表す
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+
+    return environ
+
+
+def response_headers(response):
+    """レスポンスのヘッダー ( Cookie を含む ) を ASGI の形式で"""
+    headers = [
+        (name.encode("latin-1"), value.encode("latin-1"))
+        for name, value in response.items()
+    ]
+    for cookie in response.cookies.values():
+        headers.append(
+            (b"Set-Cookie", cookie.output(header="").strip().encode()))
+    return headers
+
+
+class ASGIHandler(object):
+    """ASGI ( version 3 ) のアプリケーション"""
+
+    def __init__(self):
+        # ミドルウェアを読み込んだ Django のハンドラー
+        self.handler = WSGIHandler()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported scope type: %s" % scope["type"])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                shutdown_executor()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+
+        environ = build_environ(scope, body)
+
+        view, kwargs = self.async_view(scope["path"])
+        if view is None or scope["method"] not in ("GET", "HEAD"):
+            response = await run_sync(self.get_response, environ)
+        else:
+            request = WSGIRequest(environ)
+            try:
+                response = await view(request, **kwargs)
+            except Exception as e:
+                response = await run_sync(response_for_exception, request, e)
+
+        await self.send_response(response, send, receive)
+
+    def async_view(self, path):
+        """非同期のビューと URL のキーワード引数 ( なければ None )"""
+        try:
+            match = resolve(path)
+        except Resolver404:
+            return None, None
+        return ASYNC_VIEWS.get(match.view_name), match.kwargs
+
+    def get_response(self, environ):
+        """WSGIHandler.__call__() と同じ ( スレッドプールで呼び出す )"""
+        set_script_prefix(get_script_name(environ))
+        signals.request_started.send(sender=self.__class__, environ=environ)
+        request = WSGIRequest(environ)
+        return self.handler.get_response(request)
+
+    async def send_response(self, response, send, receive=None):
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": response_headers(response),
+        })
+
+        if getattr(response, "async_content", None) is not None:
+            await self.send_async_content(response, send, receive)
+            return
+
+        if not response.streaming:
+            await send({"type": "http.response.body",
+                "body": response.content})
+            await run_sync(response.close)
+            return
+
+        # 本体の作成中にクエリを発行するので、1 つのスレッドで最後まで送る
+        loop = asyncio.get_event_loop()
+
+        def stream():
+            try:
+                for chunk in response:
+                    asyncio.run_coroutine_threadsafe(send({
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": True,
+                    }), loop).result()
+            finally:
+                response.close()
+
+        await run_sync(stream)
+        await send({"type": "http.response.body", "body": b""})
+
+    async def send_async_content(self, response, send, receive=None):
+        """
+        非同期のイテレーターの本体をイベントループ上で送る
+        クライアントが切断したら ( 次の送信の前に ) 止める
+        """
+        content = response.async_content
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            async for chunk in content:
+                if disconnected.done():
+                    break
+                await send({
+                    "type": "http.response.body",
+                    "body": chunk,
+                    "more_body": True,
+                })
+        finally:
+            closed = disconnected.done()
+            disconnected.cancel()
+            await content.aclose()
+            await run_sync(response.close)
+        if not closed:
+            await send({"type": "http.response.body", "body": b""})
+
+
+async def wait_disconnect(receive):
+    """クライアントの切断 ( http.disconnect ) を待つ"""
+    if receive is None:
+        await asyncio.Event().wait()
+    while (await receive())["type"] != "http.disconnect":
+        pass
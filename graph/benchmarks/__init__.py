@@ -0,0 +1,18 @@
+# graph/benchmarks/__init__.py
+"""
+関心事のグラフの合成データとエンドポイントのベンチマーク
+
+    ・generators .. 形 ( chain / fan / dag / cycle ) と大きさを指定して
+                    インポート用のデータ ( graph/transfer.py ) を作る
+    ・runner     .. 関心事の種類 ( ノードタイプが違う ) ごとに
+                    テストクライアントでエンドポイントを呼び出し、
+                    所要時間の分位点、クエリ数、ピークメモリ、
+                    レスポンスのバイト数を JSON にまとめる
+    ・transports .. 同時リクエストを WSGI と ASGI ( graph/asgi.py ) で
+                    計測して比べる
+
+manage.py benchmark_graphs で実行する ( テスト用のデータベースを使う )
+"""
+from .generators import SHAPES, generate
+from .runner import CONCERN_TYPES, run_benchmarks
+from .transports import run_transport_benchmarks
@@ -0,0 +1,82 @@
+# graph/benchmarks/generators.py
+"""
+合成グラフ ( graph/transfer.py の JSON 形式の辞書 ) を作る
+ノード 0 はルートに直接接続する
+"""
+import random
+
+from ..models import Concern, Node
+
+
+def chain(n, rng):
+    """深い一直線 ( i => i - 1 )"""
+    return [(i, i - 1) for i in range(1, n)]
+
+
+def fan(n, rng):
+    """幅の広い扇形 ( 全てのノード => 0 )"""
+    return [(i, 0) for i in range(1, n)]
+
+
+def dag(n, rng, degree=4):
+    """密な DAG ( 各ノードから、それより前の最大 degree 個のノードへ )"""
+    return [
+        (i, j)
+        for i in range(1, n)
+        for j in rng.sample(range(i), min(degree, i))
+    ]
+
+
+def cycle(n, rng):
+    """循環 ( 一直線の末尾から先頭へ戻る接続と、途中の短い循環を含む )"""
+    links = chain(n, rng)
+    if n > 1:
+        links.append((0, n - 1))
+    links += [(i - 2, i) for i in range(2, n, 7)]
+    return links
+
+
+SHAPES = {
+    "chain": chain,
+    "fan": fan,
+    "dag": dag,
+    "cycle": cycle,
+}
+
+
+def node_types_for(concern_type):
+    """関心事の種類で使えるノードタイプ ( NodeFormView.get_form() と同じ )"""
+    if concern_type == Concern.SET_TARGET:
+        return [Node.PLAN, Node.DONE]
+    return [Node.NORMAL, Node.REVERSE]
+
+
+def generate(shape, n, concern_type=Concern.ANALYZE, mixed=True, seed=0):
+    """
+    shape の形で n 個のノードのグラフを作る
+    mixed が True ならノードタイプを混ぜる
+    """
+    rng = random.Random(seed)
+    types = node_types_for(concern_type)
+
+    nodes = [
+        {
+            "id": i,
+            "content": "%s %d" % (shape, i),
+            "node_type": rng.choice(types) if mixed else types[0],
+            "to_root": i == 0,
+        } for i in range(n)
+    ]
+    links = [
+        {"source": source, "target": target}
+        for source, target in SHAPES[shape](n, rng)
+    ]
+
+    return {
+        "concern": {
+            "content": "%s %d" % (shape, n),
+            "concern_type": concern_type,
+        },
+        "nodes": nodes,
+        "links": links,
+    }
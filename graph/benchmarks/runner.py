@@ -0,0 +1,191 @@
+# graph/benchmarks/runner.py
+"""
+エンドポイントをテストクライアントで呼び出して計測する
+
+    ・latency_ms        .. 所要時間の分位点 ( repeat 回 )
+    ・queries           .. クエリ数
+    ・peak_memory_bytes .. tracemalloc で測ったピークメモリ
+    ・payload_bytes     .. レスポンスの本体のバイト数
+
+クエリ数とメモリは、所要時間に影響しないように別の 1 回で測る
+"""
+import datetime
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from .. import transfer
+from ..adjacency import graphs as adjacency_graphs
+from ..cache import get_graph_cache
+from ..instrumentation import QueryRecorder
+from ..models import Concern, Node
+from .generators import generate, node_types_for
+
+
+# 計測する関心事の種類 ( 種類ごとに使えるノードタイプが違う )
+CONCERN_TYPES = [concern_type for concern_type, label in Concern.NODE_TYPES]
+
+
+def clear_caches():
+    """グラフのキャッシュを空にする ( キャッシュなしの状態を測る )"""
+    get_graph_cache().clear()
+    adjacency_graphs.clear()
+
+
+def endpoints(concern, root_node):
+    """
+    計測するエンドポイント
+    ( 名前, メソッド, URL, データ, 毎回の前処理 ) のリスト
+    ※ノードの作成は関心事の種類で使えるノードタイプで送る
+    """
+    c = concern.id
+    node_type = node_types_for(concern.concern_type)[0]
+    detail = reverse("graph:concern-detail", kwargs={"pk": c})
+    detail_json = reverse("graph:concern-detail-json", kwargs={"pk": c})
+    return [
+        ("concern-detail-json:cold", "get", detail_json, {}, clear_caches),
+        ("concern-detail-json:warm", "get", detail_json, {}, None),
+        ("concern-detail-bin:cold", "get", detail_json, {"format": "bin"},
+            clear_caches),
+        ("concern-detail:cold", "get", detail, {}, clear_caches),
+        ("concern-detail:warm", "get", detail, {}, None),
+        ("node-new", "post",
+            reverse("graph:node-new", kwargs={"concern_id": c}),
+            {"content": "new"}, None),
+        ("node-new-source", "post",
+            reverse("graph:node-new-source",
+                kwargs={"concern_id": c, "target_id": root_node}),
+            {"content": "source", "node_type": node_type}, None),
+        ("node-new-target", "post",
+            reverse("graph:node-new-target",
+                kwargs={"concern_id": c, "source_id": root_node}),
+            {"content": "target"}, None),
+    ]
+
+
+def percentiles(values):
+    """最小/最大/平均と分位点 ( nearest-rank )"""
+    values = sorted(values)
+
+    def rank(p):
+        index = max(0, min(len(values) - 1,
+            int(round(p / 100.0 * len(values) + 0.5)) - 1))
+        return values[index]
+
+    return {
+        "min": values[0],
+        "p50": rank(50),
+        "p90": rank(90),
+        "p99": rank(99),
+        "max": values[-1],
+        "mean": sum(values) / len(values),
+    }
+
+
+def _request(client, method, url, data):
+    """リクエストを送り、( レスポンス, 本体 ) を返す"""
+    response = getattr(client, method)(url, data)
+    if response.streaming:
+        body = b"".join(response.streaming_content)
+    else:
+        body = response.content
+    return response, body
+
+
+def measure(client, method, url, data, before=None, repeat=5):
+    """1 つのエンドポイントを計測する"""
+    latencies = []
+    for _ in range(repeat):
+        if before:
+            before()
+        start = time.perf_counter()
+        _request(client, method, url, data)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        with QueryRecorder() as recorder:
+            response, body = _request(client, method, url, data)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "status": response.status_code,
+        "latency_ms": {name: round(value, 3)
+            for name, value in percentiles(latencies).items()},
+        "queries": len(recorder),
+        "peak_memory_bytes": peak,
+        "payload_bytes": len(body),
+    }
+
+
+def git_revision():
+    """計測したコミット ( git が使えなければ None )"""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=settings.BASE_DIR,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(user, shapes, sizes, concern_types=None, repeat=5,
+    mixed=True, seed=0):
+    """
+    関心事の種類、形と大きさごとに関心事を作り、各エンドポイントを計測する
+    ( concern_types を省略すると全ての種類 )
+    戻り値は JSON に変換できる辞書
+    """
+    if concern_types is None:
+        concern_types = CONCERN_TYPES
+
+    client = Client()
+    client.force_login(user)
+
+    results = []
+    for concern_type in concern_types:
+        for shape in shapes:
+            for size in sizes:
+                data = generate(shape, size, concern_type=concern_type,
+                    mixed=mixed, seed=seed)
+                concern, timings = transfer.import_graph(user, data)
+                root_node = Node.objects.filter(
+                    concern=concern).order_by("id").values_list(
+                    "id", flat=True)[0]
+
+                for name, method, url, params, before in endpoints(
+                    concern, root_node):
+                    result = measure(client, method, url, params,
+                        before=before, repeat=repeat)
+                    result.update({
+                        "concern_type": concern_type,
+                        "shape": shape,
+                        "nodes": size,
+                        "links": len(data["links"]),
+                        "endpoint": name,
+                    })
+                    results.append(result)
+
+    return {
+        "meta": {
+            "revision": git_revision(),
+            "created_at": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "repeat": repeat,
+            "mixed_node_types": mixed,
+            "seed": seed,
+        },
+        "results": results,
+    }
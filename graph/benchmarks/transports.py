@@ -0,0 +1,182 @@
+# graph/benchmarks/transports.py
+"""
+WSGI と ASGI ( graph/asgi.py ) の比較
+
+同じ URL に concurrency 件ずつ同時にリクエストを送り、
+所要時間の分位点とスループットを測る
+    ・wsgi .. concurrency 個のスレッドから WSGIHandler を呼び出す
+              ( 1 スレッドが 1 リクエストを処理するワーカーに相当 )
+    ・asgi .. 1 つのイベントループから ASGIHandler を呼び出す
+              ( ORM は GRAPH_ASYNC_WORKERS 個のスレッドで実行する )
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.test import Client
+from django.urls import reverse
+
+from .. import transfer
+from ..asgi import ASGIHandler, build_environ, shutdown_executor
+from .generators import generate
+from .runner import clear_caches, percentiles
+
+
+def make_scope(method, path, query_string=b"", headers=()):
+    """ASGI の HTTP の scope"""
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query_string,
+        "headers": list(headers),
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 0),
+    }
+
+
+async def asgi_request(app, method, path, query_string=b"", headers=(),
+    body=b""):
+    """ASGI のアプリケーションを呼び出し、( 状態, ヘッダー, 本体 ) を返す"""
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(make_scope(method, path, query_string, headers), receive, send)
+
+    start = sent[0]
+    headers = [(name.decode("latin-1"), value.decode("latin-1"))
+        for name, value in start["headers"]]
+    content = b"".join(message.get("body", b"") for message in sent[1:])
+    return start["status"], headers, content
+
+
+def wsgi_request(handler, method, path, query_string=b"", headers=()):
+    """WSGIHandler を呼び出し、( 状態, ヘッダー, 本体 ) を返す"""
+    environ = build_environ(
+        make_scope(method, path, query_string, headers), b"")
+    status = []
+
+    def start_response(status_line, response_headers, exc_info=None):
+        status.append((int(status_line.split()[0]), response_headers))
+
+    response = handler(environ, start_response)
+    try:
+        content = b"".join(response)
+    finally:
+        response.close()
+    return status[0][0], status[0][1], content
+
+
+def _summary(latencies, elapsed):
+    return {
+        "latency_ms": {name: round(value * 1000, 3)
+            for name, value in percentiles(latencies).items()},
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+    }
+
+
+def run_wsgi(path, headers, concurrency, requests):
+    handler = WSGIHandler()
+
+    def call(_):
+        start = time.perf_counter()
+        status, _, _ = wsgi_request(handler, "GET", path, headers=headers)
+        assert status == 200, status
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(call, range(requests)))
+    return _summary(latencies, time.perf_counter() - start)
+
+
+def run_asgi(path, headers, concurrency, requests):
+    app = ASGIHandler()
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call():
+            async with semaphore:
+                start = time.perf_counter()
+                status, _, _ = await asgi_request(app, "GET", path,
+                    headers=headers)
+                assert status == 200, status
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*[call() for _ in range(requests)])
+
+    loop = asyncio.new_event_loop()
+    try:
+        start = time.perf_counter()
+        latencies = loop.run_until_complete(main())
+        elapsed = time.perf_counter() - start
+    finally:
+        loop.close()
+        shutdown_executor()
+    return _summary(latencies, elapsed)
+
+
+def compare_transports(path, headers=(), concurrency=8, requests=64,
+    before=None):
+    """
+    WSGI と ASGI で同じ URL を計測する
+    before .. それぞれの計測の前に呼び出す ( キャッシュを空にするなど )
+    """
+    results = {}
+    for name, run in (("wsgi", run_wsgi), ("asgi", run_asgi)):
+        if before:
+            before()
+        results[name] = run(path, headers, concurrency, requests)
+        results[name]["concurrency"] = concurrency
+        results[name]["requests"] = requests
+    return results
+
+
+def run_transport_benchmarks(user, shapes, sizes, concurrency=8,
+    requests=64, mixed=True, seed=0):
+    """
+    形と大きさごとに関心事を作り、concern-detail-json を
+    WSGI と ASGI で計測する ( キャッシュを空にしてから始める )
+    """
+    client = Client()
+    client.force_login(user)
+    cookie = "%s=%s" % (settings.SESSION_COOKIE_NAME,
+        client.cookies[settings.SESSION_COOKIE_NAME].value)
+    headers = [(b"cookie", cookie.encode())]
+
+    results = []
+    for shape in shapes:
+        for size in sizes:
+            data = generate(shape, size, mixed=mixed, seed=seed)
+            concern, timings = transfer.import_graph(user, data)
+            path = reverse("graph:concern-detail-json",
+                kwargs={"pk": concern.id})
+            compared = compare_transports(path, headers,
+                concurrency=concurrency, requests=requests,
+                before=clear_caches)
+            for transport, result in compared.items():
+                result.update({
+                    "shape": shape,
+                    "nodes": size,
+                    "links": len(data["links"]),
+                    "endpoint": "concern-detail-json",
+                    "transport": transport,
+                })
+                results.append(result)
+
+    return results
@@ -0,0 +1,147 @@
+# graph/binary.py
+"""
+concern_detail_json のバイナリ形式 ( 列指向 )
+
+JSON では接続ごとに source / target / node_type のキーを繰り返すため、
+大きな関心事では転送と解析の時間の大半を占める
+Accept: application/vnd.mindgraph.graph ( または ?format=bin ) の場合は
+次の形式で返す ( 全てリトルエンディアン、各区画は 4 バイト境界に揃える )
+
+    ヘッダー ( 24 バイト )
+        magic ( b"MGRF" ), 形式のバージョン ( u16 ), flags ( u16 ),
+        グラフのバージョン ( u32 ), ノード数 N ( u32、ルートを含む ),
+        接続数 M ( u32 ), 文字列表のバイト数 ( u32 )
+    nid         .. Uint32[N]   ( ルートは 0 )
+    node_type   .. Uint8[N]
+    offsets     .. Uint32[N + 1] ( 文字列表での content の位置 )
+    strings     .. UTF-8 ( content を連結したもの )
+    sources     .. Uint32[M]   ( D3.js 用の ID、ルートは 0 )
+    targets     .. Uint32[M]
+    x, y        .. Float32[N] ずつ ( flags & FLAG_LAYOUT の場合 )
+
+・0 番目のノードがルート ( 関心事の内容 ) で、ノードの ID は並び順
+・接続の node_type は接続元の node_type ( ルートへの接続は 0 )
+・ノードごとの指標 ( graph/analytics.py ) は含まない
+  ( 必要なら analytics.json を使う )
+デコーダーは force.js ( decodeGraph() ) と decode_graph()
+"""
+import struct
+import sys
+from array import array
+
+
+MEDIA_TYPE = "application/vnd.mindgraph.graph"
+
+MAGIC = b"MGRF"
+FORMAT_VERSION = 1
+
+# ノードの座標を含む
+FLAG_LAYOUT = 1
+
+HEADER = struct.Struct("<4sHHIIII")
+
+
+def accepts_binary(request):
+    """バイナリ形式を要求されているかどうか"""
+    if request.GET.get("format") == "bin":
+        return True
+    accept = request.META.get("HTTP_ACCEPT", "")
+    for media_range in accept.split(","):
+        media_type, _, params = media_range.partition(";")
+        if media_type.strip() == MEDIA_TYPE and \
+            "q=0" not in params.replace(" ", "").split(";"):
+            return True
+    return False
+
+
+def _le(typecode, values):
+    """リトルエンディアンのバイト列"""
+    a = array(typecode, values)
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a.tobytes()
+
+
+def _pad(data):
+    """4 バイト境界に揃える"""
+    return data + b"\0" * (-len(data) % 4)
+
+
+def encode_graph(payload):
+    """
+    concern_detail_json のペイロード ( graph/adjacency.py の
+    to_payload()、座標は graph/layout.py ) をバイナリ形式に変換する
+    """
+    nodes = payload["nodes"]
+    links = payload["links"]
+
+    contents = [node["content"].encode("utf-8") for node in nodes]
+    offsets = [0]
+    for content in contents:
+        offsets.append(offsets[-1] + len(content))
+    strings = b"".join(contents)
+
+    layout = bool(nodes) and all("x" in node for node in nodes)
+    flags = FLAG_LAYOUT if layout else 0
+
+    sections = [
+        HEADER.pack(MAGIC, FORMAT_VERSION, flags,
+            payload.get("version", 0), len(nodes), len(links),
+            len(strings)),
+        _le("I", (node.get("nid", 0) for node in nodes)),
+        _pad(bytes(node["node_type"] for node in nodes)),
+        _le("I", offsets),
+        _pad(strings),
+        _le("I", (link["source"] for link in links)),
+        _le("I", (link["target"] for link in links)),
+    ]
+    if layout:
+        sections.append(_le("f", (node["x"] for node in nodes)))
+        sections.append(_le("f", (node["y"] for node in nodes)))
+
+    return b"".join(sections)
+
+
+def _read(typecode, data, offset, count):
+    a = array(typecode)
+    end = offset + a.itemsize * count
+    a.frombytes(data[offset:end])
+    if sys.byteorder == "big":
+        a.byteswap()
+    return a, end
+
+
+def decode_graph(data):
+    """
+    バイナリ形式を列 ( 配列 ) の辞書に変換する
+    ( force.js の decodeGraph() と同じ、テストと確認用 )
+    """
+    magic, format_version, flags, version, n, m, strings_size = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise ValueError("Not a graph payload (version %d)" % FORMAT_VERSION)
+
+    offset = HEADER.size
+    nids, offset = _read("I", data, offset, n)
+    node_types, offset = _read("B", data, offset, n)
+    offset += -offset % 4
+    offsets, offset = _read("I", data, offset, n + 1)
+    strings = data[offset:offset + strings_size]
+    offset += strings_size + (-strings_size % 4)
+    sources, offset = _read("I", data, offset, m)
+    targets, offset = _read("I", data, offset, m)
+
+    columns = {
+        "version": version,
+        "nid": nids,
+        "node_type": node_types,
+        "content": [strings[offsets[i]:offsets[i + 1]].decode("utf-8")
+            for i in range(n)],
+        "source": sources,
+        "target": targets,
+    }
+    if flags & FLAG_LAYOUT:
+        columns["x"], offset = _read("f", data, offset, n)
+        columns["y"], offset = _read("f", data, offset, n)
+
+    return columns
@@ -0,0 +1,143 @@
+# graph/cache.py
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Concern
+
+
+def get_graph_cache():
+    """
+    グラフ用のキャッシュを取得する
+    settings.GRAPH_CACHE_ALIAS で任意のバックエンドに差し替えられる
+    ( LocMemCache の場合は MAX_ENTRIES を超えると LRU で破棄される )
+    """
+    alias = getattr(settings, "GRAPH_CACHE_ALIAS", "default")
+    return caches[alias]
+
+
+def get_graph_version(concern_id):
+    """関心事のグラフのバージョンを取得する ( 存在しなければ None )"""
+    versions = Concern.objects.filter(
+        pk=concern_id
+    ).values_list("graph_version", flat=True)
+    for version in versions:
+        return version
+    return None
+
+
+def graph_etag(concern_id, version, variant="json", weak=False):
+    """
+    グラフのバージョンに対応する ETag
+    weak .. 弱い ETag にする ( 座標 ( graph/layout.py ) を付ける場合、
+            座標は直前のレイアウトから計算するので、同じバージョンでも
+            プロセスによってバイト列が変わりうる )
+    """
+    etag = '"concern-%d-v%d-%s"' % (concern_id, version, variant)
+    return "W/" + etag if weak else etag
+
+
+def graph_cache_key(concern_id, version, variant="json"):
+    """キャッシュのキー"""
+    return "graph:%d:%d:%s" % (concern_id, version, variant)
+
+
+def etag_matches(request, etag):
+    """
+    If-None-Match ヘッダーと ETag が一致するかどうか
+    ( 弱い比較、W/ の有無は問わない )
+    """
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+
+    def opaque(tag):
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return opaque(etag) in [opaque(tag) for tag in header.split(",")]
+
+
+class GraphCacheStats(object):
+    """
+    キャッシュのヒット/ミス/破棄の回数 ( プロセスごと )
+    破棄 .. このプロセスで set() したキーなのにミスした回数
+    """
+
+    # 破棄の検出用に覚えておくキーの数
+    max_tracked_keys = 4096
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stored = OrderedDict()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self._stored.clear()
+
+    def hit(self, key):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self, key):
+        with self._lock:
+            self.misses += 1
+            if self._stored.pop(key, None) is not None:
+                self.evictions += 1
+
+    def stored(self, key):
+        with self._lock:
+            self._stored[key] = True
+            self._stored.move_to_end(key)
+            while len(self._stored) > self.max_tracked_keys:
+                self._stored.popitem(last=False)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+stats = GraphCacheStats()
+
+
+def lookup_graph(concern_id, version, variant="json"):
+    """グラフのバージョンに対応するキャッシュ ( なければ None )"""
+    key = graph_cache_key(concern_id, version, variant)
+    content = get_graph_cache().get(key)
+    if content is not None:
+        stats.hit(key)
+    else:
+        stats.miss(key)
+    return content
+
+
+def store_graph(concern_id, version, content, variant="json"):
+    """グラフのバージョンに対応するキャッシュを保存する"""
+    key = graph_cache_key(concern_id, version, variant)
+    get_graph_cache().set(key, content)
+    stats.stored(key)
+
+
+def get_cached_graph(concern_id, version, build, variant="json"):
+    """
+    グラフのバージョンに対応するキャッシュを取得する
+    キャッシュがなければ build() で作成して保存する
+    """
+    content = lookup_graph(concern_id, version, variant)
+    if content is None:
+        content = build()
+        store_graph(concern_id, version, content, variant)
+
+    return content
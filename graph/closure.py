@@ -0,0 +1,266 @@
+# graph/closure.py
+"""
+ノード間の到達可能性 ( NodeClosure ) を管理する
+
+GRAPH_CLOSURE が True の場合のみ更新する ( 既定では更新しない )
+接続の追加は差分だけを挿入し、接続/ノードの削除は影響を受ける
+ノード ( 末端側 ) の行だけを作り直す
+( 影響を受けるノードが GRAPH_CLOSURE_MAX_REBUILD より多ければ、
+  コミット後にバックグラウンドのスレッドで作り直す )
+全体の作り直しは manage.py rebuild_closure で行う
+"""
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count
+
+from .models import NodeClosure
+from .adjacency import load_concern_graph
+
+
+# まとめて挿入する行数 ( 作り直しの際のメモリ使用量の上限 )
+BATCH_SIZE = 5000
+
+logger = logging.getLogger("graph.closure")
+
+
+def closure_enabled():
+    """到達可能性の表を更新するかどうか"""
+    return getattr(settings, "GRAPH_CLOSURE", False)
+
+
+def max_rebuild():
+    """リクエストの中で行を作り直すノードの数の上限"""
+    return getattr(settings, "GRAPH_CLOSURE_MAX_REBUILD", 200)
+
+
+def insert_rows(rows):
+    """
+    (concern_id, ancestor_id, descendant_id, depth) の行を挿入する
+    ※SQLite の bulk_create() は変数の数の上限で細かく分割される
+    ( 約 250 行ごとに 1 クエリ ) ため、executemany() で挿入する
+    """
+    fields = [NodeClosure._meta.get_field(name) for name in (
+        "concern", "ancestor", "descendant", "depth")]
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(NodeClosure._meta.db_table),
+        ", ".join(qn(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def update_depths(updates):
+    """( depth, id ) の組で既存の行の depth を更新する"""
+    qn = connection.ops.quote_name
+    sql = "UPDATE %s SET %s = %%s WHERE %s = %%s" % (
+        qn(NodeClosure._meta.db_table),
+        qn(NodeClosure._meta.get_field("depth").column),
+        qn(NodeClosure._meta.pk.column),
+    )
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(updates), BATCH_SIZE):
+            cursor.executemany(sql, updates[start:start + BATCH_SIZE])
+
+
+def add_node(node):
+    """ノードの追加時 ( 自分自身への行を追加する )"""
+    NodeClosure.objects.get_or_create(
+        ancestor_id=node.id,
+        descendant_id=node.id,
+        defaults={"concern_id": node.concern_id, "depth": 0},
+    )
+
+
+def add_edges(concern_id, edges):
+    """
+    接続 ( 接続元 ID, 接続先 ID ) の追加時
+    接続元より末端側のノードから、接続先よりルート側のノードへの行を
+    追加する ( 既にあれば短い方の depth にする )
+    """
+    with transaction.atomic():
+        for source, target in edges:
+
+            # 接続元に届くノード ( 末端側 ) と、接続先から届くノード
+            down = dict(NodeClosure.objects.filter(
+                ancestor_id=source
+            ).values_list("descendant_id", "depth"))
+            down[source] = 0
+            up = dict(NodeClosure.objects.filter(
+                descendant_id=target
+            ).values_list("ancestor_id", "depth"))
+            up[target] = 0
+
+            candidates = {}
+            for d, down_depth in down.items():
+                for a, up_depth in up.items():
+                    if a != d:
+                        candidates[(a, d)] = down_depth + 1 + up_depth
+
+            # 既存の行と比べる ( 短くなる行はまとめて更新する )
+            existing = NodeClosure.objects.filter(
+                ancestor_id__in=up,
+                descendant_id__in=down,
+            ).values_list("id", "ancestor_id", "descendant_id", "depth")
+            updates = []
+            for pk, a, d, depth in existing:
+                new_depth = candidates.pop((a, d), None)
+                if new_depth is not None and new_depth < depth:
+                    updates.append((new_depth, pk))
+            update_depths(updates)
+
+            insert_rows([
+                (concern_id, a, d, depth)
+                for (a, d), depth in candidates.items()
+            ])
+
+
+def descendants_of(node_ids):
+    """( 現在の表で ) ノードに届くノードの ID ( 自分自身を含む )"""
+    return set(NodeClosure.objects.filter(
+        ancestor_id__in=node_ids
+    ).values_list("descendant_id", flat=True)) | set(node_ids)
+
+
+def rebuild_closure(concern_id, node_ids=None):
+    """
+    到達可能性の表を作り直す
+    node_ids を指定した場合は、そのノードから届く行だけを作り直す
+    戻り値は作成した行数
+    """
+    graph = load_concern_graph(concern_id, None)
+
+    if node_ids is None:
+        starts = range(len(graph))
+    else:
+        starts = [graph.index_of(nid) for nid in node_ids]
+        starts = [i for i in starts if i is not None]
+
+    with transaction.atomic():
+        rows = NodeClosure.objects.filter(concern_id=concern_id)
+        if node_ids is not None:
+            rows = rows.filter(descendant_id__in=node_ids)
+        rows.delete()
+
+        batch = []
+        count = 0
+        for start in starts:
+
+            # 接続先を幅優先でたどる ( 最短の深さ )
+            depths = {start: 0}
+            queue = deque([start])
+            while queue:
+                i = queue.popleft()
+                for j in graph.targets_of(i):
+                    if j not in depths:
+                        depths[j] = depths[i] + 1
+                        queue.append(j)
+
+            descendant = graph.node_ids[start]
+            for i, depth in depths.items():
+                batch.append((concern_id, graph.node_ids[i], descendant,
+                    depth))
+
+            if len(batch) >= BATCH_SIZE:
+                insert_rows(batch)
+                count += len(batch)
+                batch = []
+
+        insert_rows(batch)
+        count += len(batch)
+
+    return count
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    作り直しを行うスレッド ( プロセスごとに 1 つ )
+    ※1 つのスレッドで順に行うので、同じ関心事の作り直しが重ならない
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1,
+                thread_name_prefix="graph-closure")
+        return _executor
+
+
+def _rebuild_in_background(concern_id, node_ids):
+    try:
+        rebuild_closure(concern_id, node_ids)
+    except Exception:
+        logger.exception("closure rebuild failed for concern %d "
+            "(run manage.py rebuild_closure %d)", concern_id, concern_id)
+    finally:
+        # スレッドの接続を閉じる
+        connection.close()
+
+
+def schedule_rebuild(concern_id, node_ids=None):
+    """
+    コミット後にバックグラウンドのスレッドで行を作り直す
+    ( 作り直すまでの間は古い行が残る。プロセスが終了した場合などは
+      manage.py rebuild_closure で作り直す )
+    """
+    if node_ids is not None:
+        node_ids = set(node_ids)
+    transaction.on_commit(lambda: get_executor().submit(
+        _rebuild_in_background, concern_id, node_ids))
+
+
+def rebuild_affected(concern_id, node_ids):
+    """
+    接続/ノードの削除時に、影響を受けるノードの行を作り直す
+    max_rebuild() 件までならその場で、それより多ければコミット後に作り直す
+    ( 作り直しは関心事のグラフ全体を読み、ノードごとに幅優先でたどるため )
+    """
+    if len(node_ids) <= max_rebuild():
+        rebuild_closure(concern_id, node_ids)
+    else:
+        schedule_rebuild(concern_id, node_ids)
+
+
+def is_reachable(descendant_id, ancestor_id):
+    """descendant から接続先をたどって ancestor に届くかどうか"""
+    return NodeClosure.objects.filter(
+        descendant_id=descendant_id,
+        ancestor_id=ancestor_id,
+    ).exists()
+
+
+def reachable_pairs(concern_id, pairs):
+    """
+    (descendant, ancestor) の組ごとに届くかどうかを返す
+    ( 1 回のクエリでまとめて調べる )
+    """
+    pairs = list(pairs)
+    found = set(NodeClosure.objects.filter(
+        concern_id=concern_id,
+        descendant_id__in=set(d for d, a in pairs),
+        ancestor_id__in=set(a for d, a in pairs),
+    ).values_list("descendant_id", "ancestor_id"))
+    return [pair in found for pair in pairs]
+
+
+def subtree_sizes(concern_id):
+    """ノードごとの、そのノードに届くノードの数 ( 自分自身を除く )"""
+    rows = NodeClosure.objects.filter(
+        concern_id=concern_id,
+        depth__gt=0,
+    ).values("ancestor_id").annotate(
+        size=Count("descendant_id")
+    ).values_list("ancestor_id", "size")
+    return dict(rows)
@@ -0,0 +1,153 @@
+# graph/counters.py
+"""
+関心事ごとの集計 ( 関心事の一覧で表示する )
+
+    ・Concern.node_count / link_count / plan_count / done_count と
+      last_activity_at に非正規化して持つ
+    ・ノードと接続の書き込み ( graph/signals.py ) では、グラフの
+      バージョンを増やす UPDATE ( bump_graph_version() ) と同じ文で
+      増減するので、クエリは増えず、書き込みと同じトランザクションになる
+    ・シグナルを通らない書き込み ( 生の SQL など ) でずれた場合は
+      manage.py reconcile_counters で数え直す ( reconcile() )
+
+接続の数は接続元のノードが属する関心事で数える
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q
+from django.utils import timezone
+
+from .models import Concern, Node
+
+
+# 集計のフィールド
+COUNTERS = ("node_count", "link_count", "plan_count", "done_count")
+
+
+def node_deltas(node_type, sign=1):
+    """ノード 1 件の作成 ( sign=-1 なら削除 ) による増減"""
+    deltas = {"node_count": sign}
+    if node_type == Node.PLAN:
+        deltas["plan_count"] = sign
+    elif node_type == Node.DONE:
+        deltas["done_count"] = sign
+    return deltas
+
+
+def type_change_deltas(old_type, new_type):
+    """ノードタイプの変更による増減"""
+    deltas = {}
+    for name, count in node_deltas(old_type, -1).items():
+        deltas[name] = deltas.get(name, 0) + count
+    for name, count in node_deltas(new_type, 1).items():
+        deltas[name] = deltas.get(name, 0) + count
+    return {name: count for name, count in deltas.items() if count}
+
+
+def counter_updates(deltas=None):
+    """
+    QuerySet.update() に渡す値
+    ( 増減は F() で、最終更新日時は現在の日時 )
+    """
+    updates = {"last_activity_at": timezone.now()}
+    for name, count in (deltas or {}).items():
+        if name not in COUNTERS:
+            raise ValueError("Unknown counter: %s" % name)
+        if count:
+            updates[name] = F(name) + count
+    return updates
+
+
+def count_concerns(concern_ids):
+    """
+    関心事ごとの実際の値を数える ( 関心事の ID => 値の辞書 )
+    ノード一覧と中間テーブルを 1 回ずつ集計する
+    """
+    actual = {
+        concern_id: {
+            "node_count": 0,
+            "link_count": 0,
+            "plan_count": 0,
+            "done_count": 0,
+            "last_activity_at": None,
+        } for concern_id in concern_ids
+    }
+
+    nodes = Node.objects.filter(
+        concern_id__in=concern_ids
+    ).values("concern_id").annotate(
+        nodes=Count("id"),
+        plans=Count("id", filter=Q(node_type=Node.PLAN)),
+        dones=Count("id", filter=Q(node_type=Node.DONE)),
+        last=Max("updated_at"),
+    ).order_by()
+    for row in nodes:
+        actual[row["concern_id"]].update({
+            "node_count": row["nodes"],
+            "plan_count": row["plans"],
+            "done_count": row["dones"],
+            "last_activity_at": row["last"],
+        })
+
+    links = Node.targets.through.objects.filter(
+        from_node__concern_id__in=concern_ids
+    ).values("from_node__concern_id").annotate(
+        links=Count("id")
+    ).order_by()
+    for row in links:
+        actual[row["from_node__concern_id"]]["link_count"] = row["links"]
+
+    return actual
+
+
+def batch_size():
+    """数え直す関心事の件数 ( 1 トランザクションあたり )"""
+    return getattr(settings, "GRAPH_COUNTERS_BATCH_SIZE", 500)
+
+
+def reconcile(concern_ids=None, size=None, dry_run=False):
+    """
+    集計を数え直し、ずれている関心事を直す
+    size 件ずつ、行をロックしてから数える ( 数えている間の書き込みを待たせる )
+    戻り値は ( 関心事の ID, {フィールド: ( 保存されていた値, 実際の値 )} ) の
+    リスト
+    ※最終更新日時はノードの更新日時より古い場合だけ直す
+      ( 削除の日時はノードに残らないため )
+    """
+    size = size or batch_size()
+    if concern_ids is None:
+        concern_ids = Concern.objects.order_by("id").values_list(
+            "id", flat=True)
+    concern_ids = list(concern_ids)
+
+    drifted = []
+    for start in range(0, len(concern_ids), size):
+        batch = concern_ids[start:start + size]
+        with transaction.atomic():
+            stored = Concern.objects.select_for_update().filter(
+                id__in=batch
+            ).order_by("id").values("id", "last_activity_at", *COUNTERS)
+            stored = list(stored)
+            actual = count_concerns([row["id"] for row in stored])
+
+            for row in stored:
+                values = actual[row["id"]]
+                changes = {
+                    name: (row[name], values[name])
+                    for name in COUNTERS if row[name] != values[name]
+                }
+                last = values["last_activity_at"]
+                if last is not None and (row["last_activity_at"] is None or
+                    row["last_activity_at"] < last):
+                    changes["last_activity_at"] = (
+                        row["last_activity_at"], last)
+                if not changes:
+                    continue
+
+                drifted.append((row["id"], changes))
+                if not dry_run:
+                    Concern.objects.filter(pk=row["id"]).update(**{
+                        name: value for name, (old, value) in changes.items()
+                    })
+
+    return drifted
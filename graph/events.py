@@ -0,0 +1,205 @@
+# graph/events.py
+"""
+開いている関心事のページへのグラフの変更の通知 ( Server-Sent Events )
+
+    ・ノードの保存/削除と Node.targets の変更 ( graph/signals.py ) を
+      トランザクションのコミット後に broker に送る
+    ・broker ( LocalBroker ) は同じプロセスの hub に渡すだけの代用品
+      ( 複数のプロセスで配信する場合は Redis の pub/sub などに差し替え、
+        受け取った通知を hub.deliver() に渡す )
+    ・hub は関心事ごとの購読者に配る
+      購読者ごとのキューは GRAPH_EVENTS_QUEUE_SIZE 件まで
+      ( 溢れた場合は捨てて resync を送る、クライアントは差分を取得し直す )
+
+通知の内容は concern_delta_json と同じ形式の差分 ( since → version ) で、
+作成にクエリは発行しない ( 待っているだけの閲覧者のクエリは 0 回 )
+※ASGI ( graph/asgi.py ) ではイベントループ上で待つ ( get_async() )
+  ストリームごとにスレッドを占有しない
+"""
+import asyncio
+import json
+import queue
+import threading
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+
+class HubFull(Exception):
+    """購読者の数が上限 ( GRAPH_EVENTS_MAX_SUBSCRIBERS ) に達している"""
+
+
+def events_enabled():
+    """変更を通知するかどうか"""
+    return getattr(settings, "GRAPH_EVENTS", True)
+
+
+def format_event(event, data):
+    """Server-Sent Events の 1 件分 ( バイト列 )"""
+    lines = ["event: %s" % event]
+    payload = json.dumps(data, cls=DjangoJSONEncoder)
+    lines += ["data: %s" % line for line in payload.splitlines()]
+    return ("\n".join(lines) + "\n\n").encode()
+
+
+def stream_preamble(version):
+    """ストリームの最初に送るもの ( 再接続の間隔と現在のバージョン )"""
+    return [b"retry: 3000\n\n", format_event("hello", {"version": version})]
+
+
+class Subscription(object):
+    """
+    1 人の閲覧者 ( 1 本のストリーム ) の購読
+    loop .. get_async() で待つイベントループ ( スレッドで待つなら None )
+    """
+
+    def __init__(self, hub, concern_id, size, loop=None):
+        self.hub = hub
+        self.concern_id = concern_id
+        self._queue = queue.Queue(maxsize=size)
+        self._loop = loop
+        self._ready = asyncio.Event() if loop is not None else None
+
+    def put(self, message):
+        """通知を追加する ( 溢れた場合は全て捨てて resync だけを残す )"""
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._queue.put_nowait(format_event("resync", {}))
+        self._wake()
+
+    def _wake(self):
+        """get_async() で待っているイベントループに知らせる"""
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass    # イベントループが既に閉じている
+
+    def get(self, timeout):
+        """次の通知 ( timeout 秒以内になければ None )"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    async def get_async(self, timeout):
+        """get() のイベントループ版 ( スレッドを使わずに待つ )"""
+        deadline = self._loop.time() + timeout
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            # clear() の前に届いた通知を取りこぼさないようにもう一度見る
+            self._ready.clear()
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub(object):
+    """関心事ごとの購読者に通知を配る ( プロセスごと )"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}    # 関心事の ID => 購読の set
+
+    def subscribe(self, concern_id, loop=None):
+        max_subscribers = getattr(settings,
+            "GRAPH_EVENTS_MAX_SUBSCRIBERS", 1000)
+        size = getattr(settings, "GRAPH_EVENTS_QUEUE_SIZE", 100)
+        with self._lock:
+            if self.count() >= max_subscribers:
+                raise HubFull()
+            subscription = Subscription(self, concern_id, size, loop)
+            self._subscriptions.setdefault(concern_id, set()).add(
+                subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.concern_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.concern_id]
+
+    def count(self, concern_id=None):
+        """購読者の数"""
+        if concern_id is not None:
+            return len(self._subscriptions.get(concern_id, ()))
+        return sum(len(s) for s in self._subscriptions.values())
+
+    def has_subscribers(self, concern_id):
+        return concern_id in self._subscriptions
+
+    def deliver(self, concern_id, message):
+        """関心事の購読者に通知 ( バイト列 ) を配る"""
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(concern_id, ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+class LocalBroker(object):
+    """同じプロセスの hub に渡すだけの broker"""
+
+    def __init__(self, hub):
+        self.hub = hub
+
+    def publish(self, concern_id, message):
+        self.hub.deliver(concern_id, message)
+
+
+hub = EventHub()
+broker = LocalBroker(hub)
+
+
+def publish_delta(concern_id, version, nodes=(), removed_nodes=(),
+    links=(), removed_links=(), content=None):
+    """
+    グラフの変更 ( バージョン version - 1 → version の差分 ) を
+    コミット後に通知する
+    content .. 関心事 ( ルート ) の内容 ( 変わった場合のみ )
+    """
+    if not events_enabled() or version is None:
+        return
+
+    # 購読者がいなければ何もしない ( 他のプロセスは考慮しない )
+    if isinstance(broker, LocalBroker) and \
+        not hub.has_subscribers(concern_id):
+        return
+
+    delta = {
+        "full": False,
+        "since": version - 1,
+        "version": version,
+        "nodes": list(nodes),
+        "removed_nodes": list(removed_nodes),
+        "links": list(links),
+        "removed_links": list(removed_links),
+    }
+    if content is not None:
+        delta["content"] = content
+    message = format_event("delta", delta)
+    transaction.on_commit(lambda: broker.publish(concern_id, message))
@@ -20,6 +20,24 @@ class ConcernForm(forms.ModelForm):
         self.fields["content"].widget.attrs["autofocus"] = ""
 
 
+class TargetSearchWidget(forms.SelectMultiple):
+    """
+    接続先の選択
+    選択済みのノードだけを描画し、それ以外は検索して追加する
+    ( graph/static/js/nodes/target_search.js )
+    """
+
+    template_name = "graph/widgets/target_search.html"
+
+    # 候補を検索する URL ( node_target_candidates_json )
+    search_url = ""
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context["widget"]["search_url"] = self.search_url
+        return context
+
+
 class NodeEditForm(forms.ModelForm):
     """ノードの作成/編集に使用するフォームクラス"""
 
@@ -32,6 +50,9 @@ class NodeEditForm(forms.ModelForm):
             "to_root",
             "node_type",
         )
+        widgets = {
+            "targets": TargetSearchWidget,
+        }
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
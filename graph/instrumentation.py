@@ -0,0 +1,142 @@
+# graph/instrumentation.py
+"""
+リクエストごとに発行されたクエリを記録する
+
+    ・SQL を正規化 ( 値、IN (...) の長さ、空白の違いをなくす ) して
+      同じ形のクエリをまとめる
+    ・同じ形のクエリが何度も発行されていれば N+1 の疑いとする
+    ・ビューごとに回数を集計する ( views )
+
+graph/middleware.py の QueryInstrumentationMiddleware から使う
+( RequestMetricsMiddleware の QueryTimer ( graph/metrics.py ) があれば、
+  そのラッパーから record() を呼ぶ。ラッパーは 1 つだけ )
+テストでは QueryRecorder を直接使う
+"""
+import logging
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger("graph.queries")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)", re.IGNORECASE)
+_VALUES = re.compile(r"\bVALUES (\([^)]*\))(?:, \([^)]*\))*",
+    re.IGNORECASE)
+_UNION_VALUES = re.compile(
+    r"(SELECT (?:\?, )*\?)(?: UNION ALL SELECT (?:\?, )*\?)+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    """SQL の形 ( 値を除いたもの ) を返す"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = sql.replace("%s", "?")
+    sql = _IN_LIST.sub("IN (...)", sql)
+    sql = _VALUES.sub(r"VALUES \1", sql)
+    sql = _UNION_VALUES.sub(r"\1", sql)    # SQLite の bulk_create()
+    return _SPACES.sub(" ", sql).strip()
+
+
+def repeat_threshold():
+    """同じ形のクエリが何回以上なら N+1 の疑いとするか"""
+    return getattr(settings, "GRAPH_QUERY_REPEAT_THRESHOLD", 5)
+
+
+class QueryRecorder(object):
+    """
+    with ブロック内で発行されたクエリを記録する ( 全てのデータベース )
+    queries .. (正規化した SQL, 所要時間 ( 秒 )) のリスト
+    ※with を使わずに他のラッパーから record() を呼んでもよい
+    """
+
+    def __init__(self):
+        self.queries = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record(sql, time.perf_counter() - start)
+
+    def record(self, sql, duration):
+        self.queries.append((normalize_sql(sql), duration))
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        """クエリの所要時間の合計 ( 秒 )"""
+        return sum(duration for sql, duration in self.queries)
+
+    def shapes(self):
+        """SQL の形ごとの回数 ( 多い順 )"""
+        return Counter(sql for sql, duration in self.queries).most_common()
+
+    def repeated(self, threshold=None):
+        """threshold 回以上発行された形 ( N+1 の疑い ) と回数"""
+        threshold = threshold or repeat_threshold()
+        return [(sql, count) for sql, count in self.shapes()
+            if count >= threshold]
+
+
+class ViewQueryStats(object):
+    """ビューごとのクエリの回数の集計 ( プロセスごと )"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = OrderedDict()
+
+    def record(self, view_name, recorder):
+        repeated = recorder.repeated()
+        with self._lock:
+            stats = self._views.setdefault(view_name, {
+                "requests": 0,
+                "queries": 0,
+                "max_queries": 0,
+                "n_plus_one": {},
+            })
+            stats["requests"] += 1
+            stats["queries"] += len(recorder)
+            stats["max_queries"] = max(stats["max_queries"], len(recorder))
+            for sql, count in repeated:
+                stats["n_plus_one"][sql] = max(
+                    stats["n_plus_one"].get(sql, 0), count)
+
+        for sql, count in repeated:
+            logger.warning("possible N+1 in %s (%d times): %s",
+                view_name, count, sql)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                name: dict(stats, n_plus_one=dict(stats["n_plus_one"]))
+                for name, stats in self._views.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+
+views = ViewQueryStats()
@@ -0,0 +1,188 @@
+# graph/layout.py
+"""
+グラフのレイアウト ( ノードの座標 ) をサーバー側で計算する
+
+NumPy でベクトル化した力学モデル ( Fruchterman-Reingold ) を使う
+座標はリンクの長さを 1 とした単位で、原点を中心とする
+( 画面上の座標への変換はクライアント側 ( force.js ) で行う )
+"""
+from django.conf import settings
+
+from .cache import get_graph_cache
+
+try:
+    import numpy as np
+except ImportError:    # NumPy がなければレイアウトは計算しない
+    np = None
+
+
+# 反発力を計算する際の 1 ブロックあたりの要素数 ( メモリ使用量の上限 )
+BLOCK_SIZE = 1 << 20
+
+# これより多いノードでは、反発力をランダムに選んだノードとの間で近似する
+MAX_REPULSION_SAMPLES = 400
+
+
+def compute_layout(n, sources, targets, initial=None, iterations=50,
+    seed=0):
+    """
+    ノードの座標を計算する
+
+    n        .. ノード数
+    sources  .. リンクの接続元 ( ノードの番号 ) の配列
+    targets  .. リンクの接続先 ( ノードの番号 ) の配列
+    initial  .. 初期座標 ( n x 2 の配列、不明な座標は NaN )
+    戻り値は n x 2 の配列
+    """
+    rng = np.random.RandomState(seed)
+    sources = np.asarray(sources, dtype=np.intp)
+    targets = np.asarray(targets, dtype=np.intp)
+
+    if n == 0:
+        return np.zeros((0, 2))
+
+    # 初期座標 ( 座標が不明なノードは、座標が分かる隣接ノードの
+    # 重心の近くに置く。それもなければランダムに置く )
+    radius = np.sqrt(n)
+    if initial is None:
+        pos = np.full((n, 2), np.nan)
+    else:
+        pos = np.array(initial, dtype=float)
+    known = ~np.isnan(pos[:, 0])
+    seeded = known.sum()
+
+    if seeded < n:
+        total = np.zeros((n, 2))
+        count = np.zeros(n)
+        for a, b in ((sources, targets), (targets, sources)):
+            ok = known[b]
+            np.add.at(total, a[ok], pos[b[ok]])
+            np.add.at(count, a[ok], 1)
+        fill = ~known & (count > 0)
+        pos[fill] = total[fill] / count[fill, None] + \
+            rng.uniform(-0.5, 0.5, (fill.sum(), 2))
+        rest = np.isnan(pos[:, 0])
+        pos[rest] = rng.uniform(-radius, radius, (rest.sum(), 2))
+
+    # ほとんどのノードの座標が分かっている場合は少しだけ動かす
+    # ( 既存のノードは新しいノードよりさらに動きにくくする )
+    if seeded >= 0.9 * n:
+        iterations = max(1, iterations // 5)
+        temperature = np.where(known, 0.1, 0.5)[:, None]
+    else:
+        temperature = radius * 0.1
+    cooling = temperature / (iterations + 1)
+
+    for _ in range(iterations):
+        disp = _repulsion(pos, rng)
+
+        # 引力 ( リンクの両端を引き寄せる )
+        delta = pos[sources] - pos[targets]
+        distance = np.sqrt((delta ** 2).sum(axis=1))[:, None]
+        force = delta * distance
+        np.add.at(disp, sources, -force)
+        np.add.at(disp, targets, force)
+
+        # 重力 ( 連結していない部分が離れていかないようにする )
+        disp -= 0.05 * pos
+
+        # 移動量を温度で制限する
+        length = np.sqrt((disp ** 2).sum(axis=1))[:, None]
+        length[length == 0] = 1.0
+        pos += disp / length * np.minimum(length, temperature)
+        temperature -= cooling
+
+    return pos - pos.mean(axis=0)
+
+
+def _repulsion(pos, rng):
+    """全ノード間の反発力 ( ノード数が多い場合はサンプリングで近似 )"""
+    n = len(pos)
+    others = pos
+    scale = 1.0
+    if n > MAX_REPULSION_SAMPLES:
+        others = pos[rng.choice(n, MAX_REPULSION_SAMPLES, replace=False)]
+        scale = n / MAX_REPULSION_SAMPLES
+
+    disp = np.zeros_like(pos)
+    rows = max(1, BLOCK_SIZE // len(others))
+    for start in range(0, n, rows):
+        block = pos[start:start + rows]
+        dx = block[:, 0:1] - others[:, 0]
+        dy = block[:, 1:2] - others[:, 1]
+        d2 = dx * dx + dy * dy
+        d2[d2 == 0] = np.inf    # 自分自身 ( と同じ座標のノード ) は除く
+        inv = 1.0 / d2
+        disp[start:start + rows, 0] = (dx * inv).sum(axis=1)
+        disp[start:start + rows, 1] = (dy * inv).sum(axis=1)
+
+    return disp * scale
+
+
+def layout_cache_key(concern_id):
+    """直前に計算したレイアウトのキャッシュのキー"""
+    return "graph:layout:%d" % concern_id
+
+
+def layout_available():
+    """
+    座標を計算できるかどうか ( NumPy があり、GRAPH_LAYOUT が True )
+    ※座標は直前のレイアウトに依るので、concern_detail_json の ETag は
+      弱い ETag にする ( graph/cache.py の graph_etag() )
+    """
+    return np is not None and getattr(settings, "GRAPH_LAYOUT", True)
+
+
+def layout_enabled(node_count):
+    """
+    座標を計算するかどうか
+    ノード数が GRAPH_LAYOUT_MAX_NODES を超える場合は計算しない
+    ( キャッシュがなければリクエストの中で計算するため、
+      大きな関心事では座標なしで返し、クライアント側 ( force.js ) で計算する )
+    """
+    if not layout_available():
+        return False
+    return node_count <= getattr(settings, "GRAPH_LAYOUT_MAX_NODES", 2000)
+
+
+def attach_layout(concern_id, payload):
+    """
+    concern_detail_json のペイロードのノードに座標 ( x, y ) を追加する
+    直前に計算したレイアウトを初期座標として使うため、
+    一部のノードが変わっただけなら少しの計算で済む
+    """
+    nodes = payload["nodes"]
+    links = payload["links"]
+
+    if not layout_enabled(len(nodes)):
+        return payload
+
+    # ノードのキー ( ルートは 0、それ以外はノードの ID )
+    keys = [node.get("nid", 0) for node in nodes]
+
+    # 直前のレイアウトを初期座標にする
+    cache = get_graph_cache()
+    previous = cache.get(layout_cache_key(concern_id)) or {}
+    initial = np.full((len(nodes), 2), np.nan)
+    for i, key in enumerate(keys):
+        if key in previous:
+            initial[i] = previous[key]
+
+    # ペイロードの id はノードの並び順と一致する
+    pos = compute_layout(
+        len(nodes),
+        [link["source"] for link in links],
+        [link["target"] for link in links],
+        initial=initial,
+        iterations=getattr(settings, "GRAPH_LAYOUT_ITERATIONS", 50),
+        seed=concern_id,
+    )
+
+    for node, (x, y) in zip(nodes, pos.round(3).tolist()):
+        node["x"] = x
+        node["y"] = y
+
+    cache.set(layout_cache_key(concern_id),
+        dict(zip(keys, pos.tolist())))
+
+    return payload
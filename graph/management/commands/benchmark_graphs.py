@@ -0,0 +1,71 @@
+# graph/management/commands/benchmark_graphs.py
+import json
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, \
+teardown_test_environment
+
+from graph.benchmarks import CONCERN_TYPES, SHAPES, run_benchmarks, \
+run_transport_benchmarks
+
+
+class Command(BaseCommand):
+    """
+    合成グラフでエンドポイントを計測し、結果を JSON で書き出す
+    ※テスト用のデータベースを作成して使う ( 既存のデータは変更しない )
+    """
+
+    help = "Benchmark graph endpoints on synthetic concerns (JSON output)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--shapes", nargs="+", choices=sorted(SHAPES),
+            default=sorted(SHAPES))
+        parser.add_argument("--sizes", nargs="+", type=int,
+            default=[100, 1000])
+        parser.add_argument("--concern-types", nargs="+", type=int,
+            choices=CONCERN_TYPES, default=CONCERN_TYPES,
+            help="concern types (0: analyze, 1: set target)")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--single-node-type", action="store_true",
+            help="do not mix node types")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--transports", action="store_true",
+            help="also compare WSGI and ASGI under concurrent requests")
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--requests", type=int, default=64,
+            help="requests per transport (with --transports)")
+        parser.add_argument("-o", "--output",
+            help="output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        if options["repeat"] < 1:
+            raise CommandError("--repeat must be at least 1")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            user = User.objects.create_user("benchmark")
+            report = run_benchmarks(user, options["shapes"],
+                options["sizes"], concern_types=options["concern_types"],
+                repeat=options["repeat"],
+                mixed=not options["single_node_type"],
+                seed=options["seed"])
+            if options["transports"]:
+                report["transports"] = run_transport_benchmarks(user,
+                    options["shapes"], options["sizes"],
+                    concurrency=options["concurrency"],
+                    requests=options["requests"],
+                    mixed=not options["single_node_type"],
+                    seed=options["seed"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
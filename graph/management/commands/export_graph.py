@@ -0,0 +1,43 @@
+# graph/management/commands/export_graph.py
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from graph import transfer
+from graph.models import Concern
+
+
+class Command(BaseCommand):
+    """グラフをエクスポートする"""
+
+    help = "Export a concern's graph as JSON or CSV."
+
+    def add_arguments(self, parser):
+        parser.add_argument("concern_id", type=int)
+        parser.add_argument("--format", choices=("json", "csv"),
+            default="json")
+        parser.add_argument("-o", "--output",
+            help="output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            concern = Concern.objects.get(pk=options["concern_id"])
+        except Concern.DoesNotExist:
+            raise CommandError(
+                "Concern %d does not exist" % options["concern_id"])
+
+        # self.stdout は write() ごとに改行を補うので、一度文字列にする
+        out = io.StringIO()
+        if options["format"] == "csv":
+            transfer.export_graph_csv(concern, out)
+        else:
+            json.dump(transfer.export_graph(concern), out,
+                ensure_ascii=False)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8",
+                newline="") as f:
+                f.write(out.getvalue())
+        else:
+            self.stdout.write(out.getvalue(), ending="")
@@ -0,0 +1,39 @@
+# graph/management/commands/export_user_graphs.py
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from graph import transfer
+
+
+class Command(BaseCommand):
+    """ユーザーの全ての関心事のグラフを少しずつ書き出す"""
+
+    help = "Stream every concern graph of a user as NDJSON or JSON."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--format", choices=("ndjson", "json"),
+            default="ndjson")
+        parser.add_argument("--chunk-size", type=int, default=100,
+            help="concerns fetched per database round trip")
+        parser.add_argument("-o", "--output",
+            help="output file (default: stdout)")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(
+                "User %s does not exist" % options["username"])
+
+        chunks = transfer.iter_user_export(user, options["format"],
+            chunk_size=options["chunk_size"])
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending="")
+            self.stdout.flush()
@@ -0,0 +1,68 @@
+# graph/management/commands/graph_profiles.py
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from graph import profiling
+
+
+class Command(BaseCommand):
+    """保存したリクエストのプロファイルの一覧/集計"""
+
+    help = "List or aggregate request profiles saved by ProfilingMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--view",
+            help="view name (e.g. graph:concern-detail-json)")
+        parser.add_argument("--concern", type=int, help="concern id")
+        parser.add_argument("--aggregate", action="store_true",
+            help="merge the matching profiles and print the top functions")
+        parser.add_argument("--sort", default="cumulative",
+            help="pstats sort key (default: cumulative)")
+        parser.add_argument("--limit", type=int, default=30,
+            help="number of functions to print")
+        parser.add_argument("-o", "--output",
+            help="write the merged pstats file here")
+
+    def handle(self, *args, **options):
+        profiles = profiling.list_profiles(options["view"],
+            options["concern"])
+        if not profiles:
+            self.stdout.write("No profiles in %s" % profiling.profile_dir())
+            return
+
+        if not options["aggregate"] and not options["output"]:
+            self.list_profiles(profiles)
+            return
+
+        stats = profiling.aggregate(profiles)
+        if options["output"]:
+            stats.dump_stats(options["output"])
+            self.stdout.write("Merged %d profiles into %s" % (
+                len(profiles), options["output"]))
+        if options["aggregate"]:
+            out = io.StringIO()
+            stats.stream = out
+            try:
+                stats.sort_stats(options["sort"]).print_stats(
+                    options["limit"])
+            except KeyError:
+                raise CommandError("Unknown sort key: %s" % options["sort"])
+            self.stdout.write("%d profiles" % len(profiles))
+            self.stdout.write(out.getvalue())
+
+    def list_profiles(self, profiles):
+        """ビュー/関心事ごとの件数と所要時間"""
+        groups = {}
+        for profile in profiles:
+            key = (profile.view_name, profile.concern_id)
+            groups.setdefault(key, []).append(profile.duration_ms)
+
+        self.stdout.write("%-40s %8s %6s %10s %10s" % (
+            "view", "concern", "count", "mean ms", "max ms"))
+        for (view_name, concern_id), durations in sorted(
+            groups.items(), key=lambda item: -sum(item[1])):
+            self.stdout.write("%-40s %8s %6d %10.1f %10d" % (
+                view_name, "-" if concern_id is None else concern_id,
+                len(durations), sum(durations) / len(durations),
+                max(durations)))
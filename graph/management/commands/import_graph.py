@@ -0,0 +1,51 @@
+# graph/management/commands/import_graph.py
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from graph import transfer
+from graph.closure import closure_enabled
+
+
+class Command(BaseCommand):
+    """グラフを新しい関心事としてインポートする"""
+
+    help = "Import a graph (JSON or CSV) as a new concern."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--user", required=True,
+            help="username of the owner")
+        parser.add_argument("--format", choices=("json", "csv"),
+            help="input format (default: by extension)")
+        parser.add_argument("--content",
+            help="concern content (default: from the JSON)")
+        parser.add_argument("--skip-closure", action="store_true",
+            help="do not build the NodeClosure rows")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError("User %s does not exist" % options["user"])
+
+        path = options["path"]
+        fmt = options["format"] or \
+            ("csv" if path.lower().endswith(".csv") else "json")
+
+        with open(path, encoding="utf-8-sig") as f:
+            text = f.read()
+
+        try:
+            data = transfer.load_import_data(text, fmt)
+            concern, timings = transfer.import_graph(user, data,
+                content=options["content"],
+                closure=False if options["skip_closure"] else
+                    closure_enabled())
+        except transfer.GraphImportError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write("concern %d: %d nodes, %d links" % (
+            concern.id, len(data.get("nodes", [])),
+            len(data.get("links", []))))
+        for phase, seconds in timings.items():
+            self.stdout.write("  %-10s %8.3fs" % (phase, seconds))
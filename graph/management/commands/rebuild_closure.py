@@ -0,0 +1,26 @@
+# graph/management/commands/rebuild_closure.py
+from django.core.management.base import BaseCommand, CommandError
+
+from graph.closure import rebuild_closure
+from graph.models import Concern
+
+
+class Command(BaseCommand):
+    """到達可能性の表 ( NodeClosure ) を作り直す"""
+
+    help = "Rebuild the NodeClosure reachability table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("concern_ids", nargs="*", type=int,
+            help="concerns to rebuild (default: all)")
+
+    def handle(self, *args, **options):
+        concern_ids = options["concern_ids"] or \
+            Concern.objects.order_by("id").values_list("id", flat=True)
+
+        for concern_id in concern_ids:
+            if not Concern.objects.filter(pk=concern_id).exists():
+                raise CommandError("Concern %d does not exist" % concern_id)
+
+            count = rebuild_closure(concern_id)
+            self.stdout.write("concern %d: %d rows" % (concern_id, count))
@@ -0,0 +1,19 @@
+# graph/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+
+from graph import search
+
+
+class Command(BaseCommand):
+    """全文検索用のインデックスを作り直す"""
+
+    help = "Rebuild the full-text search index of concerns and nodes."
+
+    def handle(self, *args, **options):
+        if not search.using_fts():
+            self.stdout.write(
+                "Nothing to rebuild: this database is searched in place.")
+            return
+
+        count = search.rebuild_index()
+        self.stdout.write("Indexed %d concerns and nodes." % count)
@@ -0,0 +1,33 @@
+# graph/management/commands/reconcile_counters.py
+from django.core.management.base import BaseCommand
+
+from graph.counters import reconcile
+
+
+class Command(BaseCommand):
+    """関心事ごとの集計 ( graph/counters.py ) を数え直す"""
+
+    help = "Recount the per-concern counters and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("concern_ids", nargs="*", type=int,
+            help="concerns to recount (default: all)")
+        parser.add_argument("--batch-size", type=int, default=None,
+            help="concerns per transaction (default: "
+                "GRAPH_COUNTERS_BATCH_SIZE)")
+        parser.add_argument("--dry-run", action="store_true",
+            help="report drift without fixing it")
+
+    def handle(self, *args, **options):
+        drifted = reconcile(
+            options["concern_ids"] or None,
+            size=options["batch_size"],
+            dry_run=options["dry_run"],
+        )
+
+        for concern_id, changes in drifted:
+            self.stdout.write("concern %d: %s" % (concern_id, ", ".join(
+                "%s %s -> %s" % (name, old, new)
+                for name, (old, new) in sorted(changes.items()))))
+        self.stdout.write("%d concerns %s" % (len(drifted),
+            "drifted" if options["dry_run"] else "fixed"))
@@ -0,0 +1,40 @@
+# graph/management/commands/sync_sqlite_replicas.py
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    """
+    primary ( SQLite ) の内容をレプリカ用の SQLite のファイルに複製する
+    ( ローカルでレプリカへの振り分けを試すため )
+    """
+
+    help = "Copy the SQLite primary into the SQLite replica files."
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        if primary["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("The primary database is not SQLite")
+
+        replicas = settings.GRAPH_REPLICA_DATABASES
+        if not replicas:
+            raise CommandError(
+                "No replicas configured (set GRAPH_SQLITE_REPLICAS)")
+
+        source = sqlite3.connect(primary["NAME"])
+        try:
+            for alias in replicas:
+                database = settings.DATABASES[alias]
+                if database["ENGINE"] != "django.db.backends.sqlite3":
+                    raise CommandError("%s is not SQLite" % alias)
+                target = sqlite3.connect(database["NAME"])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write("%s: %s" % (alias, database["NAME"]))
+        finally:
+            source.close()
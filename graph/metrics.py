@@ -0,0 +1,182 @@
+# graph/metrics.py
+"""
+リクエストごとの所要時間、クエリ数、データベースの所要時間を
+ビューごとに集計し、Prometheus のテキスト形式で出力する
+
+    ・QueryTimer      .. クエリの回数と所要時間を数え、閾値
+                         ( GRAPH_SLOW_QUERY_MS ) を超えたものだけログに出す
+                         recorder があれば同じラッパーから記録を渡す
+                         ( graph/instrumentation.py の QueryRecorder )
+    ・RequestMetrics  .. ビューごとのヒストグラム/カウンター ( registry )
+
+graph/middleware.py の RequestMetricsMiddleware から使い、
+/graph/metrics/ で出力する
+※集計はプロセスごと ( ワーカーが複数あればそれぞれを収集する )
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger("graph.slow_queries")
+
+# 所要時間のヒストグラムの境界 ( 秒 )
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def slow_query_threshold():
+    """ログに出すクエリの所要時間の閾値 ( 秒 )"""
+    return getattr(settings, "GRAPH_SLOW_QUERY_MS", 100) / 1000.0
+
+
+class QueryTimer(object):
+    """
+    with ブロック内のクエリの回数と所要時間を数える ( 全てのデータベース )
+    ※SQL の正規化などはせず、閾値を超えたクエリだけをログに出す
+    recorder .. record(sql, duration) を持つもの ( QueryRecorder など )
+                リクエストごとの記録も同じラッパーで取る
+    """
+
+    def __init__(self, view_name=None, recorder=None):
+        self.view_name = view_name
+        self.recorder = recorder
+        self.count = 0
+        self.duration = 0.0
+        self.slow = 0
+        self.threshold = slow_query_threshold()
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            if duration >= self.threshold:
+                self.slow += 1
+                logger.warning("slow query (%.1f ms) in %s: %s",
+                    duration * 1000, self.view_name or "-", sql)
+            if self.recorder is not None:
+                self.recorder.record(sql, duration)
+
+
+class Histogram(object):
+    """累積のヒストグラム ( Prometheus の histogram )"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class RequestMetrics(object):
+    """ビューごとの集計 ( プロセスごと )"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            # (view, method) => Histogram
+            self.latency = OrderedDict()
+            # (view, method, status) => 回数
+            self.responses = OrderedDict()
+            # view => [クエリ数, データベースの所要時間, 遅いクエリ数]
+            self.database = OrderedDict()
+
+    def observe(self, view_name, method, status, duration, timer):
+        with self._lock:
+            key = (view_name, method)
+            if key not in self.latency:
+                self.latency[key] = Histogram()
+            self.latency[key].observe(duration)
+
+            key = (view_name, method, str(status))
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+            database = self.database.setdefault(view_name, [0, 0.0, 0])
+            database[0] += timer.count
+            database[1] += timer.duration
+            database[2] += timer.slow
+
+    def exposition(self):
+        """Prometheus のテキスト形式 ( version 0.0.4 )"""
+        lines = []
+
+        def metric(name, kind, help_text):
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, kind))
+
+        with self._lock:
+            metric("graph_http_request_duration_seconds", "histogram",
+                "Request latency by view.")
+            for (view, method), histogram in self.latency.items():
+                labels = 'view="%s",method="%s"' % (
+                    escape(view), escape(method))
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(
+                        'graph_http_request_duration_seconds_bucket'
+                        '{%s,le="%s"} %d' % (labels, bound, count))
+                lines.append(
+                    'graph_http_request_duration_seconds_bucket'
+                    '{%s,le="+Inf"} %d' % (labels, histogram.count))
+                lines.append("graph_http_request_duration_seconds_sum"
+                    "{%s} %r" % (labels, histogram.sum))
+                lines.append("graph_http_request_duration_seconds_count"
+                    "{%s} %d" % (labels, histogram.count))
+
+            metric("graph_http_responses_total", "counter",
+                "Responses by view and status code.")
+            for (view, method, status), count in self.responses.items():
+                lines.append('graph_http_responses_total'
+                    '{view="%s",method="%s",status="%s"} %d' % (
+                    escape(view), escape(method), status, count))
+
+            for index, name, kind, help_text, fmt in (
+                (0, "graph_db_queries_total", "counter",
+                    "Database queries by view.", "%d"),
+                (1, "graph_db_duration_seconds_total", "counter",
+                    "Time spent in database queries by view.", "%r"),
+                (2, "graph_db_slow_queries_total", "counter",
+                    "Queries over GRAPH_SLOW_QUERY_MS by view.", "%d"),
+            ):
+                metric(name, kind, help_text)
+                for view, values in self.database.items():
+                    lines.append(('%s{view="%s"} ' + fmt) % (
+                        name, escape(view), values[index]))
+
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    """ラベルの値のエスケープ"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace(
+        "\n", "\\n")
+
+
+registry = RequestMetrics()
@@ -0,0 +1,166 @@
+# graph/middleware.py
+import logging
+import time
+
+from django.conf import settings
+from django.db import DatabaseError
+
+from .instrumentation import QueryRecorder, views as view_query_stats
+from .metrics import QueryTimer, registry as metrics_registry
+from . import profiling, routers
+
+
+logger = logging.getLogger("graph.replicas")
+
+
+class QueryInstrumentationMiddleware(object):
+    """
+    リクエストごとのクエリを記録し、ビューごとに集計する
+    ( settings.GRAPH_QUERY_INSTRUMENTATION が True の場合のみ )
+    DEBUG の場合は X-Query-Count ヘッダーに回数を付ける
+    ※StreamingHttpResponse の本体を返す間のクエリは含まない
+    ※RequestMetricsMiddleware の内側にあれば、その QueryTimer から
+      記録する ( execute_wrapper を重ねない )
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "GRAPH_QUERY_INSTRUMENTATION", False):
+            return self.get_response(request)
+
+        timer = getattr(request, "_query_timer", None)
+        if timer is not None:
+            recorder = QueryRecorder()
+            timer.recorder = recorder
+            try:
+                response = self.get_response(request)
+            finally:
+                timer.recorder = None
+        else:
+            with QueryRecorder() as recorder:
+                response = self.get_response(request)
+
+        match = request.resolver_match
+        view_name = match.view_name if match else request.path
+        view_query_stats.record(view_name, recorder)
+
+        if settings.DEBUG:
+            response["X-Query-Count"] = str(len(recorder))
+
+        return response
+
+
+class RequestMetricsMiddleware(object):
+    """
+    ビューごとの所要時間、クエリ数、データベースの所要時間を集計する
+    ( graph/metrics.py、/graph/metrics/ で出力する )
+    GRAPH_SLOW_QUERY_MS を超えたクエリだけをビューの名前と共にログに出す
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with QueryTimer() as timer:
+            request._query_timer = timer
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        # URL に一致しないものはまとめる ( ラベルの種類を増やさない )
+        match = request.resolver_match
+        view_name = match.view_name if match else "unresolved"
+        metrics_registry.observe(view_name, request.method,
+            response.status_code, duration, timer)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """遅いクエリのログに出すビューの名前 ( URL の解決後に分かる )"""
+        timer = getattr(request, "_query_timer", None)
+        if timer is not None:
+            timer.view_name = request.resolver_match.view_name
+
+
+class ProfilingMiddleware(object):
+    """
+    スタッフの指定 ( X-Graph-Profile ヘッダー / ?profile=1 ) または
+    GRAPH_PROFILE_SAMPLE_RATE 回に 1 回、ビューを cProfile で計測する
+    ( graph/profiling.py、manage.py graph_profiles で集計する )
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not profiling.should_profile(request):
+            return None
+
+        def call():
+            response = view_func(request, *view_args, **view_kwargs)
+            # テンプレートの描画も含める
+            if hasattr(response, "render") and callable(response.render):
+                response.render()
+            return response
+
+        response, profiler, duration = profiling.profile_call(call)
+        if profiler is not None:
+            match = request.resolver_match
+            profiling.save_profile(profiler, match.view_name,
+                profiling.concern_id_of(match), duration)
+
+        return response
+
+
+class ReplicaMiddleware(object):
+    """
+    GET / HEAD のリクエストの間だけ、graph アプリの読み取りを
+    レプリカに送る ( graph/routers.py )
+    ユーザーの書き込みの直後は primary から読む
+    レプリカの読み取りが DatabaseError になれば、そのレプリカを使わない
+    ようにして、ビューを primary で呼び直す ( GET / HEAD のみなので安全 )
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.use_replicas(
+            request.method in ("GET", "HEAD") and
+            not routers.is_pinned(request))
+        try:
+            response = self.get_response(request)
+        finally:
+            routers.use_replicas(False)
+
+        if getattr(request, "graph_pinned", False):
+            response.set_cookie(routers.COOKIE_NAME, "1",
+                max_age=routers.sticky_seconds(), httponly=True)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """呼び直すビュー"""
+        request._graph_view = (view_func, view_args, view_kwargs)
+
+    def process_exception(self, request, exception):
+        replica = routers.current_replica()
+        view = getattr(request, "_graph_view", None)
+        if not isinstance(exception, DatabaseError) or replica is None or \
+            view is None:
+            return None
+
+        logger.warning("replica %s failed, reading from primary: %s",
+            replica, exception)
+        routers.mark_unhealthy(replica)
+        routers.use_replicas(False)
+
+        view_func, view_args, view_kwargs = view
+        response = view_func(request, *view_args, **view_kwargs)
+        if hasattr(response, "render") and callable(response.render):
+            response.render()
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0003_node_node_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='concern',
+            name='graph_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
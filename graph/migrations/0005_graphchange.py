@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0004_concern_graph_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('kind', models.IntegerField(choices=[(0, 'ノード'), (1, '接続')])),
+                ('deleted', models.BooleanField(default=False)),
+                ('source', models.IntegerField()),
+                ('target', models.IntegerField(blank=True, null=True)),
+                ('concern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='graph.Concern')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='graphchange',
+            index=models.Index(fields=['concern', 'version'], name='graph_graph_concern_b6050e_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 13:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0005_graphchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField()),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_closures', to='graph.Node')),
+                ('concern', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='graph.Concern')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_closures', to='graph.Node')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='nodeclosure',
+            index=models.Index(fields=['descendant', 'ancestor'], name='graph_nodec_descend_4e9bd9_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodeclosure',
+            unique_together={('ancestor', 'descendant')},
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0006_nodeclosure'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='concern',
+            index=models.Index(fields=['user', 'created_at'], name='graph_conce_user_id_0816fe_idx'),
+        ),
+    ]
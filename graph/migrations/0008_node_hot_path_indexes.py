@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0007_concern_user_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['concern', 'created_at'], name='graph_node_concern_8f0be1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['user', 'concern'], name='graph_node_user_id_1ba64d_idx'),
+        ),
+        # 中間テーブル ( Node.targets ) の逆方向 ( 接続先 => 接続元、sources )
+        # ※自動作成されるテーブルなので Meta.indexes では指定できない
+        migrations.RunSQL(
+            'CREATE INDEX graph_node_targets_to_from_idx '
+            'ON graph_node_targets (to_node_id, from_node_id)',
+            'DROP INDEX graph_node_targets_to_from_idx',
+        ),
+    ]
@@ -0,0 +1,42 @@
+# 全文検索用のインデックス ( graph/search.py )
+# 既存のデータは manage.py rebuild_search_index で登録する
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE graph_search USING fts5("
+            "tokens, content UNINDEXED, user_id UNINDEXED, "
+            "concern_id UNINDEXED, tokenize='unicode61')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table in ('graph_concern', 'graph_node'):
+            schema_editor.execute(
+                'CREATE INDEX %s_content_trgm_idx ON %s '
+                'USING gin (content gin_trgm_ops)' % (table, table)
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE graph_search')
+    elif vendor == 'postgresql':
+        for table in ('graph_concern', 'graph_node'):
+            schema_editor.execute(
+                'DROP INDEX %s_content_trgm_idx' % table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0008_node_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:38
+
+# 関心事ごとの集計 ( graph/counters.py )
+# 既存のデータは manage.py reconcile_counters で数える
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0009_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='concern',
+            name='done_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='concern',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='concern',
+            name='link_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='concern',
+            name='node_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='concern',
+            name='plan_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 2.2.28 on 2026-10-18 14:50
+
+# ノードタイプの選択肢 ( 実行予定/実行済み ) をモデルに合わせる
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0010_concern_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='node',
+            name='node_type',
+            field=models.IntegerField(choices=[(0, 'ノーマル'), (1, '反論'), (2, '実行予定'), (3, '実行済み')], default=0),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# 全文検索用のインデックス ( graph/search.py ) にユーザーと関心事の
+# トークンの列 ( keys ) を追加する
+# ( ユーザーでの絞り込みと関心事ごとの削除を MATCH で行う )
+
+from django.db import migrations
+
+
+def add_keys(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE graph_search_new USING fts5("
+        "tokens, content UNINDEXED, keys, "
+        "concern_id UNINDEXED, tokenize='unicode61')"
+    )
+    schema_editor.execute(
+        "INSERT INTO graph_search_new "
+        "(rowid, tokens, content, keys, concern_id) "
+        "SELECT rowid, tokens, content, "
+        "'u' || user_id || ' c' || concern_id, concern_id "
+        "FROM graph_search"
+    )
+    schema_editor.execute('DROP TABLE graph_search')
+    schema_editor.execute(
+        'ALTER TABLE graph_search_new RENAME TO graph_search')
+
+
+def remove_keys(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        "CREATE VIRTUAL TABLE graph_search_old USING fts5("
+        "tokens, content UNINDEXED, user_id UNINDEXED, "
+        "concern_id UNINDEXED, tokenize='unicode61')"
+    )
+    schema_editor.execute(
+        "INSERT INTO graph_search_old "
+        "(rowid, tokens, content, user_id, concern_id) "
+        "SELECT rowid, tokens, content, "
+        "CAST(substr(keys, 2, instr(keys, ' ') - 2) AS INTEGER), "
+        "concern_id FROM graph_search"
+    )
+    schema_editor.execute('DROP TABLE graph_search')
+    schema_editor.execute(
+        'ALTER TABLE graph_search_old RENAME TO graph_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0011_node_node_type_choices'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_keys, remove_keys),
+    ]
@@ -1,7 +1,28 @@
+import contextvars
+
 from django.db import models
 from django.contrib.auth.models import User
 
 
+# 削除中の関心事の ID ( 関心事の pre_delete から post_delete まで、
+# graph/signals.py )
+# ※スレッドや非同期タスクごとに別の値になる
+deleting_concerns = contextvars.ContextVar("deleting_concerns",
+    default=frozenset())
+
+
+class ConcernQuerySet(models.QuerySet):
+    """関心事のクエリセット"""
+
+    def delete(self):
+        """まとめて削除する ( 失敗しても削除中の ID を残さない )"""
+        token = deleting_concerns.set(deleting_concerns.get())
+        try:
+            return super().delete()
+        finally:
+            deleting_concerns.reset(token)
+
+
 # Create your models here.
 class BaseModel(models.Model):
     """基本モデル"""
@@ -48,9 +69,60 @@ class Concern(BaseModel):
         choices=NODE_TYPES
     )
 
+    # グラフのバージョン
+    # ノードの保存/削除、接続の変更のたびに 1 増える ( graph/signals.py )
+    graph_version = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+
+    # 集計 ( 関心事の一覧で表示する、graph/counters.py )
+    # ノードと接続の書き込みと同じトランザクションで増減する
+    # ( graph/signals.py、ずれたら manage.py reconcile_counters )
+    node_count = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+    link_count = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+    # 実行予定/実行済みのノードの数 ( 目標設定の場合に表示する )
+    plan_count = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+    done_count = models.PositiveIntegerField(
+        default=0,
+        editable=False
+    )
+
+    # 最後にノードか接続が変更された日時 ( なければ None )
+    last_activity_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+
+    objects = ConcernQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 関心事の一覧 ( ユーザーごとに新しい順、graph/pagination.py )
+            models.Index(fields=["user", "created_at"]),
+        ]
+
     def __str__(self):
         return "%s" % self.content
 
+    def delete(self, *args, **kwargs):
+        """削除 ( 失敗しても削除中の ID を残さない )"""
+        token = deleting_concerns.set(deleting_concerns.get())
+        try:
+            return super().delete(*args, **kwargs)
+        finally:
+            deleting_concerns.reset(token)
+
 
 class Node(BaseModel):
     """ノード"""
@@ -96,5 +168,107 @@ class Node(BaseModel):
         default=NORMAL
     )
 
+    class Meta:
+        indexes = [
+            # 関心事のノード一覧 ( 作成順、graph/adjacency.py )
+            models.Index(fields=["concern", "created_at"]),
+            # 接続先の選択肢 ( NodeEditView.get_form() )
+            models.Index(fields=["user", "concern"]),
+        ]
+
+    def __str__(self):
+        return "%s" % self.content
+
+
+class GraphChange(models.Model):
+    """
+    グラフの変更履歴 ( 差分の配信に使用する )
+    Concern.graph_version が増えるたびに記録される
+    """
+
+    # 関心事
+    concern = models.ForeignKey(
+        Concern,
+        on_delete=models.CASCADE
+    )
+
+    # 変更後のグラフのバージョン
+    version = models.PositiveIntegerField()
+
+    # 変更の対象
+    # 0 .. ノード
+    # 1 .. 接続
+    NODE = 0
+    LINK = 1
+    KINDS = (
+        (NODE, "ノード"),
+        (LINK, "接続"),
+    )
+    kind = models.IntegerField(
+        choices=KINDS
+    )
+
+    # 削除かどうか ( False の場合は追加/変更 )
+    deleted = models.BooleanField(
+        default=False
+    )
+
+    # ノードの ID ( 接続の場合は接続元のノード ID )
+    # ※ノードが削除されても履歴は残すため ForeignKey にはしない
+    source = models.IntegerField()
+
+    # 接続先のノード ID ( 接続の場合のみ )
+    target = models.IntegerField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["concern", "version"]),
+        ]
+
+    def __str__(self):
+        return "%s v%d" % (self.concern_id, self.version)
+
+
+class NodeClosure(models.Model):
+    """
+    ノード間の到達可能性 ( 推移的閉包 )
+    descendant から接続先 ( targets ) を depth 回たどると ancestor に着く
+    ※自分自身への行 ( depth = 0 ) も含む
+    """
+
+    # 関心事
+    concern = models.ForeignKey(
+        Concern,
+        on_delete=models.CASCADE
+    )
+
+    # ルート側のノード
+    ancestor = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name="descendant_closures"
+    )
+
+    # 末端側のノード
+    descendant = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name="ancestor_closures"
+    )
+
+    # 最短の経路の長さ
+    depth = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (
+            ("ancestor", "descendant"),
+        )
+        indexes = [
+            models.Index(fields=["descendant", "ancestor"]),
+        ]
+
     def __str__(self):
-        return "%s" % self.content
\ No newline at end of file
+        return "%s -> %s" % (self.descendant_id, self.ancestor_id)
\ No newline at end of file
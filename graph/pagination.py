@@ -0,0 +1,70 @@
+# graph/pagination.py
+"""
+キーセット ( カーソル ) 方式のページ分割
+
+OFFSET を使わず、前のページの最後の行の (作成日時, ID) より
+後ろの行を取り出すので、どれだけ先のページでも所要時間は変わらない
+( Concern の (user, created_at) のインデックスを使う )
+
+カーソルは "作成日時|ID" を URL で使える base64 にしたもの
+"""
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """カーソルが不正"""
+
+
+def page_size():
+    """1 ページの件数"""
+    return getattr(settings, "GRAPH_CONCERN_PAGE_SIZE", 50)
+
+
+def encode_cursor(obj):
+    """行の (作成日時, ID) をカーソルにする"""
+    raw = "%s|%d" % (obj.created_at.isoformat(), obj.id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """カーソルを (作成日時, ID) に戻す"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(
+            padded.encode()).decode().split("|")
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("invalid cursor: %s" % cursor)
+    if created_at is None:
+        raise InvalidCursor("invalid cursor: %s" % cursor)
+    return created_at, pk
+
+
+def paginate_newest_first(queryset, cursor=None, size=None):
+    """
+    新しい順 ( -created_at, -id ) の 1 ページ分を取り出す
+    戻り値は (行のリスト, 次のページのカーソル ( なければ None ))
+    """
+    size = size or page_size()
+    queryset = queryset.order_by("-created_at", "-id")
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) |
+            Q(created_at=created_at, id__lt=pk)
+        )
+
+    # 1 件多く取り出して、次のページがあるかどうかを調べる
+    rows = list(queryset[:size + 1])
+    if len(rows) > size:
+        rows = rows[:size]
+        return rows, encode_cursor(rows[-1])
+
+    return rows, None
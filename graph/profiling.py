@@ -0,0 +1,181 @@
+# graph/profiling.py
+"""
+リクエスト単位のプロファイル ( cProfile )
+
+次の場合にビューの呼び出し ( テンプレートの描画を含む ) を計測する
+    ・スタッフが X-Graph-Profile ヘッダーか ?profile=1 を付けた場合
+    ・GRAPH_PROFILE_SAMPLE_RATE ( N ) が 1 以上なら N 回に 1 回
+
+結果は GRAPH_PROFILE_DIR に pstats 形式 ( .prof ) で保存する
+    ファイル名 .. <ビュー名>.<関心事の ID>.<日時>.<所要時間 ms>.prof
+    GRAPH_PROFILE_MAX_FILES 件 / GRAPH_PROFILE_MAX_BYTES バイトを超えたら
+    古いものから削除する ( prune_profiles() )
+( snakeviz / flameprof などでそのまま開ける )
+一覧と集計は manage.py graph_profiles で行う
+"""
+import cProfile
+import datetime
+import os
+import pstats
+import random
+import re
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+
+HEADER = "HTTP_X_GRAPH_PROFILE"
+PARAM = "profile"
+
+# 関心事の ID が入っている URL のキーワード引数
+CONCERN_KWARGS = ("concern_id", "pk")
+
+Profile = namedtuple("Profile",
+    ["path", "view_name", "concern_id", "created_at", "duration_ms"])
+
+_FILENAME = re.compile(
+    r"^(?P<view>[^.]+)\.(?P<concern>\d+|-)\.(?P<created_at>\d{14}\d*)"
+    r"\.(?P<duration>\d+)\.prof$")
+
+
+def profile_dir():
+    """プロファイルを保存するディレクトリ"""
+    return getattr(settings, "GRAPH_PROFILE_DIR",
+        os.path.join(settings.BASE_DIR, "profiles"))
+
+
+def should_profile(request):
+    """このリクエストを計測するかどうか"""
+    requested = request.META.get(HEADER) or request.GET.get(PARAM)
+    user = getattr(request, "user", None)
+    if requested and user is not None and user.is_staff:
+        return True
+
+    rate = getattr(settings, "GRAPH_PROFILE_SAMPLE_RATE", 0)
+    return rate > 0 and random.random() < 1.0 / rate
+
+
+def concern_id_of(resolver_match):
+    """URL から関心事の ID を取り出す ( なければ None )"""
+    if resolver_match is None:
+        return None
+    kwargs = resolver_match.kwargs
+    # ノードの URL の pk はノードの ID なので concern_id を優先する
+    for name in CONCERN_KWARGS:
+        if name in kwargs:
+            return kwargs[name]
+    return None
+
+
+def profile_call(func, *args, **kwargs):
+    """
+    func を cProfile で計測して呼び出す
+    戻り値は (戻り値, cProfile.Profile, 所要時間 ( 秒 ))
+    ※他のプロファイラーが動いている場合は計測せずに呼び出す
+    """
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        profiler.enable()
+    except ValueError:
+        return func(*args, **kwargs), None, 0.0
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        profiler.disable()
+    return result, profiler, time.perf_counter() - start
+
+
+def save_profile(profiler, view_name, concern_id, duration):
+    """プロファイルを保存し、ファイルのパスを返す"""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    filename = "%s.%s.%s.%d.prof" % (
+        re.sub(r"[^\w-]", "-", view_name or "unresolved"),
+        concern_id if concern_id is not None else "-",
+        datetime.datetime.now().strftime("%Y%m%d%H%M%S%f"),
+        duration * 1000,
+    )
+    path = os.path.join(directory, filename)
+    profiler.dump_stats(path)
+    prune_profiles()
+    return path
+
+
+def prune_profiles(max_files=None, max_bytes=None):
+    """
+    保存したプロファイルが max_files 件または max_bytes バイトを
+    超えていれば、古いものから削除する ( 削除した件数を返す )
+    ※他のプロセスが同時に削除した場合は無視する
+    """
+    if max_files is None:
+        max_files = getattr(settings, "GRAPH_PROFILE_MAX_FILES", 500)
+    if max_bytes is None:
+        max_bytes = getattr(settings, "GRAPH_PROFILE_MAX_BYTES",
+            100 * 1024 * 1024)
+
+    sizes = []
+    for profile in list_profiles():
+        try:
+            sizes.append((profile.path, os.path.getsize(profile.path)))
+        except OSError:
+            continue
+
+    files = len(sizes)
+    total = sum(size for path, size in sizes)
+    removed = 0
+    for path, size in sizes:
+        if files <= max_files and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            pass
+        files -= 1
+        total -= size
+    return removed
+
+
+def list_profiles(view_name=None, concern_id=None):
+    """保存したプロファイルの一覧 ( 古い順 )"""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for filename in sorted(os.listdir(directory)):
+        match = _FILENAME.match(filename)
+        if match is None:
+            continue
+        concern = match.group("concern")
+        profile = Profile(
+            path=os.path.join(directory, filename),
+            view_name=match.group("view"),
+            concern_id=None if concern == "-" else int(concern),
+            created_at=datetime.datetime.strptime(
+                match.group("created_at"), "%Y%m%d%H%M%S%f"),
+            duration_ms=int(match.group("duration")),
+        )
+        if view_name is not None and profile.view_name != \
+            re.sub(r"[^\w-]", "-", view_name):
+            continue
+        if concern_id is not None and profile.concern_id != concern_id:
+            continue
+        profiles.append(profile)
+
+    profiles.sort(key=lambda profile: profile.created_at)
+    return profiles
+
+
+def aggregate(profiles):
+    """複数のプロファイルを 1 つの pstats.Stats にまとめる"""
+    stats = None
+    for profile in profiles:
+        if stats is None:
+            stats = pstats.Stats(profile.path)
+        else:
+            stats.add(profile.path)
+    return stats
@@ -0,0 +1,186 @@
+# graph/routers.py
+"""
+読み取り専用のレプリカへの振り分け
+
+    ・graph アプリのモデルの読み取りを、GET / HEAD のリクエストの間だけ
+      GRAPH_REPLICA_DATABASES のいずれかに送る
+      ( それ以外のリクエスト、管理コマンドなどは全て primary )
+    ・ユーザーが自分でノードを書き込んだ後 GRAPH_REPLICA_STICKY_SECONDS
+      秒間は primary から読む ( 書き込んだ内容がすぐに見えるように )
+    ・接続できないレプリカは GRAPH_REPLICA_RETRY_SECONDS 秒間使わない
+      ( 全て使えなければ primary )
+      接続済みのレプリカも GRAPH_REPLICA_CHECK_SECONDS 秒ごとに確かめる
+    ・レプリカの読み取りが DatabaseError になれば、そのレプリカを使わない
+      ようにして primary で読み直す ( ReplicaMiddleware、graph/asgi.py )
+    ・レプリカはリクエストごとに 1 度だけ選び、リクエストの間は同じものを使う
+      ( レプリカごとの遅れの違いで、クエリごとに見える内容が変わらないように )
+
+ReplicaMiddleware でリクエストごとの状態を設定する
+※書き込みの直後かどうかはセッションではなく有効期限付きの Cookie で判定する
+  ( GET ごとにセッションを読むクエリが増えないように )
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+
+# 書き込みの直後 ( primary から読む期間 ) を表す Cookie
+COOKIE_NAME = "graph_primary"
+
+_state = threading.local()
+
+# 接続できなかったレプリカ => 再び試す時刻
+_unhealthy = {}
+# 接続を確かめたレプリカ => 確かめた時刻
+_checked = {}
+_unhealthy_lock = threading.Lock()
+
+
+def replica_aliases():
+    """レプリカのデータベース ( DATABASES のキー )"""
+    return list(getattr(settings, "GRAPH_REPLICA_DATABASES", []))
+
+
+def use_replicas(enabled, replica=None):
+    """
+    現在のスレッド ( リクエスト ) でレプリカから読むかどうか
+    replica .. 使うレプリカ ( 省略すると最初の読み取りで選ぶ )
+    ※選んだレプリカは次の use_replicas() の呼び出しまで使う
+    """
+    _state.use_replicas = enabled
+    _state.replica = replica
+
+
+def replicas_enabled():
+    return getattr(_state, "use_replicas", False)
+
+
+def sticky_seconds():
+    """ユーザーの書き込みの後、primary から読む秒数"""
+    return getattr(settings, "GRAPH_REPLICA_STICKY_SECONDS", 5)
+
+
+def pin_to_primary(request):
+    """
+    ユーザーの書き込みの後、一定時間 primary から読むようにする
+    ( 現在のリクエストの残りも primary )
+    Cookie は ReplicaMiddleware がレスポンスに付ける
+    """
+    request.graph_pinned = True
+    use_replicas(False)
+
+
+def is_pinned(request):
+    """書き込みの直後 ( primary から読む期間 ) かどうか"""
+    return COOKIE_NAME in request.COOKIES
+
+
+def check_seconds():
+    """接続済みのレプリカを確かめ直すまでの秒数"""
+    return getattr(settings, "GRAPH_REPLICA_CHECK_SECONDS", 10)
+
+
+def is_healthy(alias):
+    """
+    レプリカに接続できるかどうか
+    接続がなければ、または前回から GRAPH_REPLICA_CHECK_SECONDS 秒以上
+    経っていれば SELECT 1 で確かめる ( 接続後に落ちたものも見つける )
+    接続できなければ GRAPH_REPLICA_RETRY_SECONDS 秒間は試さない
+    """
+    now = time.time()
+    with _unhealthy_lock:
+        retry_at = _unhealthy.get(alias)
+        if retry_at is not None and retry_at > now:
+            return False
+        checked_at = _checked.get(alias)
+
+    connection = connections[alias]
+    if connection.connection is not None and checked_at is not None and \
+        now - checked_at < check_seconds():
+        return True
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+    except DatabaseError:
+        mark_unhealthy(alias)
+        return False
+
+    with _unhealthy_lock:
+        _unhealthy.pop(alias, None)
+        _checked[alias] = now
+    return True
+
+
+def mark_unhealthy(alias, seconds=None):
+    """
+    レプリカを一定時間使わないようにする
+    ( 接続は閉じ、次に使う前に確かめ直す )
+    """
+    if seconds is None:
+        seconds = getattr(settings, "GRAPH_REPLICA_RETRY_SECONDS", 30)
+    with _unhealthy_lock:
+        _unhealthy[alias] = time.time() + seconds
+        _checked.pop(alias, None)
+    try:
+        connections[alias].close()
+    except DatabaseError:
+        pass
+
+
+def current_replica():
+    """
+    現在のスレッド ( リクエスト ) で読み取りに使っているレプリカ
+    ( レプリカから読んでいなければ None )
+    """
+    replica = getattr(_state, "replica", None)
+    if not replicas_enabled() or replica in (None, DEFAULT_DB_ALIAS):
+        return None
+    return replica
+
+
+def choose_replica():
+    """
+    接続できるレプリカを 1 つ選ぶ ( 全て使えなければ primary )
+    """
+    aliases = replica_aliases()
+    random.shuffle(aliases)
+    for alias in aliases:
+        if is_healthy(alias):
+            return alias
+    return DEFAULT_DB_ALIAS
+
+
+def reset_health():
+    with _unhealthy_lock:
+        _unhealthy.clear()
+        _checked.clear()
+
+
+class ReplicaRouter(object):
+    """graph アプリのモデルの読み取りをレプリカに振り分ける"""
+
+    app_label = "graph"
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != self.app_label or \
+            not replicas_enabled():
+            return None
+
+        # リクエストの最初の読み取りで選び、以降は同じレプリカ
+        replica = getattr(_state, "replica", None)
+        if replica is None:
+            replica = _state.replica = choose_replica()
+        return replica
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカは primary の複製なので、どの組み合わせでもよい
+        return True
@@ -0,0 +1,283 @@
+# graph/search.py
+"""
+関心事とノードの内容の全文検索
+
+SQLite .. FTS5 の仮想テーブル ( graph_search ) を使う
+    内容を 2 文字ずつの n-gram ( + 語末の 1 文字 ) に分けて
+    tokens 列に入れる ( 日本語の短い文でも部分一致で引ける )
+    keys 列にはユーザーと関心事のトークン ( "u<ID> c<ID>" ) を入れ、
+    ユーザーでの絞り込みと関心事ごとの削除も MATCH で行う
+    ( 他のユーザーの行を読まない )
+    rowid は ( 対象の ID x 2 + 種類 ) で、削除/更新は rowid で行う
+PostgreSQL .. pg_trgm の GIN インデックス ( content ) と類似度を使う
+その他 .. icontains で検索する
+
+インデックスはシグナル ( graph/signals.py ) で更新し、
+全体の作り直しは manage.py rebuild_search_index で行う
+"""
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.utils import OperationalError
+
+from .models import Concern, Node
+
+
+TABLE = "graph_search"
+
+# 検索対象の種類
+CONCERN = 0
+NODE = 1
+KINDS = {
+    CONCERN: "concern",
+    NODE: "node",
+}
+
+# 1 回の executemany() で挿入する行数
+BATCH_SIZE = 5000
+
+
+def search_enabled():
+    """検索用のインデックスを更新するかどうか"""
+    return getattr(settings, "GRAPH_SEARCH", True)
+
+
+def using_fts():
+    """FTS5 の仮想テーブルを使うかどうか"""
+    return connection.vendor == "sqlite"
+
+
+def normalize(text):
+    """全角/半角、大文字/小文字の違いをなくす"""
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def ngrams(text):
+    """
+    内容を 2 文字ずつの n-gram に分ける ( 語ごと )
+    語末の 1 文字も加えるので、1 文字の前方一致でも全ての文字に届く
+    ex: "なぜ遅い" => "なぜ ぜ遅 遅い い"
+    """
+    tokens = []
+    for word in normalize(text).split():
+        tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        tokens.append(word[-1])
+    return " ".join(tokens)
+
+
+def _quote(text):
+    """FTS5 の文字列 ( フレーズ ) にする"""
+    return '"%s"' % text.replace('"', '""')
+
+
+def match_expression(q):
+    """
+    検索語を FTS5 の MATCH 式にする ( 語ごとの AND )
+        1 文字の語 .. n-gram の前方一致
+        2 文字以上 .. n-gram のフレーズ ( 連続して現れること )
+    """
+    parts = []
+    for word in normalize(q).split():
+        if len(word) == 1:
+            parts.append(_quote(word) + "*")
+        else:
+            parts.append(_quote(" ".join(
+                word[i:i + 2] for i in range(len(word) - 1))))
+    return " ".join(parts)
+
+
+def user_key(user_id):
+    return "u%d" % user_id
+
+
+def concern_key(concern_id):
+    return "c%d" % concern_id
+
+
+def user_match_expression(user_id, q):
+    """ユーザーの行に絞った MATCH 式 ( 検索語は tokens 列のみ )"""
+    return "keys : %s AND tokens : (%s)" % (
+        _quote(user_key(user_id)), match_expression(q))
+
+
+def _rowid(kind, object_id):
+    return object_id * 2 + kind
+
+
+def _rows_for(kind, objects):
+    """( rowid, tokens, content, keys, concern_id ) の行"""
+    for object_id, content, user_id, concern_id in objects:
+        yield (_rowid(kind, object_id), ngrams(content), content,
+            "%s %s" % (user_key(user_id), concern_key(concern_id)),
+            concern_id)
+
+
+def _insert(rows):
+    sql = "INSERT INTO %s (rowid, tokens, content, keys, concern_id) " \
+        "VALUES (%%s, %%s, %%s, %%s, %%s)" % TABLE
+    rows = list(rows)
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def index_object(kind, obj):
+    """関心事/ノードをインデックスに登録する ( 既にあれば置き換える )"""
+    if not using_fts():
+        return
+    concern_id = obj.id if kind == CONCERN else obj.concern_id
+    remove_object(kind, obj.id)
+    _insert(_rows_for(kind, [
+        (obj.id, obj.content, obj.user_id, concern_id)]))
+
+
+def remove_object(kind, object_id):
+    """関心事/ノードをインデックスから削除する"""
+    if not using_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM %s WHERE rowid = %%s" % TABLE,
+            [_rowid(kind, object_id)])
+
+
+def remove_concern(concern_id):
+    """関心事とそのノードをまとめてインデックスから削除する"""
+    if not using_fts():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "DELETE FROM %s WHERE rowid IN "
+            "(SELECT rowid FROM %s WHERE %s MATCH %%s)" % (
+                TABLE, TABLE, TABLE),
+            ["keys : %s" % _quote(concern_key(concern_id))])
+
+
+def index_concern(concern):
+    """
+    関心事とそのノードをまとめて登録する
+    ( シグナルを発行しない一括インポート用、graph/transfer.py )
+    """
+    if not using_fts():
+        return
+    nodes = Node.objects.filter(
+        concern_id=concern.id
+    ).values_list("id", "content", "user_id", "concern_id")
+    with transaction.atomic():
+        index_object(CONCERN, concern)
+        _insert(_rows_for(NODE, nodes.iterator()))
+
+
+def rebuild_index():
+    """インデックスを作り直す ( 戻り値は登録した件数 )"""
+    if not using_fts():
+        return 0
+
+    concerns = Concern.objects.values_list("id", "content", "user_id", "id")
+    nodes = Node.objects.values_list("id", "content", "user_id",
+        "concern_id")
+    count = 0
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM %s" % TABLE)
+        for kind, objects in ((CONCERN, concerns), (NODE, nodes)):
+            rows = list(_rows_for(kind, objects.iterator()))
+            _insert(rows)
+            count += len(rows)
+
+    return count
+
+
+def search(user, q, limit=20):
+    """
+    ユーザーの関心事/ノードを検索する ( 関連度の高い順 )
+    戻り値は {kind, id, concern_id, content} の辞書のリスト
+    ※ログインしていなければ何も返さない ( AnonymousUser の id は None )
+    """
+    if not user.is_authenticated or not normalize(q).split():
+        return []
+    if using_fts():
+        return _search_fts(user, q, limit)
+    if connection.vendor == "postgresql":
+        return _search_trigram(user, q, limit)
+    return _search_contains(user, q, limit)
+
+
+def _search_fts(user, q, limit):
+    """
+    FTS5 の MATCH で検索する ( bm25 の順 )
+    ※関連度は tokens 列だけで計算する ( keys 列の重みは 0 )
+    """
+    sql = """
+        SELECT rowid, content, concern_id
+        FROM %s
+        WHERE %s MATCH %%s
+        ORDER BY bm25(%s, 1.0, 0.0, 0.0, 0.0), rowid
+        LIMIT %%s
+    """ % (TABLE, TABLE, TABLE)
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user_match_expression(user.id, q), limit])
+            rows = cursor.fetchall()
+    except OperationalError:    # 記号だけの検索語など
+        return []
+
+    return [
+        {
+            "kind": KINDS[rowid % 2],
+            "id": rowid // 2,
+            "concern_id": concern_id,
+            "content": content,
+        } for rowid, content, concern_id in rows
+    ]
+
+
+def _search_trigram(user, q, limit):
+    """pg_trgm で検索する ( 類似度の順 )"""
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    results = []
+    for kind, model, concern_field in (
+        (CONCERN, Concern, "id"), (NODE, Node, "concern_id")):
+        rows = model.objects.filter(
+            user=user,
+            content__icontains=q,
+        ).annotate(
+            similarity=TrigramSimilarity("content", q)
+        ).order_by(
+            "-similarity", "id"
+        ).values_list("id", "content", concern_field, "similarity")[:limit]
+        results.extend((similarity, kind, object_id, content, concern_id)
+            for object_id, content, concern_id, similarity in rows)
+
+    results.sort(key=lambda row: -row[0])
+    return [
+        {
+            "kind": KINDS[kind],
+            "id": object_id,
+            "concern_id": concern_id,
+            "content": content,
+        } for similarity, kind, object_id, content, concern_id
+        in results[:limit]
+    ]
+
+
+def _search_contains(user, q, limit):
+    """icontains で検索する ( 新しい順 )"""
+    results = []
+    for kind, model, concern_field in (
+        (CONCERN, Concern, "id"), (NODE, Node, "concern_id")):
+        rows = model.objects.filter(
+            user=user,
+            content__icontains=q,
+        ).order_by("-id").values_list("id", "content", concern_field)
+        results.extend(
+            {
+                "kind": KINDS[kind],
+                "id": object_id,
+                "concern_id": concern_id,
+                "content": content,
+            } for object_id, content, concern_id in rows[:limit]
+        )
+    return results[:limit]
@@ -0,0 +1,173 @@
+# graph/serializers.py
+"""
+グラフの JSON を少しずつ作成するシリアライザー
+
+    ・モデルごとに出力してよいフィールドを FIELDS で明示する
+      ( それ以外のフィールドは読まない、指定すれば FieldNotAllowed )
+    ・クエリセットは values_list().iterator() で chunk_size 件ずつ読み、
+      chunk_size 件分の JSON の断片 ( 文字列 ) にまとめて返す
+    ・断片はそのまま StreamingHttpResponse に渡せる
+
+メモリ使用量は chunk_size と ( 接続を D3.js 用の ID に変換するための )
+ノード数で決まり、接続の数やペイロード全体の大きさにはよらない
+concern_detail_json ( キャッシュにない大きな関心事 ) とエクスポート
+( graph/transfer.py ) で使う
+"""
+from array import array
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Concern, Node
+
+
+# モデル => 出力してよいフィールド
+FIELDS = {
+    Concern: ("id", "content", "concern_type", "created_at"),
+    Node: ("id", "content", "node_type", "to_root"),
+    Node.targets.through: ("from_node_id", "to_node_id"),
+}
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False)
+
+
+class FieldNotAllowed(ValueError):
+    """FIELDS にないフィールドを出力しようとした"""
+
+
+class Fragments(object):
+    """JSON の断片 ( エンコード済みの文字列 ) の列"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+def default_chunk_size():
+    """1 つの断片にまとめる件数"""
+    return getattr(settings, "GRAPH_STREAM_CHUNK_SIZE", 2000)
+
+
+def allowed_fields(model, fields=None):
+    """出力するフィールド ( 省略すれば FIELDS の全て )"""
+    whitelist = FIELDS.get(model, ())
+    if fields is None:
+        fields = whitelist
+    for field in fields:
+        if field not in whitelist:
+            raise FieldNotAllowed("%s.%s is not serializable" % (
+                model.__name__, field))
+    return tuple(fields)
+
+
+def serialize(instance, fields=None):
+    """モデルのインスタンスを辞書にする ( FIELDS のフィールドのみ )"""
+    return {
+        field: getattr(instance, field)
+        for field in allowed_fields(type(instance), fields)
+    }
+
+
+def iter_values(queryset, fields=None, chunk_size=None):
+    """クエリセットを FIELDS のフィールドのタプルとして少しずつ読む"""
+    fields = allowed_fields(queryset.model, fields)
+    return queryset.values_list(*fields).iterator(
+        chunk_size=chunk_size or default_chunk_size())
+
+
+def iter_array(items, encode=None, chunk_size=None):
+    """items を JSON の配列として chunk_size 件ずつ返す"""
+    encode = encode or _encoder.encode
+    chunk_size = chunk_size or default_chunk_size()
+
+    yield "["
+    separator = ""
+    buffer = []
+    for item in items:
+        buffer.append(encode(item))
+        if len(buffer) >= chunk_size:
+            yield separator + ", ".join(buffer)
+            separator = ", "
+            buffer = []
+    if buffer:
+        yield separator + ", ".join(buffer)
+    yield "]"
+
+
+def iter_object(members):
+    """
+    (キー, 値) の列を JSON のオブジェクトとして返す
+    値が Fragments ならその断片を順に返す
+    """
+    yield "{"
+    for i, (key, value) in enumerate(members):
+        yield "%s%s: " % (", " if i else "", _encoder.encode(key))
+        if isinstance(value, Fragments):
+            for chunk in value:
+                yield chunk
+        else:
+            yield _encoder.encode(value)
+    yield "}"
+
+
+def iter_concern_graph(concern, version, chunk_size=None):
+    """
+    concern_detail_json と同じ形のグラフ ( 座標と指標は含まない ) を
+    少しずつ返す ( ノード一覧、中間テーブルを 1 回ずつ読む )
+    """
+    # ノードの ID => D3.js 用の ID、接続の node_type 用にノードごとの
+    # node_type、ルートに接続するノード ( 接続の前に読み終わる )
+    id2js = {}
+    node_types = array("b", [0])
+    to_root = array("l")
+
+    def nodes():
+        yield {
+            "id": 0,
+            "content": concern.content,
+            "is_root": True,
+            "node_type": 0,
+        }
+        rows = iter_values(Node.objects.filter(
+            concern_id=concern.id
+        ).order_by("created_at", "id"), chunk_size=chunk_size)
+        for js, (nid, content, node_type, root) in enumerate(rows, 1):
+            id2js[nid] = js
+            node_types.append(node_type)
+            if root:
+                to_root.append(js)
+            yield {
+                "id": js,
+                "content": content,
+                "is_root": False,
+                "nid": nid,
+                "node_type": node_type,
+            }
+
+    def links():
+        for source in to_root:
+            yield source, 0
+        edges = iter_values(Node.targets.through.objects.filter(
+            from_node__concern_id=concern.id
+        ).order_by("id"), chunk_size=chunk_size)
+        for source_id, target_id in edges:
+            # 他の関心事のノードへの接続は無視する
+            source = id2js.get(source_id)
+            target = id2js.get(target_id)
+            if source is not None and target is not None:
+                yield source, target
+
+    def encode_link(link):
+        source, target = link
+        node_type = node_types[source] if target else 0
+        return '{"source": %d, "target": %d, "node_type": %d}' % (
+            source, target, node_type)
+
+    return iter_object([
+        ("nodes", Fragments(iter_array(nodes(), chunk_size=chunk_size))),
+        ("links", Fragments(iter_array(links(), encode_link,
+            chunk_size=chunk_size))),
+        ("version", version),
+    ])
@@ -0,0 +1,111 @@
+# graph/services.py
+from django.conf import settings
+
+from . import analytics
+from .models import Node, GraphChange
+from .adjacency import get_concern_graph
+
+
+def build_concern_graph(concern, metrics=False, graph=None):
+    """
+    関心事のグラフ ( ノード一覧と接続情報 ) を作成する
+    ※モデルのインスタンスは作らず、配列ベースのグラフ
+    ( graph/adjacency.py ) から組み立てる
+    metrics が True ならノードごとの指標 ( graph/analytics.py ) も付ける
+    graph を渡せば、それを使う ( 読み込み済みの場合 )
+
+    発行するクエリはノード数に関係なく 2 回
+        ・ノード一覧
+        ・中間テーブル ( Node.targets ) のレコード
+    ( 同じバージョンのグラフがキャッシュにあれば 0 回 )
+    """
+    if graph is None:
+        graph = get_concern_graph(concern)
+    payload = graph.to_payload(concern.content)
+
+    if metrics:
+        payload = analytics.attach_metrics(graph, payload)
+
+    return payload
+
+
+def build_graph_delta(concern, since):
+    """
+    バージョン since 以降のグラフの差分を作成する
+    ノード/接続は D3.js 用の ID ではなく、ノードの ID ( nid ) で表す
+    履歴が削除済みの場合は全体 ( build_concern_graph() ) を返す
+    """
+    version = concern.graph_version
+
+    # 履歴が残っていない ( または不正な ) バージョンの場合は全体を返す
+    history_size = getattr(settings, "GRAPH_HISTORY_SIZE", 100)
+    if since > version or since < version - history_size:
+        payload = build_concern_graph(concern)
+        payload["full"] = True
+        payload["version"] = version
+        return payload
+
+    changes = GraphChange.objects.filter(
+        concern=concern,
+        version__gt=since,
+    ).order_by(
+        "version", "id"
+    ).values_list(
+        "kind", "deleted", "source", "target"
+    )
+
+    # 変更を順に適用して、最終的な差分だけを残す
+    touched_nodes = set()
+    removed_nodes = set()
+    links = {}    # (接続元, 接続先) => 追加なら True、削除なら False
+    for kind, deleted, source, target in changes:
+        if kind == GraphChange.NODE:
+            if deleted:
+                touched_nodes.discard(source)
+                removed_nodes.add(source)
+            else:
+                touched_nodes.add(source)
+        else:
+            links[(source, target)] = not deleted
+
+    # 追加/変更されたノードの現在の内容
+    rows = Node.objects.filter(
+        concern=concern,
+        id__in=touched_nodes,
+    ).values_list(
+        "id", "content", "node_type", "to_root"
+    )
+    node_dicts = [
+        {
+            "nid": nid,
+            "content": content,
+            "node_type": node_type,
+            "to_root": to_root,
+        } for nid, content, node_type, to_root in rows
+    ]
+
+    # 見つからなかったノードは削除済み
+    removed_nodes |= touched_nodes - set(n["nid"] for n in node_dicts)
+
+    added_links = []
+    removed_links = []
+    for (source, target), added in sorted(links.items()):
+        link = {"source": source, "target": target}
+        if not added:
+            removed_links.append(link)
+        elif source not in removed_nodes and target not in removed_nodes:
+            added_links.append(link)
+
+    payload = {
+        "full": False,
+        "since": since,
+        "version": version,
+        # 関心事 ( ルート ) の内容
+        "content": concern.content,
+        "nodes": node_dicts,
+        "removed_nodes": sorted(removed_nodes),
+        "links": added_links,
+        "removed_links": removed_links,
+    }
+
+    return payload
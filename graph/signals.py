@@ -0,0 +1,295 @@
+# graph/signals.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.core.signals import request_started
+from django.db.models.signals import pre_save, post_save, pre_delete,\
+post_delete, m2m_changed
+from django.dispatch import receiver
+
+from . import closure, search, events, counters
+from .models import Concern, Node, GraphChange, deleting_concerns
+
+
+@receiver(pre_delete, sender=Concern)
+def concern_deleting(sender, instance, **kwargs):
+    """
+    関心事の削除前
+    ( ノードの削除が連鎖しても、ノードごとに履歴や到達可能性の表を更新しない )
+    ※削除の前に全ての pre_delete が送られるので、ノードの post_delete の
+    時点では関心事の pre_delete は受け取り済み
+    """
+    deleting_concerns.set(deleting_concerns.get() | {instance.id})
+
+
+@receiver(post_delete, sender=Concern)
+def concern_deleted(sender, instance, **kwargs):
+    """関心事の削除時"""
+    deleting_concerns.set(deleting_concerns.get() - {instance.id})
+
+    # 関心事とそのノードをまとめて削除する ( ノードごとには削除しない )
+    if search.search_enabled():
+        search.remove_concern(instance.id)
+
+
+@receiver(request_started)
+def request_starting(sender, **kwargs):
+    """
+    リクエストの開始時
+    ※ユーザーの削除に連鎖した関心事の削除が失敗した場合など、
+    Concern.delete を通らずに残った削除中の ID を消す
+    """
+    deleting_concerns.set(frozenset())
+
+
+@receiver(pre_save, sender=Concern)
+def concern_saving(sender, instance, **kwargs):
+    """
+    関心事の保存前
+    編集の場合は保存されている内容を控えておく
+    ( 内容はグラフのルートなので、変わればグラフのバージョンを増やす )
+    """
+    if instance._state.adding or instance.pk is None:
+        return
+    instance._saved_content = Concern.objects.filter(
+        pk=instance.pk
+    ).values_list("content", flat=True).first()
+
+
+@receiver(post_save, sender=Concern)
+def concern_saved(sender, instance, created, **kwargs):
+    """関心事の作成/編集時"""
+    saved_content = getattr(instance, "_saved_content", None)
+    instance._saved_content = None
+    if not created and saved_content is not None and \
+        saved_content != instance.content:
+        version = record_graph_changes(instance.id, [])
+        events.publish_delta(instance.id, version, content=instance.content)
+
+    if search.search_enabled():
+        search.index_object(search.CONCERN, instance)
+
+
+def bump_graph_version(concern_id, deltas=None):
+    """
+    関心事のグラフのバージョンを 1 増やす
+    同じ UPDATE で集計 ( graph/counters.py ) を deltas だけ増減し、
+    最終更新日時を更新する
+    増やした後のバージョンを返す ( 関心事が存在しなければ None )
+    """
+    updated = Concern.objects.filter(pk=concern_id).update(
+        graph_version=F("graph_version") + 1,
+        **counters.counter_updates(deltas)
+    )
+    if not updated:
+        return None
+
+    return Concern.objects.filter(
+        pk=concern_id
+    ).values_list("graph_version", flat=True)[0]
+
+
+def record_graph_changes(concern_id, changes, deltas=None):
+    """
+    グラフのバージョンを増やし、変更履歴を記録する
+    changes .. GraphChange のフィールド ( kind, deleted, source, target )
+        の辞書のリスト
+    deltas .. 集計の増減 ( graph/counters.py )
+    """
+    with transaction.atomic():
+        version = bump_graph_version(concern_id, deltas)
+        if version is None:
+            return None
+
+        GraphChange.objects.bulk_create([
+            GraphChange(concern_id=concern_id, version=version, **change)
+            for change in changes
+        ])
+
+        # 保持する範囲より古い履歴を削除する
+        history_size = getattr(settings, "GRAPH_HISTORY_SIZE", 100)
+        GraphChange.objects.filter(
+            concern_id=concern_id,
+            version__lte=version - history_size,
+        ).delete()
+
+    return version
+
+
+@receiver(pre_save, sender=Node)
+def node_saving(sender, instance, update_fields=None, **kwargs):
+    """
+    ノードの保存前
+    編集の場合は保存されているノードタイプを控えておく ( 集計の増減に使う )
+    """
+    if instance._state.adding or instance.pk is None:
+        return
+    if update_fields is not None and "node_type" not in update_fields:
+        return
+    instance._saved_node_type = Node.objects.filter(
+        pk=instance.pk
+    ).values_list("node_type", flat=True).first()
+
+
+@receiver(post_save, sender=Node)
+def node_saved(sender, instance, created, **kwargs):
+    """ノードの作成/編集時"""
+    if created:
+        deltas = counters.node_deltas(instance.node_type)
+    else:
+        saved_type = getattr(instance, "_saved_node_type", None)
+        instance._saved_node_type = None
+        if saved_type is None:
+            deltas = None
+        else:
+            deltas = counters.type_change_deltas(
+                saved_type, instance.node_type)
+
+    version = record_graph_changes(instance.concern_id, [{
+        "kind": GraphChange.NODE,
+        "source": instance.id,
+    }], deltas)
+
+    events.publish_delta(instance.concern_id, version, nodes=[{
+        "nid": instance.id,
+        "content": instance.content,
+        "node_type": instance.node_type,
+        "to_root": instance.to_root,
+    }])
+
+    if created and closure.closure_enabled():
+        closure.add_node(instance)
+
+    if search.search_enabled():
+        search.index_object(search.NODE, instance)
+
+
+@receiver(pre_delete, sender=Node)
+def node_deleting(sender, instance, **kwargs):
+    """
+    ノードの削除前
+    このノードを経由して届いていたノードと、一緒に削除される接続の数を
+    控えておく
+    """
+    # 接続の数は接続元の関心事で数える ( graph/counters.py )
+    instance._removed_links = Node.targets.through.objects.filter(
+        Q(from_node_id=instance.id) |
+        Q(to_node_id=instance.id, from_node__concern_id=instance.concern_id)
+    ).count()
+
+    if closure.closure_enabled():
+        instance._closure_descendants = \
+            closure.descendants_of([instance.id]) - {instance.id}
+
+
+@receiver(post_delete, sender=Node)
+def node_deleted(sender, instance, **kwargs):
+    """
+    ノードの削除時
+    ※中間テーブルのレコードも削除されるが、m2m_changed は
+    発行されないので、接続の削除はクライアント側で補う
+    """
+    # 関心事の削除に連鎖した場合 ( ノードの履歴などは関心事ごと消える )
+    if instance.concern_id in deleting_concerns.get():
+        return
+
+    if search.search_enabled():
+        search.remove_object(search.NODE, instance.id)
+
+    deltas = counters.node_deltas(instance.node_type, -1)
+    deltas["link_count"] = -getattr(instance, "_removed_links", 0)
+
+    version = record_graph_changes(instance.concern_id, [{
+        "kind": GraphChange.NODE,
+        "deleted": True,
+        "source": instance.id,
+    }], deltas)
+
+    events.publish_delta(instance.concern_id, version,
+        removed_nodes=[instance.id])
+
+    descendants = getattr(instance, "_closure_descendants", None)
+    if descendants:
+        closure.rebuild_affected(instance.concern_id, descendants)
+
+
+@receiver(m2m_changed, sender=Node.targets.through)
+def node_targets_changed(sender, instance, action, reverse, pk_set,
+    **kwargs):
+    """
+    接続情報 ( Node.targets ) の変更時
+    ※sources.add() の場合 ( reverse=True ) は instance が接続先、
+    pk_set が接続元となる
+    """
+
+    # remove() の pk_set には存在しない接続も含まれるので、
+    # 削除前に実際の接続の数を控えておく ( 集計に使う )
+    if action == "pre_remove":
+        if not pk_set:
+            return
+        if reverse:
+            links = sender.objects.filter(
+                from_node_id__in=pk_set, to_node_id=instance.id)
+        else:
+            links = sender.objects.filter(
+                from_node_id=instance.id, to_node_id__in=pk_set)
+        instance._removed_links = links.count()
+        return
+
+    # clear() の場合は pk_set が渡されないので、削除前に控えておく
+    if action == "pre_clear":
+        manager = instance.sources if reverse else instance.targets
+        instance._cleared_pks = set(
+            manager.values_list("id", flat=True))
+        return
+    if action == "post_clear":
+        pk_set = getattr(instance, "_cleared_pks", set())
+        del instance._cleared_pks
+
+    if action not in ("post_add", "post_remove", "post_clear") or \
+        not pk_set:
+        return
+
+    changes = []
+    for pk in sorted(pk_set):
+        if reverse:
+            source, target = pk, instance.id
+        else:
+            source, target = instance.id, pk
+        changes.append({
+            "kind": GraphChange.LINK,
+            "deleted": action != "post_add",
+            "source": source,
+            "target": target,
+        })
+
+    # 集計の増減 ( add() の pk_set は追加された接続のみ )
+    # ※接続先の選択肢は同じ関心事のノードに限られる
+    #   ( NodeEditView.get_form() ) ので、instance の関心事で数える
+    if action == "post_remove":
+        removed = getattr(instance, "_removed_links", len(pk_set))
+        instance._removed_links = None
+        deltas = {"link_count": -removed}
+    elif action == "post_clear":
+        deltas = {"link_count": -len(pk_set)}
+    else:
+        deltas = {"link_count": len(pk_set)}
+
+    version = record_graph_changes(instance.concern_id, changes, deltas)
+
+    links = [{"source": c["source"], "target": c["target"]} for c in changes]
+    if action == "post_add":
+        events.publish_delta(instance.concern_id, version, links=links)
+    else:
+        events.publish_delta(instance.concern_id, version,
+            removed_links=links)
+
+    # 到達可能性の表を更新する
+    if closure.closure_enabled():
+        edges = [(c["source"], c["target"]) for c in changes]
+        if action == "post_add":
+            closure.add_edges(instance.concern_id, edges)
+        else:
+            sources = set(source for source, target in edges)
+            closure.rebuild_affected(instance.concern_id,
+                closure.descendants_of(sources))
@@ -9,11 +9,15 @@ $(function () {
   let reg = /\/graph\/concerns\/([^\/]+)\//;
   let concernId = location.href.match(reg)[1];
   let url = `/graph/concerns/${concernId}.json/`;
-  $.getJSON(url, (data) => {
+  // 大きな関心事でも転送/解析が速いようにバイナリ形式で取得する ( force.js )
+  loadGraph(url, (data) => {
 
     let nodes = data["nodes"];
     let links = data["links"];
 
+    // 取得したグラフのバージョン ( 差分の取得に使用する )
+    let version = data["version"];
+
     // グラフを描画する
     let svgId = "svgArea";
     let arrowColor = "gray";    // 矢印の色 ( デフォルトで lightgray )
@@ -21,6 +25,32 @@ $(function () {
     let force = new ForceConcern(svgId, nodes, links,
       arrowColor, distance);
 
-  });    // end of $.getJSON(url, ...)
+    // 他のユーザーの変更も含めて、グラフの変更をそのまま反映する
+    let eventsUrl = `/graph/concerns/${concernId}/events/`;
+    let deltaUrl = `/graph/concerns/${concernId}/delta.json/`;
+    force.subscribe(eventsUrl, deltaUrl, version);
+
+    // モーダルダイアログのフォームは Ajax で送信し、
+    // ページを再読み込みせずに差分だけを反映する
+    $(document).on("submit", ".modal-body form", (e) => {
+      e.preventDefault();
+
+      let form = $(e.target);
+      $.post(form.attr("action"), form.serialize(), (html, status, xhr) => {
+
+        // 入力エラーの場合はフォームを表示し直す
+        if (xhr.status !== 204) {
+          $(".modal-body").html(html);
+          return;
+        }
+
+        $("#mdddl").modal("hide");
+
+        // 通知を待たずに差分を反映する ( 通知は反映済みなら無視される )
+        force.fetchDelta();
+      });
+    });
+
+  });    // end of loadGraph(url, ...)
 
 }());
\ No newline at end of file
@@ -5,6 +5,11 @@
  */
 class ForceConcern extends Force {
 
+  /* ノードを識別するキー ( D3.js 用の ID は変わりうるため nid を使う ) */
+  nodeKey(node) {
+    return node.is_root ? "root" : node.nid;
+  }
+
   /* 矢印を定義する ( 定義を追加する ) */
   appendArrowHead() {
     super.appendArrowHead();
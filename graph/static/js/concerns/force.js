@@ -21,15 +21,41 @@ class Force {
     this.width = svg.style("width").replace("px", "");
     this.height = svg.style("height").replace("px", "");
 
+    // サーバー側で計算した座標があれば画面上の座標に変換する
+    let placed = this.placeNodes(nodes);
+
     // フォースレイアウトの設定
     this.sim = this.setForceSimulation();
 
+    // 全ノードの座標が分かっている場合は少しだけ動かす
+    if (placed) {
+      this.sim.alpha(0.05);
+    }
+
     // 矢印を定義する
     this.defs = this.svg.append("defs");
     this.arrowId = "arrowHead";
     // this.defineArrowHead(this.arrowId, this.arrowColor);
     this.appendArrowHead();
 
+    // リンク、ノード、ラベルを描画する
+    this.draw();
+
+    // tickイベント時の処理を登録する
+    this.sim.on("tick", () => {
+      this.onTick(this.linkGroup, this.nodeGroup);
+    });
+
+  }
+
+  /* リンク、ノード、ラベルを描画する ( データの変更時にも呼び出す ) */
+  draw() {
+
+    // シミュレーションにノードとリンクを設定する
+    // ( リンクの source/target がノードのオブジェクトに置き換わる )
+    this.sim.nodes(this.nodes);
+    this.sim.force("link").links(this.links);
+
     // リンク (g要素 + line要素) を追加する
     this.linkGroup = this.appendLinkGroup();
 
@@ -41,22 +67,49 @@ class Force {
     // 取得しているのは、フォースレイアウトによる座標指定は
     // g 要素ごと行う一方で、circle 要素のみにドラッグイベントを
     // 設定するようにしているため
+    // ※円とラベルは新しく追加されたノードにのみ追加する
     this.circles = this.appendNodeCircles();
 
-    // tickイベント時の処理を登録する
-    this.sim.nodes(nodes).on("tick", () => {
-      this.onTick(this.linkGroup, this.nodeGroup);
-    });
-
-    // リンクのシミュレーションを開始する
-    this.sim.force("link").links(links);
-
     // ラベルを表示する
     this.labels = this.appendLabels();
 
     // ドラッグイベントを設定する
     this.setDragEventHandlers();
 
+    // 既存のノードの表示を更新する
+    this.updateNodeGroup();
+
+  }
+
+  /**
+   * サーバー側で計算した座標 ( リンクの長さを 1 とする単位、
+   * 原点が中心 ) を画面上の座標に変換する
+   * 全ノードに座標があれば true を返す
+   */
+  placeNodes(nodes) {
+
+    let placed = nodes.filter((n) => n.x !== undefined);
+    if (placed.length === 0) return false;
+
+    // 画面に収まるように縮尺を決める ( 最大でリンクの長さ )
+    let extent = d3.max(placed, (n) => Math.max(Math.abs(n.x), Math.abs(n.y)));
+    let fit = Math.min(this.width, this.height) * 0.45 / (extent || 1);
+    let scale = Math.min(this.distance, fit);
+
+    placed.forEach((n) => {
+      n.x = this.width / 2 + n.x * scale;
+      n.y = this.height / 2 + n.y * scale;
+    });
+
+    return placed.length === nodes.length;
+  }
+
+  /* ノードを識別するキー */
+  nodeKey(node) { return node.id; }
+
+  /* リンクを識別するキー */
+  linkKey(link) {
+    return `${this.nodeKey(link.source)}-${this.nodeKey(link.target)}`;
   }
 
   /* フォースレイアウトを設定する */
@@ -90,6 +143,14 @@ class Force {
     return sim;
   }
 
+  /* シミュレーションを再開する ( データの変更時 ) */
+  restart() {
+    this.sim.alpha(0.3).restart();
+
+    // 2 秒後にシミュレーションを停止させる
+    this.stopAfter(2000);
+  }
+
   /* n ミリ秒後にシミュレーションを停止させる */
   stopAfter(ms) {
     setTimeout(() => { this.sim.stop(); }, ms);
@@ -113,17 +174,26 @@ class Force {
   /* リンク ( g 要素 + line 要素 ) を追加する */
   appendLinkGroup() {
 
-    let linkGroup = this.svg.append("g")
-      .attr("class", "links")
+    // リンク全体をまとめる g 要素 ( 初回のみ追加する )
+    if (!this.linkLayer) {
+      this.linkLayer = this.svg.append("g")
+        .attr("class", "links");
+    }
+
+    // 削除されたリンクを取り除き、追加されたリンクを描画する
+    let join = this.linkLayer
       .selectAll("line")
-      .data(this.links)
-      .enter()
+      .data(this.links, (link) => this.linkKey(link));
+    join.exit().remove();
+
+    let linkGroup = join.enter()
       .append("line")
+      .attr("stroke-width", 1)
+      .attr("fill", "none")
+      .merge(join)
       .attr("stroke", (link) => {
         return this.setLineColor(link);
       })
-      .attr("stroke-width", 1)
-      .attr("fill", "none")
       .attr("marker-end", (link) => {
         return this.setArrowHead(link);
       });
@@ -134,14 +204,30 @@ class Force {
   /* ノード (g要素) を追加する */
   appendNodeGroup() {
 
-    let nodeGroup = this.svg.append("g")
-      .attr("class", "nodes")
+    // ノード全体をまとめる g 要素 ( 初回のみ追加する )
+    if (!this.nodeLayer) {
+      this.nodeLayer = this.svg.append("g")
+        .attr("class", "nodes");
+    }
+
+    // 削除されたノードを取り除き、追加されたノードを描画する
+    let join = this.nodeLayer
       .selectAll("g")
-      .data(this.nodes)
-      .enter()
-      .append("g");
+      .data(this.nodes, (node) => this.nodeKey(node));
+    join.exit().remove();
 
-    return nodeGroup;
+    // 新しく追加されたノード ( 円とラベルの追加先 )
+    this.newNodeGroup = join.enter().append("g");
+
+    return this.newNodeGroup.merge(join);
+  }
+
+  /* 既存のノードの色とラベルを更新する */
+  updateNodeGroup() {
+    this.nodeGroup.select("circle")
+      .attr("stroke", this.setNodeColor);
+    this.nodeGroup.select("text")
+      .text(this.setLabel);
   }
 
   /* ノードの色を設定する */
@@ -150,7 +236,7 @@ class Force {
   /* ノードの円 (circle要素) を追加する */
   appendNodeCircles() {
 
-    let circles = this.nodeGroup.append("circle")
+    let circles = this.newNodeGroup.append("circle")
       .attr("r", 5)
       .attr("fill", "white")
       .attr("stroke", this.setNodeColor)
@@ -165,7 +251,7 @@ class Force {
   /* ラベルを表示する (text要素を追加する) */
   appendLabels() {
 
-    let labels = this.nodeGroup.append("text")
+    let labels = this.newNodeGroup.append("text")
      .text(this.setLabel)
      .attr("x", 8)
      .attr("y", 3)
@@ -219,6 +305,185 @@ class Force {
 
   };
 
+  /* ノードとリンクを入れ替える ( 座標は同じキーのノードから引き継ぐ ) */
+  replaceData(nodes, links) {
+
+    let prev = new Map(this.nodes.map((n) => [this.nodeKey(n), n]));
+    nodes.forEach((node) => {
+      let old = prev.get(this.nodeKey(node));
+      if (old) {
+        node.x = old.x;
+        node.y = old.y;
+        node.vx = old.vx;
+        node.vy = old.vy;
+      }
+    });
+
+    this.nodes = nodes;
+    this.links = links;
+    this.draw();
+    this.restart();
+  }
+
+  /**
+   * サーバーから取得した差分 ( concern_delta_json ) を反映する
+   * 差分のノード/リンクはノードの ID ( nid ) で表される
+   * ( ルートへの接続はノードの to_root で表される )
+   */
+  applyDelta(delta) {
+
+    // 履歴が残っていない場合は全体が返される
+    if (delta.full) {
+      this.replaceData(delta.nodes, delta.links);
+      return;
+    }
+
+    // nid => ノード
+    let root = null;
+    let byNid = new Map();
+    this.nodes.forEach((node) => {
+      if (node.is_root) root = node;
+      else byNid.set(node.nid, node);
+    });
+
+    // 関心事 ( ルート ) の内容の変更を反映する
+    if (root && delta.content !== undefined) {
+      root.content = delta.content;
+    }
+
+    // 削除されたノードと、そのノードのリンクを取り除く
+    let removed = new Set(delta.removed_nodes);
+    this.nodes = this.nodes.filter((n) => !removed.has(n.nid));
+    this.links = this.links.filter((l) => {
+      return !removed.has(l.source.nid) && !removed.has(l.target.nid);
+    });
+
+    // 削除されたリンクを取り除く
+    let removedLinks = new Set(
+      delta.removed_links.map((l) => `${l.source}-${l.target}`));
+    this.links = this.links.filter((l) => {
+      return !removedLinks.has(`${l.source.nid}-${l.target.nid}`);
+    });
+
+    // 追加/変更されたノードを反映する
+    let nextId = d3.max(this.nodes, (n) => n.id) + 1;
+    delta.nodes.forEach((n) => {
+      let node = byNid.get(n.nid);
+      if (node) {
+        node.content = n.content;
+        node.node_type = n.node_type;
+      } else {
+        node = {
+          id: nextId++,
+          nid: n.nid,
+          content: n.content,
+          is_root: false,
+          node_type: n.node_type,
+          x: this.width / 2,
+          y: this.height / 2,
+        };
+        this.nodes.push(node);
+        byNid.set(n.nid, node);
+      }
+
+      // ルートへの接続を付け直す
+      this.links = this.links.filter((l) => {
+        return !(l.source === node && l.target === root);
+      });
+      if (n.to_root) {
+        this.links.push({ source: node, target: root, node_type: 0 });
+      }
+
+      // 接続元のノードタイプをリンクに反映する
+      this.links.forEach((l) => {
+        if (l.source === node && l.target !== root) {
+          l.node_type = node.node_type;
+        }
+      });
+    });
+
+    // 追加されたリンクを反映する
+    let linkKeys = new Set(this.links.map((l) => this.linkKey(l)));
+    delta.links.forEach((l) => {
+      let source = byNid.get(l.source);
+      let target = byNid.get(l.target);
+      if (!source || !target) return;
+
+      let link = { source: source, target: target,
+        node_type: source.node_type };
+      if (linkKeys.has(this.linkKey(link))) return;
+
+      this.links.push(link);
+      linkKeys.add(this.linkKey(link));
+    });
+
+    this.draw();
+    this.restart();
+  }
+
+  /**
+   * グラフの変更の通知 ( Server-Sent Events、concern_events ) を購読し、
+   * 届いた差分をそのまま反映する
+   * version  .. 描画しているグラフのバージョン
+   * deltaUrl .. 差分 ( concern_delta_json ) の URL
+   * 通知を取りこぼした場合 ( 再接続、resync ) は差分を取得し直す
+   */
+  subscribe(eventsUrl, deltaUrl, version) {
+
+    this.version = version;
+    this.deltaUrl = deltaUrl;
+
+    // EventSource が使えないブラウザーでは自分の変更だけを反映する
+    if (!window.EventSource) return;
+
+    this.events = new EventSource(eventsUrl);
+
+    // 接続時 ( 再接続を含む ) の現在のバージョン
+    this.events.addEventListener("hello", (e) => {
+      if (JSON.parse(e.data).version > this.version) this.fetchDelta();
+    });
+
+    // 1 回分の変更 ( since → version )
+    this.events.addEventListener("delta", (e) => {
+      let delta = JSON.parse(e.data);
+      if (delta.version <= this.version) return;    // 反映済み
+
+      if (delta.since === this.version) {
+        this.applyDelta(delta);
+        this.version = delta.version;
+      } else {
+        this.fetchDelta();
+      }
+    });
+
+    // サーバー側で通知が溢れた
+    this.events.addEventListener("resync", () => { this.fetchDelta(); });
+  }
+
+  /* バージョン this.version 以降の差分を取得して反映する */
+  fetchDelta() {
+
+    // 取得中なら終わってからもう一度取得する
+    if (this.fetching) {
+      this.refetch = true;
+      return;
+    }
+    this.fetching = true;
+
+    $.getJSON(this.deltaUrl, { since: this.version }, (delta) => {
+      if (delta.version > this.version || delta.full) {
+        this.applyDelta(delta);
+        this.version = delta.version;
+      }
+    }).always(() => {
+      this.fetching = false;
+      if (this.refetch) {
+        this.refetch = false;
+        this.fetchDelta();
+      }
+    });
+  }
+
   /* ドラッグ開始時の処理 */
   onDragStart(node) {
     if (!d3.event.active) {
@@ -258,4 +523,121 @@ class Force {
 
   }
 
+}
+
+
+/* concern_detail_json のバイナリ形式 ( graph/binary.py ) */
+const GRAPH_MEDIA_TYPE = "application/vnd.mindgraph.graph";
+
+/**
+ * バイナリ形式 ( ArrayBuffer ) を JSON と同じ形 ( nodes, links, version )
+ * に変換する
+ * 配列はリトルエンディアンで 4 バイト境界に揃っているので、
+ * Uint32Array などでコピーせずに読む ( ビッグエンディアンの環境は DataView )
+ */
+function decodeGraph(buffer) {
+
+  let view = new DataView(buffer);
+  let magic = String.fromCharCode(
+    view.getUint8(0), view.getUint8(1), view.getUint8(2), view.getUint8(3));
+  if (magic !== "MGRF" || view.getUint16(4, true) !== 1) {
+    throw new Error("Not a graph payload");
+  }
+
+  let flags = view.getUint16(6, true);
+  let version = view.getUint32(8, true);
+  let n = view.getUint32(12, true);
+  let m = view.getUint32(16, true);
+  let stringsSize = view.getUint32(20, true);
+
+  let littleEndian = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+  let offset = 24;
+  let align = () => { offset += (4 - offset % 4) % 4; };
+
+  // Uint32 / Float32 の配列を読む
+  let read = (TypedArray, count) => {
+    let array;
+    if (littleEndian) {
+      array = new TypedArray(buffer, offset, count);
+    } else {
+      let get = TypedArray === Float32Array ? "getFloat32" : "getUint32";
+      array = new TypedArray(count);
+      for (let i = 0; i < count; i++) {
+        array[i] = view[get](offset + i * 4, true);
+      }
+    }
+    offset += count * 4;
+    return array;
+  };
+
+  let nids = read(Uint32Array, n);
+  let nodeTypes = new Uint8Array(buffer, offset, n);
+  offset += n;
+  align();
+  let offsets = read(Uint32Array, n + 1);
+  let strings = new Uint8Array(buffer, offset, stringsSize);
+  offset += stringsSize;
+  align();
+  let sources = read(Uint32Array, m);
+  let targets = read(Uint32Array, m);
+
+  let xs = null;
+  let ys = null;
+  if (flags & 1) {
+    xs = read(Float32Array, n);
+    ys = read(Float32Array, n);
+  }
+
+  // ノード ( 0 番目がルート )
+  let decoder = new TextDecoder("utf-8");
+  let nodes = new Array(n);
+  for (let i = 0; i < n; i++) {
+    let node = {
+      id: i,
+      content: decoder.decode(strings.subarray(offsets[i], offsets[i + 1])),
+      is_root: i === 0,
+      node_type: nodeTypes[i],
+    };
+    if (i > 0) node.nid = nids[i];
+    if (xs) {
+      node.x = xs[i];
+      node.y = ys[i];
+    }
+    nodes[i] = node;
+  }
+
+  // 接続 ( node_type は接続元のもの、ルートへの接続は 0 )
+  let links = new Array(m);
+  for (let k = 0; k < m; k++) {
+    let target = targets[k];
+    links[k] = {
+      source: sources[k],
+      target: target,
+      node_type: target === 0 ? 0 : nodeTypes[sources[k]],
+    };
+  }
+
+  return { nodes: nodes, links: links, version: version };
+}
+
+/**
+ * concern_detail_json を取得する
+ * fetch と TextDecoder が使えればバイナリ形式、なければ JSON
+ */
+function loadGraph(url, callback) {
+
+  if (!window.fetch || !window.TextDecoder) {
+    $.getJSON(url, callback);
+    return;
+  }
+
+  fetch(url, {
+    credentials: "same-origin",
+    headers: { "Accept": GRAPH_MEDIA_TYPE },
+  }).then((response) => {
+    if (!response.ok) throw new Error(`${response.status}`);
+    return response.arrayBuffer();
+  }).then((buffer) => {
+    callback(decodeGraph(buffer));
+  });
 }
\ No newline at end of file
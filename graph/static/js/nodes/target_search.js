@@ -0,0 +1,90 @@
+/**
+ *
+ * js/nodes/target_search.js
+ *
+ * 接続先の選択 ( TargetSearchWidget )
+ * 候補は検索して追加する ( 全てのノードを <option> にしない )
+ *
+ */
+(function () {
+
+  // モーダルダイアログに読み込まれるたびに実行されるので、一度だけ登録する
+  if (window.targetSearchInstalled) {
+    return;
+  }
+  window.targetSearchInstalled = true;
+
+  let timer = null;
+
+  /* 候補を検索して一覧に表示する */
+  function search(input, after, append) {
+    let list = input.nextElementSibling;
+    let params = new URLSearchParams({ q: input.value });
+    if (after !== undefined) {
+      params.set("after", after);
+    }
+
+    fetch(`${input.dataset.searchUrl}?${params}`, { credentials: "same-origin" })
+      .then((response) => response.json())
+      .then((data) => {
+        if (!append) {
+          list.innerHTML = "";
+        }
+        let more = list.querySelector(".target-more");
+        if (more) {
+          more.remove();
+        }
+
+        data["results"].forEach((node) => {
+          let item = document.createElement("li");
+          item.className = "target-candidate";
+          item.dataset.id = node["id"];
+          item.textContent = node["content"];
+          list.appendChild(item);
+        });
+
+        // 続きがあれば「さらに表示」を付ける
+        if (data["next"] !== null) {
+          let item = document.createElement("li");
+          item.className = "target-more";
+          item.dataset.after = data["next"];
+          item.textContent = "さらに表示";
+          list.appendChild(item);
+        }
+      });
+  }
+
+  document.addEventListener("input", (e) => {
+    let input = e.target;
+    if (!input.classList || !input.classList.contains("target-search")) {
+      return;
+    }
+    clearTimeout(timer);
+    timer = setTimeout(() => search(input), 200);
+  });
+
+  document.addEventListener("click", (e) => {
+    let item = e.target;
+    let list = item.parentElement;
+    if (!list || !list.classList.contains("target-candidates")) {
+      return;
+    }
+    let input = list.previousElementSibling;
+
+    if (item.classList.contains("target-more")) {
+      search(input, item.dataset.after, true);
+      return;
+    }
+
+    // 選択済みの <option> として追加する
+    let select = document.getElementById(input.dataset.select);
+    let option = select.querySelector(`option[value="${item.dataset.id}"]`);
+    if (!option) {
+      option = new Option(item.textContent, item.dataset.id);
+      select.appendChild(option);
+    }
+    option.selected = true;
+    item.remove();
+  });
+
+}());
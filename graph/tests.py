@@ -1,3 +1,1902 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from unittest import mock, skipUnless
+
+from django.db import OperationalError, connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import traversal, closure, analytics, transfer, pagination, search,\
+instrumentation, benchmarks, metrics, profiling, routers, asgi, events,\
+binary, serializers, counters
+from .models import Concern, Node, NodeClosure, GraphChange, \
+    deleting_concerns
+from .services import build_concern_graph, build_graph_delta
+from .cache import get_graph_cache, stats as cache_stats
+from .layout import attach_layout
+from .benchmarks.transports import asgi_request, compare_transports, \
+make_scope
+from .adjacency import get_concern_graph, graphs as adjacency_graphs
+
 
 # Create your tests here.
+def create_chain(user, concern, size, node_type=Node.NORMAL):
+    """一直線に接続したノードを作成する ( 先頭がルートに接続 )"""
+    nodes = []
+    for i in range(size):
+        node = Node.objects.create(
+            user=user,
+            concern=concern,
+            content="node %d" % i,
+            to_root=(i == 0),
+            node_type=node_type,
+        )
+        if nodes:
+            node.targets.add(nodes[-1])
+        nodes.append(node)
+    return nodes
+
+
+class GraphTestCase(TestCase):
+    """グラフ関連のテストの共通処理"""
+
+    def setUp(self):
+        # ID が使い回されるので、プロセス内のキャッシュを空にしておく
+        get_graph_cache().clear()
+        adjacency_graphs.clear()
+
+        self.user = User.objects.create_user("alice", password="pw")
+        self.client.force_login(self.user)
+        self.concern = Concern.objects.create(
+            user=self.user,
+            content="なぜ遅いのか",
+            concern_type=Concern.ANALYZE,
+        )
+
+
+class ConcernGraphTests(GraphTestCase):
+    """build_concern_graph() / concern_detail_json のテスト"""
+
+    def test_payload_shape(self):
+        nodes = create_chain(self.user, self.concern, 3)
+        payload = build_concern_graph(self.concern)
+
+        self.assertEqual(payload["nodes"][0], {
+            "id": 0,
+            "content": "なぜ遅いのか",
+            "is_root": True,
+            "node_type": 0,
+        })
+        self.assertEqual(
+            [n["nid"] for n in payload["nodes"][1:]],
+            [n.id for n in nodes])
+        self.assertEqual(payload["links"], [
+            {"source": 1, "target": 0, "node_type": 0},
+            {"source": 2, "target": 1, "node_type": 0},
+            {"source": 3, "target": 2, "node_type": 0},
+        ])
+
+    def test_constant_queries(self):
+        create_chain(self.user, self.concern, 30)
+        self.concern.refresh_from_db()
+        with self.assertNumQueries(2):
+            build_concern_graph(self.concern)
+
+    def test_json_view(self):
+        create_chain(self.user, self.concern, 2)
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["links"]), 2)
+
+
+class GraphVersionCacheTests(GraphTestCase):
+    """グラフのバージョン / キャッシュ / ETag のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        cache_stats.reset()
+        self.url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+
+    def version(self):
+        self.concern.refresh_from_db()
+        return self.concern.graph_version
+
+    def test_version_bumped_by_writes(self):
+        a, b = create_chain(self.user, self.concern, 2)
+        before = self.version()
+        b.targets.remove(a)
+        self.assertEqual(self.version(), before + 1)
+        a.sources.add(b)
+        self.assertEqual(self.version(), before + 2)
+        b.delete()
+        self.assertEqual(self.version(), before + 3)
+
+    def test_conditional_get(self):
+        create_chain(self.user, self.concern, 3)
+        first = self.client.get(self.url)
+        etag = first["ETag"]
+
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(second.status_code, 304)
+
+        with self.assertNumQueries(1):
+            third = self.client.get(self.url)
+        self.assertEqual(third.content, first.content)
+        self.assertEqual(cache_stats.as_dict(),
+            {"hits": 1, "misses": 1, "evictions": 0})
+
+        Node.objects.create(user=self.user, concern=self.concern,
+            content="new")
+        fourth = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(fourth.status_code, 200)
+        self.assertNotEqual(fourth["ETag"], etag)
+        self.assertEqual(len(fourth.json()["nodes"]), 5)
+
+    def test_weak_etag_with_layout(self):
+        # 座標はプロセスごとの直前のレイアウトに依るので弱い ETag
+        create_chain(self.user, self.concern, 3)
+        etag = self.client.get(self.url)["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag[2:])
+        self.assertEqual(response.status_code, 304)
+
+        with self.settings(GRAPH_LAYOUT=False):
+            get_graph_cache().clear()
+            response = self.client.get(self.url)
+            self.assertEqual(response["ETag"], etag[2:])
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+
+    def test_renamed_concern(self):
+        create_chain(self.user, self.concern, 1)
+        before = self.version()
+        first = self.client.get(self.url)
+
+        # 内容 ( ルート ) が変われば、キャッシュと ETag を使わない
+        self.concern.content = "なぜ速いのか"
+        self.concern.save()
+        self.assertEqual(self.version(), before + 1)
+        second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json()["nodes"][0]["content"], "なぜ速いのか")
+
+        delta = self.client.get(reverse("graph:concern-delta-json",
+            kwargs={"pk": self.concern.id}), {"since": before}).json()
+        self.assertEqual(delta["content"], "なぜ速いのか")
+
+        # 内容が同じなら増やさない
+        self.concern.save()
+        self.assertEqual(self.version(), before + 1)
+
+    def test_missing_concern(self):
+        url = reverse("graph:concern-detail-json", kwargs={"pk": 999})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class ConcernDetailTableTests(GraphTestCase):
+    """関心事の詳細のノードの表 ( グラフのバージョンごとのキャッシュ ) のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        self.url = reverse("graph:concern-detail",
+            kwargs={"pk": self.concern.id})
+
+    def test_cached_until_changed(self):
+        nodes = create_chain(self.user, self.concern, 3)
+        first = self.client.get(self.url)
+        for node in nodes:
+            self.assertContains(first, reverse("graph:node-edit",
+                kwargs={"concern_id": self.concern.id, "pk": node.id}))
+            self.assertContains(first, reverse("graph:node-new-target",
+                kwargs={"concern_id": self.concern.id, "source_id": node.id}))
+
+        # 2 回目はノードを読まない ( 関心事のみ )
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+
+        Node.objects.create(user=self.user, concern=self.concern,
+            content="<new>")
+        third = self.client.get(self.url)
+        self.assertContains(third, "&lt;new&gt;")
+
+    def test_escaped_content(self):
+        Node.objects.create(user=self.user, concern=self.concern,
+            content="<script>alert(1)</script>")
+        response = self.client.get(self.url)
+        self.assertNotContains(response, "<script>alert(1)</script>")
+        self.assertContains(response, "&lt;script&gt;")
+
+
+class GraphDeltaTests(GraphTestCase):
+    """build_graph_delta() / concern_delta_json のテスト"""
+
+    def delta(self, since):
+        self.concern.refresh_from_db()
+        return build_graph_delta(self.concern, since)
+
+    def test_changes_since_version(self):
+        a, b, c = create_chain(self.user, self.concern, 3)
+        since = self.delta(0)["version"]
+
+        c.content = "changed"
+        c.save()
+        c.targets.remove(b)
+        c.targets.add(a)
+        b_id = b.id
+        b.delete()
+        d = Node.objects.create(user=self.user, concern=self.concern,
+            content="d", to_root=True)
+
+        delta = self.delta(since)
+        self.assertFalse(delta["full"])
+        self.assertEqual(delta["removed_nodes"], [b_id])
+        self.assertEqual(
+            sorted((n["nid"], n["content"]) for n in delta["nodes"]),
+            [(c.id, "changed"), (d.id, "d")])
+        self.assertEqual(delta["links"],
+            [{"source": c.id, "target": a.id}])
+        self.assertEqual(delta["removed_links"],
+            [{"source": c.id, "target": b_id}])
+
+    @override_settings(GRAPH_HISTORY_SIZE=2)
+    def test_full_snapshot_after_pruning(self):
+        create_chain(self.user, self.concern, 3)
+        delta = self.delta(0)
+        self.assertTrue(delta["full"])
+        self.assertEqual(len(delta["nodes"]), 4)
+
+    def test_ajax_edit_then_delta(self):
+        a, = create_chain(self.user, self.concern, 1)
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        version = self.client.get(url).json()["version"]
+
+        new_target = reverse("graph:node-new-target",
+            kwargs={"concern_id": self.concern.id, "source_id": a.id})
+        response = self.client.post(new_target, {"content": "b"},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest")
+        self.assertEqual(response.status_code, 204)
+
+        url = reverse("graph:concern-delta-json",
+            kwargs={"pk": self.concern.id})
+        delta = self.client.get(url, {"since": version}).json()
+        b = Node.objects.get(content="b")
+        self.assertEqual([n["nid"] for n in delta["nodes"]], [b.id])
+        self.assertEqual(delta["links"],
+            [{"source": a.id, "target": b.id}])
+
+
+class GraphLayoutTests(GraphTestCase):
+    """attach_layout() のテスト"""
+
+    def test_layout_is_seeded_by_previous_layout(self):
+        nodes = create_chain(self.user, self.concern, 20)
+        first = attach_layout(self.concern.id,
+            build_concern_graph(self.concern))
+        for node in first["nodes"]:
+            self.assertIn("x", node)
+            self.assertIn("y", node)
+
+        # 1 ノード追加しただけなら既存のノードはほとんど動かない
+        node = Node.objects.create(user=self.user, concern=self.concern,
+            content="new")
+        node.targets.add(nodes[-1])
+        self.concern.refresh_from_db()
+        second = attach_layout(self.concern.id,
+            build_concern_graph(self.concern))
+        moved = max(
+            abs(a["x"] - b["x"]) + abs(a["y"] - b["y"])
+            for a, b in zip(first["nodes"], second["nodes"]))
+        self.assertLess(moved, 2.0)
+        self.assertEqual(len(second["nodes"]), 22)
+
+    @override_settings(GRAPH_LAYOUT_MAX_NODES=5)
+    def test_large_graph_has_no_layout(self):
+        create_chain(self.user, self.concern, 5)
+        payload = attach_layout(self.concern.id,
+            build_concern_graph(self.concern))
+        self.assertNotIn("x", payload["nodes"][0])
+
+
+class ConcernGraphAdjacencyTests(GraphTestCase):
+    """ConcernGraph ( CSR 形式の隣接リスト ) のテスト"""
+
+    def test_csr(self):
+        a, b, c = create_chain(self.user, self.concern, 3)
+        c.targets.add(a)
+        self.concern.refresh_from_db()
+        graph = get_concern_graph(self.concern)
+
+        ia, ib, ic = [graph.index_of(n.id) for n in (a, b, c)]
+        self.assertEqual(list(graph.targets_of(ic)), [ib, ia])
+        self.assertEqual(sorted(graph.sources_of(ia)), [ib, ic])
+        self.assertEqual(list(graph.to_root), [1, 0, 0])
+        self.assertEqual(graph.num_links, 3)
+        self.assertIsNone(graph.index_of(-1))
+        self.assertGreater(graph.nbytes, 0)
+
+    def test_cached_per_version(self):
+        create_chain(self.user, self.concern, 3)
+        self.concern.refresh_from_db()
+        graph = get_concern_graph(self.concern)
+        with self.assertNumQueries(0):
+            self.assertIs(get_concern_graph(self.concern), graph)
+
+        Node.objects.create(user=self.user, concern=self.concern,
+            content="new")
+        self.concern.refresh_from_db()
+        self.assertEqual(len(get_concern_graph(self.concern)), 4)
+        self.assertEqual(adjacency_graphs.info()["entries"], 1)
+
+
+class TraversalTests(GraphTestCase):
+    """graph/traversal.py ( 再帰 CTE ) のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        # a ( ルートに接続 ) <- b <- c <- d、 c -> a、 a -> d ( 循環 )
+        self.a, self.b, self.c, self.d = \
+            create_chain(self.user, self.concern, 4)
+        self.c.targets.add(self.a)
+        self.a.targets.add(self.d)
+
+    def nids(self, nodes):
+        return [(n["nid"], n["depth"]) for n in nodes]
+
+    def test_ancestors_and_descendants(self):
+        with self.assertNumQueries(1):
+            up = traversal.ancestors(self.c)
+        self.assertEqual(self.nids(up),
+            [(self.a.id, 1), (self.b.id, 1), (self.d.id, 2)])
+        self.assertEqual(self.nids(traversal.descendants(self.c, 1)),
+            [(self.d.id, 1)])
+
+    def test_neighborhood(self):
+        self.assertEqual(
+            [n["nid"] for n in traversal.neighborhood(self.b, 1)],
+            [self.a.id, self.c.id])
+
+    def test_paths_to_root(self):
+        paths = traversal.paths_to_root(self.d)
+        self.assertEqual(paths, [
+            [self.d.id, self.c.id, self.a.id],
+            [self.d.id, self.c.id, self.b.id, self.a.id],
+        ])
+
+    @override_settings(GRAPH_TRAVERSAL_MAX_ROWS=2000)
+    def test_paths_to_root_is_bounded(self):
+        # 幅 3 の層を 16 段、隣り合う層の間は全て接続する ( 経路は 3^15 本 )
+        # 先頭の層の 1 つと最後の層がルートに接続する
+        width, layers = 3, 16
+        nodes = [{"id": 0, "content": "start"}] + [
+            {"id": i, "content": "n%d" % i,
+                "to_root": i == 1 or i > width * (layers - 1)}
+            for i in range(1, width * layers + 1)]
+        links = [{"source": 0, "target": i} for i in range(1, width + 1)]
+        links += [{"source": width * layer + a, "target": width * layer + b}
+            for layer in range(layers - 1)
+            for a in range(1, width + 1)
+            for b in range(width + 1, 2 * width + 1)]
+        concern, timings = transfer.import_graph(self.user,
+            {"nodes": nodes, "links": links}, content="dense",
+            closure=False)
+        start = Node.objects.filter(concern=concern).order_by("id").first()
+
+        began = time.perf_counter()
+        paths = traversal.paths_to_root(start, limit=5)
+        self.assertLess(time.perf_counter() - began, 2.0)
+        self.assertEqual(paths, [[start.id, start.id + 1]])
+
+    def test_views(self):
+        kwargs = {"concern_id": self.concern.id, "pk": self.d.id}
+        response = self.client.get(
+            reverse("graph:node-ancestors-json", kwargs=kwargs),
+            {"depth": 1})
+        self.assertEqual([n["nid"] for n in response.json()["nodes"]],
+            [self.c.id])
+        response = self.client.get(
+            reverse("graph:node-paths-json", kwargs=kwargs))
+        self.assertEqual(len(response.json()["paths"]), 2)
+
+
+@override_settings(GRAPH_CLOSURE=True)
+class ClosureTests(GraphTestCase):
+    """到達可能性の表 ( NodeClosure ) のテスト"""
+
+    def closure_rows(self):
+        return set(NodeClosure.objects.filter(
+            concern=self.concern
+        ).values_list("descendant_id", "ancestor_id", "depth"))
+
+    def rebuilt_rows(self):
+        current = self.closure_rows()
+        closure.rebuild_closure(self.concern.id)
+        return current, self.closure_rows()
+
+    def test_incremental_matches_rebuild(self):
+        a, b, c, d = create_chain(self.user, self.concern, 4)
+        c.targets.add(a)    # 近道
+        a.sources.add(d)    # TargetNodeCreateView と同じ向き
+        current, rebuilt = self.rebuilt_rows()
+        self.assertEqual(current, rebuilt)
+        self.assertIn((d.id, a.id, 1), current)
+
+        # 接続/ノードの削除
+        d.targets.remove(a)
+        b.delete()
+        current, rebuilt = self.rebuilt_rows()
+        self.assertEqual(current, rebuilt)
+        self.assertFalse(closure.is_reachable(d.id, b.id))
+        self.assertTrue(closure.is_reachable(d.id, a.id))
+
+    def test_cycles_and_sizes(self):
+        a, b, c = create_chain(self.user, self.concern, 3)
+        a.targets.add(c)
+        current, rebuilt = self.rebuilt_rows()
+        self.assertEqual(current, rebuilt)
+        self.assertEqual(closure.subtree_sizes(self.concern.id),
+            {a.id: 2, b.id: 2, c.id: 2})
+        self.assertEqual(
+            closure.reachable_pairs(self.concern.id,
+                [(c.id, a.id), (a.id, c.id)]),
+            [True, True])
+
+    def test_shortcut_updates_depths_at_once(self):
+        nodes = create_chain(self.user, self.concern, 12)
+        # 先頭への近道で、末端側の 7 ノードの行の depth が短くなる
+        # ( 更新は 1 回の executemany() )
+        with self.assertNumQueries(14):
+            nodes[5].targets.add(nodes[0])
+        current, rebuilt = self.rebuilt_rows()
+        self.assertEqual(current, rebuilt)
+
+    @override_settings(GRAPH_CLOSURE_MAX_REBUILD=1)
+    def test_large_rebuild_is_deferred(self):
+        a, b, c = create_chain(self.user, self.concern, 3)
+        before = self.closure_rows()
+
+        # 影響を受けるノードが多ければリクエストの中では作り直さない
+        # ( コミット後に作り直す、TestCase ではコミットされない )
+        b.targets.remove(a)
+        self.assertEqual(self.closure_rows(), before)
+        current, rebuilt = self.rebuilt_rows()
+        self.assertNotIn((c.id, a.id, 2), rebuilt)
+
+    def test_concern_delete_and_command(self):
+        create_chain(self.user, self.concern, 3)
+        NodeClosure.objects.all().delete()
+        call_command("rebuild_closure", self.concern.id, stdout=StringIO())
+        self.assertEqual(len(self.closure_rows()), 6)
+
+        self.concern.delete()
+        self.assertFalse(NodeClosure.objects.exists())
+
+    def test_view(self):
+        a, b = create_chain(self.user, self.concern, 2)
+        url = reverse("graph:concern-reachability-json",
+            kwargs={"pk": self.concern.id})
+        response = self.client.get(url,
+            {"pairs": "%d-%d,%d-%d" % (b.id, a.id, a.id, b.id)})
+        self.assertEqual(
+            [r["reachable"] for r in response.json()["reachable"]],
+            [True, False])
+
+        with self.settings(GRAPH_CLOSURE=False):
+            self.assertEqual(self.client.get(url).status_code, 501)
+
+
+class AnalyticsTests(GraphTestCase):
+    """graph/analytics.py のテスト"""
+
+    def test_metrics(self):
+        # a ( ルートに接続 ) <- b <- c、 d <- a、 e は孤立
+        a, b, c = create_chain(self.user, self.concern, 3)
+        d = Node.objects.create(user=self.user, concern=self.concern,
+            content="d")
+        d.targets.add(c)
+        a.targets.add(d)    # a -> d -> c -> b -> a の循環
+        Node.objects.create(user=self.user, concern=self.concern,
+            content="e")
+        self.concern.refresh_from_db()
+
+        graph = get_concern_graph(self.concern)
+        columns = analytics.metrics_as_lists(graph)
+        self.assertEqual(columns["depth"], [1, 2, 3, 4, None])
+        self.assertEqual(columns["out_degree"], [2, 1, 1, 1, 0])
+        self.assertEqual(columns["in_degree"], [1, 1, 1, 1, 0])
+        self.assertEqual(columns["subtree_size"], [3, 2, 1, 0, 0])
+        self.assertEqual(columns["in_cycle"],
+            [True, True, True, True, False])
+        self.assertEqual(analytics.cycles(graph),
+            [sorted([a.id, b.id, c.id, d.id])])
+        self.assertGreater(columns["influence"][0],
+            columns["influence"][3])
+
+    def test_self_loop(self):
+        # 自分自身への接続も循環 ( 強連結成分の大きさは 1 )
+        a, b = create_chain(self.user, self.concern, 2)
+        b.targets.add(b)
+        self.concern.refresh_from_db()
+
+        graph = get_concern_graph(self.concern)
+        self.assertEqual(analytics.metrics_as_lists(graph)["in_cycle"],
+            [False, True])
+        self.assertEqual(analytics.cycles(graph), [[b.id]])
+
+    def test_views(self):
+        create_chain(self.user, self.concern, 3)
+        url = reverse("graph:concern-analytics-json",
+            kwargs={"pk": self.concern.id})
+        metrics = self.client.get(url).json()["metrics"]
+        self.assertEqual(metrics["subtree_size"], [2, 1, 0])
+
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        nodes = self.client.get(url).json()["nodes"]
+        self.assertEqual([n["depth"] for n in nodes[1:]], [1, 2, 3])
+
+
+class TransferTests(GraphTestCase):
+    """graph/transfer.py ( インポート/エクスポート ) のテスト"""
+
+    data = {
+        "concern": {"content": "imported", "concern_type": 0},
+        "nodes": [
+            {"id": "x", "content": "x", "to_root": True},
+            {"id": "y", "content": "y", "node_type": 1},
+            {"id": "z", "content": "z"},
+        ],
+        "links": [
+            {"source": "y", "target": "x"},
+            {"source": "z", "target": "y"},
+            {"source": "z", "target": "y"},
+        ],
+    }
+
+    def test_round_trip(self):
+        concern, timings = transfer.import_graph(self.user, self.data,
+            closure=True)
+        self.assertEqual(list(timings),
+            ["validate", "nodes", "remap", "links", "closure", "search"])
+
+        exported = transfer.export_graph(concern)
+        ids = {n["content"]: n["id"] for n in exported["nodes"]}
+        self.assertEqual(exported["concern"]["content"], "imported")
+        self.assertEqual(
+            [(n["content"], n["node_type"], n["to_root"])
+                for n in exported["nodes"]],
+            [("x", 0, True), ("y", 1, False), ("z", 0, False)])
+        self.assertEqual(exported["links"], [
+            {"source": ids["y"], "target": ids["x"]},
+            {"source": ids["z"], "target": ids["y"]},
+        ])
+        self.assertTrue(closure.is_reachable(ids["z"], ids["x"]))
+
+        # エクスポートしたものを CSV 経由でインポートし直す
+        out = StringIO()
+        transfer.export_graph_csv(concern, out)
+        again, timings = transfer.import_graph(self.user,
+            transfer.parse_csv(out.getvalue()), content="again")
+        self.assertEqual(len(transfer.export_graph(again)["links"]), 2)
+
+    def test_invalid_data(self):
+        data = dict(self.data, links=[{"source": "y", "target": "?"}])
+        with self.assertRaises(transfer.GraphImportError):
+            transfer.import_graph(self.user, data)
+        self.assertFalse(Concern.objects.filter(content="imported").exists())
+
+    @override_settings(GRAPH_CLOSURE=True)
+    def test_closure_deferred(self):
+        # 既定ではコミット後に作成する ( TestCase ではコミットされない )
+        concern, timings = transfer.import_graph(self.user, self.data)
+        self.assertNotIn("closure", timings)
+        self.assertFalse(NodeClosure.objects.filter(concern=concern).exists())
+
+    def test_strict_types(self):
+        def invalid(node, concern_type=Concern.ANALYZE):
+            data = {"nodes": [dict({"id": 1, "content": "a"}, **node)]}
+            with self.assertRaises(transfer.GraphImportError):
+                transfer.import_graph(self.user, data, content="c",
+                    concern_type=concern_type)
+
+        invalid({"to_root": "false"})
+        invalid({"node_type": Node.PLAN})
+        invalid({"node_type": Node.REVERSE}, Concern.SET_TARGET)
+        invalid({"node_type": True})
+        invalid({"node_type": [0]})
+        invalid({"content": 1})
+        invalid({"id": [1]})
+        with self.assertRaises(transfer.GraphImportError):
+            transfer.parse_csv("id,content,to_root\n1,a,maybe\n")
+
+        # 型の違う入れ物も GraphImportError ( ビューでは 400 )
+        for data in ([], {"concern": "c"}, {"concern": {"content": 1}},
+            {"nodes": {}}, {"nodes": ["a"]}, {"links": [1]},
+            {"nodes": [{"id": 1, "content": "a"}],
+                "links": [{"source": {}, "target": 1}]}):
+            with self.assertRaises(transfer.GraphImportError):
+                transfer.import_graph(self.user, data)
+            upload = SimpleUploadedFile("graph.json",
+                json.dumps(data).encode())
+            response = self.client.post(reverse("graph:concern-import"),
+                {"file": upload, "content": "c"})
+            self.assertEqual(response.status_code, 400)
+
+        concern, timings = transfer.import_graph(self.user,
+            {"nodes": [{"id": 1, "content": "a", "node_type": Node.DONE}]},
+            content="c", concern_type=Concern.SET_TARGET)
+        self.assertEqual(concern.node_set.get().node_type, Node.DONE)
+
+    def test_views(self):
+        upload = SimpleUploadedFile("graph.csv",
+            "id,content,node_type,to_root,targets\n"
+            "1,a,0,1,\n2,b,0,0,1\n".encode())
+        response = self.client.post(reverse("graph:concern-import"),
+            {"file": upload, "content": "csv"})
+        self.assertEqual(response.status_code, 201)
+        concern_id = response.json()["concern_id"]
+
+        response = self.client.get(reverse("graph:concern-export",
+            kwargs={"pk": concern_id}), {"format": "csv"})
+        header, a, b = csv.reader(StringIO(response.content.decode()))
+        self.assertEqual(header, list(transfer.CSV_FIELDS))
+        self.assertEqual(b[4], a[0])
+
+        # 他のユーザーの関心事はエクスポートできない
+        other = User.objects.create_user("bob", password="pw")
+        self.client.force_login(other)
+        response = self.client.get(reverse("graph:concern-export",
+            kwargs={"pk": concern_id}))
+        self.assertEqual(response.status_code, 404)
+
+        self.client.logout()
+        upload.seek(0)
+        response = self.client.post(reverse("graph:concern-import"),
+            {"file": upload, "content": "csv"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_commands(self):
+        concern, timings = transfer.import_graph(self.user, self.data)
+        out = StringIO()
+        call_command("export_graph", concern.id, stdout=out)
+        self.assertEqual(json.loads(out.getvalue())["nodes"][0]["content"],
+            "x")
+
+    def test_user_export(self):
+        transfer.import_graph(self.user, self.data)
+        transfer.import_graph(self.user, self.data, content="second")
+
+        response = self.client.get(reverse("graph:concern-export-all"))
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(json.loads(lines[0])["user"], self.user.username)
+        graphs = [json.loads(line) for line in lines[1:]]
+        self.assertEqual([g["concern"]["content"] for g in graphs][-2:],
+            ["imported", "second"])
+        self.assertEqual(len(graphs[-1]["nodes"]), 3)
+        self.assertEqual(len(graphs[-1]["links"]), 2)
+
+        out = StringIO()
+        call_command("export_user_graphs", self.user.username,
+            format="json", stdout=out)
+        exported = json.loads(out.getvalue())
+        self.assertEqual(len(exported["concerns"]), len(graphs))
+
+    def test_user_export_flush_size(self):
+        for i in range(3):
+            transfer.import_graph(self.user, self.data, content="c%d" % i)
+        expected = "".join(transfer.iter_user_export(self.user))
+
+        # 小さな関心事はまとめて返す ( 見出しと本体の 2 回 )
+        chunks = list(transfer.iter_user_export(self.user))
+        self.assertEqual(len(chunks), 2)
+
+        # 関心事の途中でも、文字数を超えたら返す
+        concerns = Concern.objects.filter(user=self.user).count()
+        for fmt in ("ndjson", "json"):
+            chunks = list(transfer.iter_user_export(self.user, fmt,
+                flush_size=50))
+            self.assertGreater(len(chunks), 2 * concerns)
+            fragments = [fragment
+                for concern in Concern.objects.filter(user=self.user)
+                for fragment in transfer.iter_concern_graph(concern)]
+            self.assertLess(max(len(chunk) for chunk in chunks),
+                50 + max(len(fragment) for fragment in fragments))
+        self.assertEqual("".join(transfer.iter_user_export(self.user,
+            flush_size=50)), expected)
+        json.loads("".join(chunks))
+
+
+@override_settings(GRAPH_CONCERN_PAGE_SIZE=2)
+class ConcernIndexTests(GraphTestCase):
+    """関心事の一覧 ( キーセット方式のページ分割 ) のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        for i in range(4):
+            Concern.objects.create(user=self.user, content="c%d" % i,
+                concern_type=Concern.ANALYZE)
+
+        # 作成日時が同じでも ID の順に並ぶ
+        Concern.objects.update(created_at=self.concern.created_at)
+
+    def test_pages(self):
+        contents = []
+        cursor = None
+        while True:
+            params = {"cursor": cursor} if cursor else {}
+            with self.assertNumQueries(3):    # セッション、ユーザー、一覧
+                response = self.client.get(
+                    reverse("graph:concern-index-json"), params)
+            data = response.json()
+            contents += [c["content"] for c in data["concerns"]]
+            cursor = data["next"]
+            if cursor is None:
+                break
+        self.assertEqual(contents, ["c3", "c2", "c1", "c0", "なぜ遅いのか"])
+
+        response = self.client.get(reverse("graph:concern-index"))
+        self.assertEqual(
+            [c.content for c in response.context["concern_list"]],
+            ["c3", "c2"])
+        response = self.client.get(reverse("graph:concern-index"),
+            {"cursor": response.context["next_cursor"]})
+        self.assertEqual(
+            [c.content for c in response.context["concern_list"]],
+            ["c1", "c0"])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(pagination.InvalidCursor):
+            pagination.decode_cursor("???")
+        response = self.client.get(reverse("graph:concern-index-json"),
+            {"cursor": "bm9wZQ"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConcernCountersTests(GraphTestCase):
+    """関心事ごとの集計 ( graph/counters.py ) のテスト"""
+
+    def counts(self, concern=None):
+        concern = concern or self.concern
+        concern.refresh_from_db()
+        return {name: getattr(concern, name) for name in counters.COUNTERS}
+
+    def test_kept_by_writes(self):
+        a, b, c = create_chain(self.user, self.concern, 3,
+            node_type=Node.PLAN)
+        self.assertEqual(self.counts(), {"node_count": 3, "link_count": 2,
+            "plan_count": 3, "done_count": 0})
+        self.assertIsNotNone(self.concern.last_activity_at)
+
+        b.node_type = Node.DONE
+        b.save()
+        a.targets.add(c)
+        a.targets.remove(c, b)      # b への接続は存在しない
+        self.assertEqual(self.counts(), {"node_count": 3, "link_count": 2,
+            "plan_count": 2, "done_count": 1})
+
+        c.sources.clear()
+        b.delete()
+        self.assertEqual(self.counts(), {"node_count": 2, "link_count": 0,
+            "plan_count": 2, "done_count": 0})
+        self.assertEqual(counters.reconcile([self.concern.id]), [])
+
+    def test_concern_delete(self):
+        a, b, c = create_chain(self.user, self.concern, 3)
+
+        # 削除に失敗しても、削除中の状態は残らない
+        with mock.patch.object(search, "search_enabled", return_value=True), \
+                mock.patch.object(search, "remove_concern",
+                    side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.concern.delete()
+        self.assertEqual(self.concern.node_set.count(), 3)
+        self.assertEqual(deleting_concerns.get(), frozenset())
+        c.delete()
+        self.assertEqual(self.counts()["node_count"], 2)
+
+        # 連鎖して削除されるノードは、ノードごとに処理しない
+        Concern.objects.filter(pk=self.concern.id).delete()
+        self.assertFalse(Node.objects.exists())
+        self.assertFalse(GraphChange.objects.exists())
+
+        other = Concern.objects.create(user=self.user, content="other",
+            concern_type=Concern.ANALYZE)
+        create_chain(self.user, other, 2)
+        self.user.delete()
+        self.assertFalse(Concern.objects.exists())
+        self.assertFalse(GraphChange.objects.exists())
+
+    def test_import_and_reconcile(self):
+        concern, timings = transfer.import_graph(self.user, {
+            "nodes": [{"id": i, "content": "n%d" % i,
+                "node_type": [Node.NORMAL, Node.PLAN, Node.DONE][i % 3]}
+                for i in range(8)],
+            "links": [{"source": i, "target": i - 1} for i in range(1, 8)],
+        }, content="imported", concern_type=Concern.SET_TARGET,
+            closure=False)
+        expected = {"node_count": 8, "link_count": 7, "plan_count": 3,
+            "done_count": 2}
+        self.assertEqual(self.counts(concern), expected)
+
+        # シグナルを通らない書き込みによるずれを直す
+        Concern.objects.filter(pk=concern.id).update(node_count=0,
+            link_count=100)
+        out = StringIO()
+        call_command("reconcile_counters", "--dry-run", stdout=out)
+        self.assertIn("node_count 0 -> 8", out.getvalue())
+        self.assertEqual(self.counts(concern)["node_count"], 0)
+
+        call_command("reconcile_counters", "--batch-size", "1",
+            stdout=StringIO())
+        self.assertEqual(self.counts(concern), expected)
+
+    def test_index_renders_counters(self):
+        self.concern.concern_type = Concern.SET_TARGET
+        self.concern.save()
+        create_chain(self.user, self.concern, 2, node_type=Node.DONE)
+
+        with self.assertNumQueries(3):    # セッション、ユーザー、一覧
+            response = self.client.get(reverse("graph:concern-index"))
+        self.assertContains(response, "ノード 2 / 接続 1")
+        self.assertContains(response, "実行済み 2")
+
+        data = self.client.get(reverse("graph:concern-index-json")).json()
+        self.assertEqual(data["concerns"][0]["node_count"], 2)
+        self.assertEqual(data["concerns"][0]["done_count"], 2)
+
+
+def explain_query_plan(queryset):
+    """
+    SQLite の EXPLAIN QUERY PLAN の結果 ( detail 列のリスト )
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+@skipUnless(connection.vendor == "sqlite", "EXPLAIN QUERY PLAN is SQLite")
+class QueryPlanTests(GraphTestCase):
+    """よく使うクエリがテーブル全体を走査しないことを確かめる"""
+
+    # 全体の走査を禁止するテーブル ( 再帰 CTE、副問い合わせなどは除く )
+    tables = ("graph_concern", "graph_node", "graph_node_targets",
+        "graph_graphchange", "graph_nodeclosure")
+
+    def assertNoFullScan(self, queryset):
+        plan = explain_query_plan(queryset)
+        for detail in plan:
+            words = detail.split()
+            if words[0] == "SCAN" and words[1] in self.tables:
+                self.fail("full scan of %s:\n%s" % (
+                    words[1], "\n".join(plan)))
+
+    def hot_queries(self):
+        """( 名前, クエリ ) のリスト"""
+        nodes = create_chain(self.user, self.concern, 3)
+        node = nodes[1]
+        Through = Node.targets.through
+        return [
+            ("concern nodes", Node.objects.filter(
+                concern_id=self.concern.id
+            ).order_by("created_at", "id").values_list("id", "content")),
+            ("concern links", Through.objects.filter(
+                from_node__concern_id=self.concern.id
+            ).order_by("id").values_list("from_node_id", "to_node_id")),
+            ("target choices", Node.objects.filter(
+                user=self.user, concern__id=self.concern.id
+            ).exclude(pk=node.id)),
+            ("targets", node.targets.all()),
+            ("sources", node.sources.all()),
+            ("concern index", Concern.objects.filter(
+                user=self.user
+            ).order_by("-created_at", "-id")[:50]),
+            ("graph changes", GraphChange.objects.filter(
+                concern_id=self.concern.id, version__gt=1
+            ).order_by("version", "id")),
+            ("closure ancestors", NodeClosure.objects.filter(
+                descendant_id=node.id)),
+            ("closure descendants", NodeClosure.objects.filter(
+                ancestor_id=node.id)),
+        ]
+
+    def test_hot_queries(self):
+        for name, queryset in self.hot_queries():
+            with self.subTest(name):
+                self.assertNoFullScan(queryset)
+
+
+@override_settings(GRAPH_AUTOCOMPLETE_PAGE_SIZE=2)
+class TargetCandidatesTests(GraphTestCase):
+    """接続先の候補の検索 / NodeEditView のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        self.nodes = create_chain(self.user, self.concern, 5)
+        self.node = self.nodes[0]
+        self.url = reverse("graph:node-target-candidates", kwargs={
+            "concern_id": self.concern.id, "pk": self.node.id})
+
+    def test_search(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual([r["id"] for r in data["results"]],
+            [n.id for n in self.nodes[1:3]])
+        data = self.client.get(self.url, {"after": data["next"]}).json()
+        self.assertEqual([r["id"] for r in data["results"]],
+            [n.id for n in self.nodes[3:5]])
+
+        data = self.client.get(self.url, {"q": "4"}).json()
+        self.assertEqual(data, {"results": [
+            {"id": self.nodes[4].id, "content": self.nodes[4].content},
+        ], "next": None})
+
+    def test_edit_form_renders_selected_only(self):
+        edit_url = reverse("graph:node-edit", kwargs={
+            "concern_id": self.concern.id, "pk": self.nodes[1].id})
+        response = self.client.get(edit_url)
+        self.assertContains(response,
+            '<option value="%d" selected>node 0</option>' % self.node.id,
+            html=True)
+        self.assertNotContains(response, "node 3")
+
+        response = self.client.post(edit_url, {
+            "concern": self.concern.id,
+            "targets": [self.nodes[4].id],
+            "content": "edited",
+            "node_type": Node.NORMAL,
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(self.nodes[1].targets.all()), [self.nodes[4]])
+
+
+class SearchTests(GraphTestCase):
+    """graph/search.py ( 全文検索 ) のテスト"""
+
+    def results(self, q, user=None):
+        return [(r["kind"], r["content"])
+            for r in search.search(user or self.user, q)]
+
+    def test_search(self):
+        Node.objects.create(user=self.user, concern=self.concern,
+            content="データベースが遅い")
+        node = Node.objects.create(user=self.user, concern=self.concern,
+            content="Slow Query")
+
+        self.assertEqual(self.results("データベース"),
+            [("node", "データベースが遅い")])
+        self.assertEqual(sorted(self.results("遅")), [
+            ("concern", "なぜ遅いのか"), ("node", "データベースが遅い")])
+        self.assertEqual(self.results("ｓｌｏｗ"), [("node", "Slow Query")])
+        self.assertEqual(self.results("遅い ベース"),
+            [("node", "データベースが遅い")])
+        self.assertEqual(self.results("\"*"), [])
+        # ユーザーと関心事のトークン ( keys 列 ) には一致しない
+        self.assertEqual(self.results("c"), [])
+
+        # 他のユーザーのものは返さない
+        other = User.objects.create_user("bob", password="pw")
+        self.assertEqual(self.results("遅", other), [])
+        self.assertEqual(self.results("遅", AnonymousUser()), [])
+        self.client.logout()
+        response = self.client.get(reverse("graph:search-json"), {"q": "遅"})
+        self.assertEqual(response.json(), {"results": []})
+        self.client.force_login(self.user)
+
+        # 編集/削除に追従する
+        node.content = "Fast Query"
+        node.save()
+        self.assertEqual(self.results("slow"), [])
+        node.delete()
+        self.assertEqual(self.results("query"), [])
+        self.concern.delete()
+        self.assertEqual(self.results("遅"), [])
+
+    def test_concern_cascade(self):
+        create_chain(self.user, self.concern, 3)
+        other = Concern.objects.create(user=self.user, content="別の関心事",
+            concern_type=Concern.ANALYZE)
+        Node.objects.create(user=self.user, concern=other, content="node")
+
+        # ノードごとではなく、関心事ごとに 1 回で削除する
+        with CaptureQueriesContext(connection) as queries:
+            self.concern.delete()
+        deletes = [q for q in queries.captured_queries
+            if q["sql"].startswith("DELETE FROM graph_search")]
+        self.assertEqual(len(deletes), 1)
+        self.assertEqual(self.results("node"), [("node", "node")])
+
+    def test_import_and_rebuild(self):
+        transfer.import_graph(self.user, TransferTests.data,
+            content="インポート")
+        self.assertEqual(len(self.results("y")), 1)
+
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM graph_search")
+        call_command("rebuild_search_index", stdout=StringIO())
+        self.assertEqual(len(self.results("y")), 1)
+
+        response = self.client.get(reverse("graph:search-json"),
+            {"q": "インポート"})
+        self.assertEqual(response.json()["results"][0]["kind"], "concern")
+
+    def test_limit(self):
+        for i in range(3):
+            Node.objects.create(user=self.user, concern=self.concern,
+                content="遅い %d" % i)
+        url = reverse("graph:search-json")
+
+        def count(limit):
+            response = self.client.get(url, {"q": "遅い", "limit": limit})
+            self.assertEqual(response.status_code, 200)
+            return len(response.json()["results"])
+
+        # 0 以下は 1 件 ( LIMIT -1 で全件を返さない )
+        self.assertEqual(count(0), 1)
+        self.assertEqual(count(-1), 1)
+        self.assertEqual(count(2), 2)
+        with mock.patch.object(search, "using_fts", return_value=False):
+            self.assertEqual(count(-1), 1)
+
+
+class QueryInstrumentationTests(GraphTestCase):
+    """graph/instrumentation.py ( クエリの記録 ) のテスト"""
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            instrumentation.normalize_sql(
+                "SELECT  * FROM t WHERE id IN (%s, %s, %s) AND x = 'a''b'"),
+            "SELECT * FROM t WHERE id IN (...) AND x = ?")
+        self.assertEqual(
+            instrumentation.normalize_sql(
+                "INSERT INTO t (a, b) VALUES (%s, %s), (%s, %s)"),
+            "INSERT INTO t (a, b) VALUES (%s, %s)".replace("%s", "?"))
+
+    def test_repeated_shapes(self):
+        nodes = create_chain(self.user, self.concern, 6)
+        with instrumentation.QueryRecorder() as recorder:
+            for node in Node.objects.filter(concern=self.concern):
+                list(node.targets.all())    # N+1
+        (sql, count), = recorder.repeated()
+        self.assertEqual(count, len(nodes))
+        self.assertIn("graph_node_targets", sql)
+
+    @override_settings(GRAPH_QUERY_INSTRUMENTATION=True)
+    def test_middleware(self):
+        instrumentation.views.clear()
+        self.client.get(reverse("graph:concern-index"))
+        stats = instrumentation.views.as_dict()["graph:concern-index"]
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual(stats["n_plus_one"], {})
+
+    @override_settings(GRAPH_QUERY_INSTRUMENTATION=True)
+    def test_single_wrapper(self):
+        # メトリクスの QueryTimer から記録する ( ラッパーを重ねない )
+        instrumentation.views.clear()
+        metrics.registry.clear()
+        with mock.patch.object(instrumentation.QueryRecorder, "__enter__",
+            side_effect=AssertionError("second execute wrapper")):
+            self.client.get(reverse("graph:concern-index"))
+        stats = instrumentation.views.as_dict()["graph:concern-index"]
+        database = metrics.registry.database["graph:concern-index"]
+        self.assertGreater(stats["queries"], 0)
+        self.assertEqual(stats["queries"], database[0])
+
+
+@override_settings(GRAPH_CLOSURE=True)
+class QueryBudgetTests(GraphTestCase):
+    """
+    graph/urls.py の全てのビューのクエリの回数が
+    グラフの大きさ ( ノード数 ) によらず一定であることを確かめる
+    """
+
+    # ※どちらの大きさでも、編集するノード ( 最後のノード ) の接続先が
+    # 先頭の 2 つ以外になるようにする ( 変更の内容を揃える )
+    sizes = (10, 100)
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = True
+        self.user.save()
+
+    def seed(self, size):
+        """分岐と循環のあるグラフを作成する"""
+        nodes = [{"id": i, "content": "node %d" % i, "to_root": i < 2,
+            "node_type": i % 2} for i in range(size)]
+        links = [{"source": i, "target": i // 2} for i in range(2, size)]
+        links += [{"source": 1, "target": size - 1}]
+        concern, timings = transfer.import_graph(self.user,
+            {"nodes": nodes, "links": links}, content="size %d" % size)
+        node_ids = list(Node.objects.filter(
+            concern=concern).order_by("id").values_list("id", flat=True))
+        return concern, node_ids
+
+    def requests(self, concern, node_ids):
+        """URL の名前 => (メソッド, URL, データ)"""
+        c = concern.id
+        first, second, last = node_ids[0], node_ids[1], node_ids[-1]
+        node = {"concern_id": c, "pk": last}
+        upload = SimpleUploadedFile("graph.csv",
+            "id,content,node_type,to_root,targets\n1,a,0,1,\n".encode())
+        return {
+            "concern-index": ("get", reverse("graph:concern-index"), {}),
+            "concern-index-json": (
+                "get", reverse("graph:concern-index-json"), {}),
+            "concern-detail": ("get", reverse("graph:concern-detail",
+                kwargs={"pk": c}), {}),
+            "concern-detail-json": ("get", reverse(
+                "graph:concern-detail-json", kwargs={"pk": c}), {}),
+            "concern-events": ("get", reverse(
+                "graph:concern-events", kwargs={"pk": c}), {"timeout": 0}),
+            "concern-delta-json": ("get", reverse(
+                "graph:concern-delta-json", kwargs={"pk": c}),
+                {"since": 0}),
+            "concern-reachability-json": ("get", reverse(
+                "graph:concern-reachability-json", kwargs={"pk": c}),
+                {"pairs": "%d-%d,%d-%d" % (last, first, second, last)}),
+            "concern-analytics-json": ("get", reverse(
+                "graph:concern-analytics-json", kwargs={"pk": c}), {}),
+            "graph-cache-stats": (
+                "get", reverse("graph:graph-cache-stats"), {}),
+            "query-stats": ("get", reverse("graph:query-stats"), {}),
+            "metrics": ("get", reverse("graph:metrics"), {}),
+            "concern-new": ("post", reverse("graph:concern-new"),
+                {"content": "new", "concern_type": Concern.ANALYZE}),
+            "concern-import": ("post", reverse("graph:concern-import"),
+                {"file": upload, "content": "csv"}),
+            "search-json": ("get", reverse("graph:search-json"),
+                {"q": "node"}),
+            "concern-export-all": (
+                "get", reverse("graph:concern-export-all"), {}),
+            "concern-export": ("get", reverse("graph:concern-export",
+                kwargs={"pk": c}), {}),
+            "concern-edit": ("post", reverse("graph:concern-edit",
+                kwargs={"pk": c}),
+                {"content": "edited", "concern_type": Concern.ANALYZE}),
+            "node-new": ("post", reverse("graph:node-new",
+                kwargs={"concern_id": c}), {"content": "new"}),
+            "node-new-to-root": ("post", reverse("graph:node-new-to-root",
+                kwargs={"concern_id": c}), {"content": "new"}),
+            "node-edit": ("post", reverse("graph:node-edit", kwargs=node),
+                {"concern": c, "targets": [first, second],
+                    "content": "edited", "node_type": Node.NORMAL}),
+            "node-target-candidates": ("get", reverse(
+                "graph:node-target-candidates", kwargs=node), {"q": "1"}),
+            "node-ancestors-json": ("get", reverse(
+                "graph:node-ancestors-json", kwargs=node), {}),
+            "node-descendants-json": ("get", reverse(
+                "graph:node-descendants-json",
+                kwargs={"concern_id": c, "pk": first}), {}),
+            "node-neighborhood-json": ("get", reverse(
+                "graph:node-neighborhood-json", kwargs=node), {"k": 3}),
+            "node-paths-json": ("get", reverse(
+                "graph:node-paths-json", kwargs=node), {}),
+            "node-new-source": ("post", reverse("graph:node-new-source",
+                kwargs={"concern_id": c, "target_id": last}),
+                {"content": "new", "node_type": Node.NORMAL}),
+            "node-new-target": ("post", reverse("graph:node-new-target",
+                kwargs={"concern_id": c, "source_id": last}),
+                {"content": "new"}),
+        }
+
+    def count_queries(self, method, url, data):
+        with instrumentation.QueryRecorder() as recorder:
+            response = getattr(self.client, method)(url, data)
+            if response.streaming:
+                b"".join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        return recorder
+
+    def test_every_view_is_covered(self):
+        from .urls import urlpatterns
+        concern, node_ids = self.seed(self.sizes[0])
+        self.assertEqual(
+            set(pattern.name for pattern in urlpatterns),
+            set(self.requests(concern, node_ids)))
+
+    def test_constant_queries(self):
+        graphs = [self.seed(size) for size in self.sizes]
+        names = sorted(self.requests(*graphs[0]))
+        for name in names:
+            with self.subTest(name):
+                counts = []
+                for concern, node_ids in graphs:
+                    recorder = self.count_queries(
+                        *self.requests(concern, node_ids)[name])
+                    counts.append(len(recorder))
+                    self.assertEqual(recorder.repeated(), [])
+                self.assertEqual(len(set(counts)), 1,
+                    "%s: %s queries for %s nodes" % (
+                        name, counts, self.sizes))
+
+
+class BenchmarkTests(GraphTestCase):
+    """graph/benchmarks ( 合成グラフとベンチマーク ) のテスト"""
+
+    def test_generators(self):
+        for shape in benchmarks.SHAPES:
+            data = benchmarks.generate(shape, 20)
+            concern, timings = transfer.import_graph(self.user, data)
+            graph = get_concern_graph(concern)
+            self.assertEqual(len(graph), 20)
+            self.assertEqual(graph.num_links, len(set(
+                (l["source"], l["target"]) for l in data["links"])))
+        self.assertEqual(len(benchmarks.generate("fan", 5)["links"]), 4)
+
+        # cycle は先頭と末尾が互いに届く
+        concern, timings = transfer.import_graph(self.user,
+            benchmarks.generate("cycle", 10), closure=True)
+        graph = get_concern_graph(concern)
+        first, last = graph.node_ids[0], graph.node_ids[-1]
+        self.assertTrue(closure.is_reachable(first, last))
+        self.assertTrue(closure.is_reachable(last, first))
+
+    def test_run_benchmarks(self):
+        report = benchmarks.run_benchmarks(self.user, ["chain"], [5],
+            repeat=2)
+        json.dumps(report)
+        endpoints = [r["endpoint"] for r in report["results"]]
+        self.assertIn("concern-detail-json:cold", endpoints)
+        result = report["results"][0]
+        self.assertEqual(result["status"], 200)
+        self.assertEqual(set(result["latency_ms"]),
+            {"min", "p50", "p90", "p99", "max", "mean"})
+        self.assertGreater(result["payload_bytes"], 0)
+        self.assertGreater(result["peak_memory_bytes"], 0)
+
+        # 目標設定の関心事は PLAN / DONE のノードで計測する
+        types = {(r["concern_type"], r["endpoint"]): r["status"]
+            for r in report["results"]}
+        self.assertEqual({t for t, e in types}, set(benchmarks.CONCERN_TYPES))
+        self.assertEqual(types[(Concern.SET_TARGET, "node-new-source")], 302)
+        self.assertEqual(set(Node.objects.filter(
+            concern__concern_type=Concern.SET_TARGET, content="source"
+        ).values_list("node_type", flat=True)), {Node.PLAN})
+
+
+class MetricsTests(GraphTestCase):
+    """graph/metrics.py ( 所要時間/クエリ数の集計 ) のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        metrics.registry.clear()
+
+    def test_exposition(self):
+        create_chain(self.user, self.concern, 3)
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        self.client.get(url)
+        self.client.get(url)
+
+        response = self.client.get(reverse("graph:metrics"))
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        text = response.content.decode()
+        labels = 'view="graph:concern-detail-json",method="GET"'
+        self.assertIn('graph_http_request_duration_seconds_count{%s} 2' %
+            labels, text)
+        self.assertIn('graph_http_request_duration_seconds_bucket'
+            '{%s,le="+Inf"} 2' % labels, text)
+        self.assertIn('graph_http_responses_total{%s,status="200"} 2' %
+            labels, text)
+        self.assertIn('graph_db_queries_total{view="graph:concern-detail-json"}',
+            text)
+
+        response = self.client.get(reverse("graph:metrics"),
+            REMOTE_ADDR="10.0.0.1")
+        self.assertEqual(response.status_code, 403)
+
+    def test_access(self):
+        url = reverse("graph:metrics")
+
+        def status(**extra):
+            return self.client.get(url, **extra).status_code
+
+        # ローカルのプロキシの後ろでは X-Forwarded-For で判定する
+        self.assertEqual(status(REMOTE_ADDR="127.0.0.1"), 200)
+        self.assertEqual(status(REMOTE_ADDR="127.0.0.1",
+            HTTP_X_FORWARDED_FOR="10.0.0.1"), 403)
+        self.assertEqual(status(REMOTE_ADDR="127.0.0.1",
+            HTTP_X_FORWARDED_FOR="127.0.0.1, 10.0.0.1"), 403)
+        # 信頼しないクライアントの X-Forwarded-For は使わない
+        self.assertEqual(status(REMOTE_ADDR="10.0.0.1",
+            HTTP_X_FORWARDED_FOR="127.0.0.1"), 403)
+
+        with self.settings(GRAPH_METRICS_TOKEN="secret"):
+            self.assertEqual(status(REMOTE_ADDR="127.0.0.1"), 403)
+            self.assertEqual(status(REMOTE_ADDR="10.0.0.1",
+                HTTP_AUTHORIZATION="Bearer wrong"), 403)
+            self.assertEqual(status(REMOTE_ADDR="10.0.0.1",
+                HTTP_AUTHORIZATION="Bearer secret"), 200)
+
+    @override_settings(GRAPH_SLOW_QUERY_MS=0)
+    def test_slow_query_log(self):
+        with self.assertLogs("graph.slow_queries", "WARNING") as logs:
+            self.client.get(reverse("graph:concern-index"))
+        self.assertIn("in graph:concern-index:", logs.output[-1])
+
+
+class ProfilingTests(GraphTestCase):
+    """graph/profiling.py ( リクエストのプロファイル ) のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(
+            GRAPH_PROFILE_DIR=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.url = reverse("graph:concern-detail",
+            kwargs={"pk": self.concern.id})
+
+    def test_staff_header(self):
+        # スタッフ以外の指定は無視する
+        self.client.get(self.url, HTTP_X_GRAPH_PROFILE="1")
+        self.assertEqual(profiling.list_profiles(), [])
+
+        self.user.is_staff = True
+        self.user.save()
+        self.client.get(self.url, HTTP_X_GRAPH_PROFILE="1")
+        self.client.get(self.url, {"profile": "1"})
+        profiles = profiling.list_profiles("graph:concern-detail",
+            self.concern.id)
+        self.assertEqual(len(profiles), 2)
+        stats = profiling.aggregate(profiles)
+        self.assertTrue(any(name == "render"
+            for filename, line, name in stats.stats))
+
+        out = StringIO()
+        call_command("graph_profiles", stdout=out)
+        self.assertIn("graph-concern-detail", out.getvalue())
+        out = StringIO()
+        call_command("graph_profiles", aggregate=True,
+            concern=self.concern.id, limit=5, stdout=out)
+        self.assertIn("2 profiles", out.getvalue())
+
+    @override_settings(GRAPH_PROFILE_SAMPLE_RATE=1)
+    def test_sampling(self):
+        self.client.get(reverse("graph:concern-index"))
+        profile, = profiling.list_profiles()
+        self.assertEqual(profile.view_name, "graph-concern-index")
+        self.assertIsNone(profile.concern_id)
+
+    @override_settings(GRAPH_PROFILE_SAMPLE_RATE=1, GRAPH_PROFILE_MAX_FILES=3)
+    def test_prune(self):
+        # 件数を超えたら古いものから削除する
+        for i in range(5):
+            self.client.get(reverse("graph:concern-index"))
+        profiles = profiling.list_profiles()
+        self.assertEqual(len(profiles), 3)
+
+        # バイト数を超えた場合も同じ ( 最新の 1 件は残る )
+        size = os.path.getsize(profiles[-1].path)
+        self.assertEqual(profiling.prune_profiles(max_bytes=size), 2)
+        self.assertEqual(profiling.list_profiles(), profiles[-1:])
+
+
+class ReplicaRoutingTests(GraphTestCase):
+    """graph/routers.py ( レプリカへの振り分け ) のテスト"""
+
+    alias = "graph_replica"
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(routers.reset_health)
+        self.addCleanup(self.remove_replica)
+        self.settings_override = override_settings(
+            GRAPH_REPLICA_DATABASES=[self.alias])
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.path = directory.name + "/replica.sqlite3"
+        self.url = reverse("graph:concern-index-json")
+
+    def add_replica(self, path):
+        connections.databases[self.alias] = dict(
+            connection.settings_dict, NAME=path, TEST={})
+
+    def remove_replica(self):
+        if self.alias in connections.databases:
+            connections[self.alias].close()
+            del connections[self.alias]
+            del connections.databases[self.alias]
+
+    def test_reads_from_replica(self):
+        self.add_replica(self.path)
+        call_command("migrate", database=self.alias, verbosity=0)
+        # レプリカにだけ存在する関心事
+        User.objects.using(self.alias).bulk_create([
+            User(id=self.user.id, username=self.user.username)])
+        Concern.objects.using(self.alias).bulk_create([
+            Concern(user_id=self.user.id, content="replica",
+                concern_type=Concern.ANALYZE)])
+
+        data = self.client.get(self.url).json()
+        self.assertEqual([c["content"] for c in data["concerns"]],
+            ["replica"])
+
+        # 書き込んだ直後は primary から読む
+        response = self.client.post(
+            reverse("graph:node-new", kwargs={"concern_id": self.concern.id}),
+            {"content": "new"})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(routers.COOKIE_NAME, response.cookies)
+        data = self.client.get(self.url).json()
+        self.assertEqual([c["id"] for c in data["concerns"]],
+            [self.concern.id])
+
+    def test_broken_replica_falls_back(self):
+        self.add_replica(self.path)
+        call_command("migrate", database=self.alias, verbosity=0)
+        User.objects.using(self.alias).bulk_create([
+            User(id=self.user.id, username=self.user.username)])
+        Concern.objects.using(self.alias).bulk_create([
+            Concern(user_id=self.user.id, content="replica",
+                concern_type=Concern.ANALYZE)])
+        data = self.client.get(self.url).json()
+        self.assertEqual([c["content"] for c in data["concerns"]],
+            ["replica"])
+
+        # 接続済みのレプリカが落ちる
+        connections[self.alias].connection.close()
+
+        # 読み取りに失敗すれば primary で読み直す
+        with self.assertLogs("graph.replicas", "WARNING"):
+            data = self.client.get(self.url).json()
+        self.assertEqual([c["id"] for c in data["concerns"]],
+            [self.concern.id])
+        self.assertFalse(routers.is_healthy(self.alias))
+
+        # 確かめ直す間隔が過ぎれば、接続済みでも確かめる
+        routers.reset_health()
+        self.assertTrue(routers.is_healthy(self.alias))
+        connections[self.alias].connection.close()
+        self.assertTrue(routers.is_healthy(self.alias))    # 間隔の内
+        with self.settings(GRAPH_REPLICA_CHECK_SECONDS=0):
+            self.assertFalse(routers.is_healthy(self.alias))
+
+        # graph/asgi.py の読み取りも primary で読み直す
+        routers.reset_health()
+        self.assertTrue(routers.is_healthy(self.alias))
+        request = mock.Mock(COOKIES={}, _graph_replica=None)
+        self.addCleanup(asgi.shutdown_executor)
+
+        def read():
+            if routers.current_replica() is not None:
+                raise OperationalError("replica is down")
+            return "primary"
+
+        async def reads():
+            return [await asgi.run_read(request, read) for _ in range(2)]
+
+        with mock.patch.object(routers, "choose_replica",
+            return_value=self.alias):
+            self.assertEqual(asyncio.run(reads()), ["primary", "primary"])
+        self.assertFalse(routers.is_healthy(self.alias))
+
+    def test_unhealthy_replica_falls_back(self):
+        self.add_replica(self.path + ".missing/replica.sqlite3")
+        data = self.client.get(self.url).json()
+        self.assertEqual([c["id"] for c in data["concerns"]],
+            [self.concern.id])
+        self.assertFalse(routers.is_healthy(self.alias))
+
+    def test_one_replica_per_request(self):
+        aliases = [self.alias, self.alias + "_2"]
+        for alias in aliases:
+            connections.databases[alias] = dict(
+                connection.settings_dict, NAME=self.path, TEST={})
+        self.addCleanup(connections.databases.pop, aliases[1])
+        router = routers.ReplicaRouter()
+
+        with self.settings(GRAPH_REPLICA_DATABASES=aliases), \
+            mock.patch.object(routers, "is_healthy",
+                return_value=True) as is_healthy:
+            chosen = set()
+            for _ in range(20):
+                routers.use_replicas(True)
+                chosen.update(router.db_for_read(Node) for _ in range(10))
+                self.assertEqual(len(chosen), 1)
+                chosen.clear()
+            routers.use_replicas(False)
+            # リクエストごとに 1 回だけ選ぶ
+            self.assertEqual(is_healthy.call_count, 20)
+
+            # 並行した読み取り ( graph/asgi.py ) も同じレプリカ
+            request = mock.Mock(COOKIES={}, _graph_replica=None)
+
+            async def reads():
+                return await asyncio.gather(*[
+                    asgi.run_read(request, router.db_for_read, Node)
+                    for _ in range(8)])
+
+            self.addCleanup(asgi.shutdown_executor)
+            self.assertEqual(len(set(asyncio.run(reads()))), 1)
+            self.assertEqual(is_healthy.call_count, 21)
+
+
+class ASGITests(TransactionTestCase):
+    """
+    graph/asgi.py ( ASGI と非同期のビュー ) のテスト
+    ※スレッドプールの別の接続から読めるように TransactionTestCase
+    """
+
+    def setUp(self):
+        get_graph_cache().clear()
+        adjacency_graphs.clear()
+        self.addCleanup(asgi.shutdown_executor)
+
+        self.user = User.objects.create_user("alice", password="pw")
+        self.concern = Concern.objects.create(
+            user=self.user,
+            content="なぜ遅いのか",
+            concern_type=Concern.ANALYZE,
+        )
+        create_chain(self.user, self.concern, 5)
+        self.client.force_login(self.user)
+        self.headers = [(b"cookie", ("%s=%s" % (settings.SESSION_COOKIE_NAME,
+            self.client.cookies[settings.SESSION_COOKIE_NAME].value)).encode())]
+        self.app = asgi.ASGIHandler()
+
+    def request(self, path, headers=(), query_string=b""):
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(asgi_request(self.app, "GET",
+                path, query_string=query_string,
+                headers=list(self.headers) + list(headers)))
+        finally:
+            loop.close()
+
+    def test_concern_detail_json(self):
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        status, headers, content = self.request(url)
+        self.assertEqual(status, 200)
+        self.assertEqual(content, self.client.get(url).content)
+
+        etag = dict(headers)["ETag"]
+        status, headers, content = self.request(url,
+            [(b"if-none-match", etag.encode())])
+        self.assertEqual(status, 304)
+
+        status, headers, content = self.request(
+            reverse("graph:concern-detail-json", kwargs={"pk": 0}))
+        self.assertEqual(status, 404)
+
+    def test_concern_index_json(self):
+        status, headers, content = self.request(
+            reverse("graph:concern-index-json"))
+        self.assertEqual(status, 200)
+        self.assertEqual([c["id"] for c in json.loads(content)["concerns"]],
+            [self.concern.id])
+
+        status, headers, content = self.request(
+            reverse("graph:concern-index-json"), query_string=b"cursor=x")
+        self.assertEqual(status, 400)
+
+    def test_sync_views(self):
+        # 非同期版のないビューは Django のハンドラーで処理する
+        status, headers, content = self.request(
+            reverse("graph:concern-detail", kwargs={"pk": self.concern.id}))
+        self.assertEqual(status, 200)
+        self.assertIn("node 4", content.decode())
+
+    @override_settings(GRAPH_ASYNC_WORKERS=1,
+        GRAPH_EVENTS_HEARTBEAT_SECONDS=0.05)
+    def test_concern_events(self):
+        # 通知のストリームはスレッドプール ( 1 スレッド ) を占有しない
+        url = reverse("graph:concern-events", kwargs={"pk": self.concern.id})
+        detail_url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+
+        async def until(condition):
+            for _ in range(250):
+                if condition():
+                    return
+                await asyncio.sleep(0.02)
+            self.fail("timed out")
+
+        def open_stream():
+            messages = [{"type": "http.request", "body": b""}]
+            closed = asyncio.Event()
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await closed.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                sent.append(message)
+
+            task = asyncio.ensure_future(self.app(make_scope("GET", url,
+                b"timeout=5", self.headers), receive, send))
+            return task, closed, sent
+
+        def body(sent):
+            return b"".join(m.get("body", b"") for m in sent[1:])
+
+        async def scenario():
+            streams = [open_stream() for _ in range(3)]
+            await until(lambda: events.hub.count(self.concern.id) == 3)
+
+            status, headers, content = await asyncio.wait_for(asgi_request(
+                self.app, "GET", detail_url, headers=self.headers), 5)
+            self.assertEqual(status, 200)
+
+            # 他のスレッド ( コミット後の通知 ) から届ける
+            message = events.format_event("delta", {"version": 99})
+            await asyncio.get_event_loop().run_in_executor(None,
+                events.hub.deliver, self.concern.id, message)
+            await until(lambda: all(message in body(sent)
+                for task, closed, sent in streams))
+
+            for task, closed, sent in streams:
+                closed.set()
+                await asyncio.wait_for(task, 5)
+            return [sent for task, closed, sent in streams]
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(scenario())
+        finally:
+            loop.close()
+
+        for sent in results:
+            self.assertEqual(sent[0]["status"], 200)
+            self.assertIn((b"content-type", b"text/event-stream"),
+                [(n.lower(), v) for n, v in sent[0]["headers"]])
+            chunks = body(sent).split(b"\n\n")
+            self.assertEqual(parse_event(chunks[1] + b"\n")[0], "hello")
+        self.assertEqual(events.hub.count(self.concern.id), 0)
+
+    def test_compare_transports(self):
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        results = compare_transports(url, self.headers, concurrency=2,
+            requests=4)
+        self.assertEqual(set(results), {"wsgi", "asgi"})
+        self.assertGreater(results["asgi"]["throughput_rps"], 0)
+
+
+def parse_event(chunk):
+    """Server-Sent Events の 1 件分を ( event, data ) に変換する"""
+    fields = dict(line.split(": ", 1)
+        for line in chunk.decode().strip().splitlines())
+    return fields["event"], json.loads(fields["data"])
+
+
+@override_settings(GRAPH_EVENTS_HEARTBEAT_SECONDS=0.05)
+class EventStreamTests(TransactionTestCase):
+    """
+    graph/events.py ( グラフの変更の通知 ) のテスト
+    ※コミット後に通知するので TransactionTestCase
+    """
+
+    def setUp(self):
+        get_graph_cache().clear()
+        adjacency_graphs.clear()
+        self.user = User.objects.create_user("alice", password="pw")
+        self.client.force_login(self.user)
+        self.concern = Concern.objects.create(
+            user=self.user,
+            content="なぜ遅いのか",
+            concern_type=Concern.ANALYZE,
+        )
+        self.url = reverse("graph:concern-events",
+            kwargs={"pk": self.concern.id})
+
+    def test_stream(self):
+        response = self.client.get(self.url, {"timeout": 5})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b"retry: 3000\n\n")
+        event, data = parse_event(next(stream))
+        self.assertEqual((event, data),
+            ("hello", {"version": self.concern.graph_version}))
+
+        # 待っている間はクエリを発行しない
+        with self.assertNumQueries(0):
+            self.assertEqual(next(stream), b": keepalive\n\n")
+
+        a = Node.objects.create(user=self.user, concern=self.concern,
+            content="a", to_root=True)
+        b = Node.objects.create(user=self.user, concern=self.concern,
+            content="b")
+        b.targets.add(a)
+        deltas = [parse_event(next(stream))[1] for _ in range(3)]
+
+        self.assertEqual(deltas[0]["since"], self.concern.graph_version)
+        for previous, delta in zip(deltas, deltas[1:]):
+            self.assertEqual(delta["since"], previous["version"])
+        self.assertEqual(deltas[0]["nodes"], [{"nid": a.id, "content": "a",
+            "node_type": Node.NORMAL, "to_root": True}])
+        self.assertEqual(deltas[2]["links"], [{"source": b.id,
+            "target": a.id}])
+
+        self.assertEqual(events.hub.count(self.concern.id), 1)
+        response.close()
+        self.assertEqual(events.hub.count(self.concern.id), 0)
+
+    @override_settings(GRAPH_EVENTS_QUEUE_SIZE=2)
+    def test_overflow(self):
+        subscription = events.hub.subscribe(self.concern.id)
+        self.addCleanup(subscription.close)
+        for i in range(3):
+            events.hub.deliver(self.concern.id, b"x")
+        self.assertEqual(parse_event(subscription.get(0)),
+            ("resync", {}))
+        self.assertIsNone(subscription.get(0))
+
+    @override_settings(GRAPH_EVENTS_MAX_SUBSCRIBERS=0)
+    def test_hub_full(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+
+
+class BinaryGraphTests(GraphTestCase):
+    """graph/binary.py ( concern_detail_json のバイナリ形式 ) のテスト"""
+
+    def get_both(self, concern):
+        url = reverse("graph:concern-detail-json", kwargs={"pk": concern.id})
+        as_json = self.client.get(url)
+        as_binary = self.client.get(url, HTTP_ACCEPT=binary.MEDIA_TYPE)
+        return as_json, as_binary
+
+    def test_content_negotiation(self):
+        create_chain(self.user, self.concern, 3, node_type=Node.REVERSE)
+        as_json, as_binary = self.get_both(self.concern)
+        self.assertEqual(as_binary["Content-Type"], binary.MEDIA_TYPE)
+        self.assertIn("Accept", as_binary["Vary"])
+        self.assertNotEqual(as_json["ETag"], as_binary["ETag"])
+
+        payload = as_json.json()
+        columns = binary.decode_graph(as_binary.content)
+        self.assertEqual(columns["version"], payload["version"])
+        self.assertEqual(columns["content"],
+            [node["content"] for node in payload["nodes"]])
+        self.assertEqual(list(columns["nid"]),
+            [node.get("nid", 0) for node in payload["nodes"]])
+        self.assertEqual(list(columns["node_type"]),
+            [node["node_type"] for node in payload["nodes"]])
+        links = [{
+            "source": source,
+            "target": target,
+            "node_type": 0 if target == 0 else columns["node_type"][source],
+        } for source, target in zip(columns["source"], columns["target"])]
+        self.assertEqual(links, payload["links"])
+        for node, x in zip(payload["nodes"], columns["x"]):
+            self.assertAlmostEqual(node["x"], x, places=3)
+
+        response = self.client.get(
+            reverse("graph:concern-detail-json",
+                kwargs={"pk": self.concern.id}),
+            {"format": "bin"}, HTTP_IF_NONE_MATCH=as_binary["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(GRAPH_LAYOUT=False, GRAPH_CLOSURE=False)
+    def test_size_and_parse_time(self):
+        concern, timings = transfer.import_graph(self.user,
+            benchmarks.generate("dag", 2000))
+        as_json, as_binary = self.get_both(concern)
+        self.assertLess(len(as_binary.content), len(as_json.content) / 3)
+
+        def best_of(func, data, repeat=5):
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func(data)
+                times.append(time.perf_counter() - start)
+            return min(times)
+
+        self.assertLess(
+            best_of(binary.decode_graph, as_binary.content),
+            best_of(json.loads, as_json.content))
+
+
+class GraphSerializerTests(GraphTestCase):
+    """graph/serializers.py ( 少しずつ作成する JSON ) のテスト"""
+
+    def test_whitelist(self):
+        self.assertEqual(serializers.serialize(self.concern, ["content"]),
+            {"content": "なぜ遅いのか"})
+        with self.assertRaises(serializers.FieldNotAllowed):
+            serializers.serialize(self.user, ["password"])
+        with self.assertRaises(serializers.FieldNotAllowed):
+            serializers.iter_values(Node.objects.all(), ["user_id"])
+
+    @override_settings(GRAPH_STREAM_MIN_NODES=1)
+    def test_streamed_concern_graph(self):
+        nodes = create_chain(self.user, self.concern, 4,
+            node_type=Node.REVERSE)
+        nodes[0].targets.add(nodes[-1])
+        self.concern.refresh_from_db()
+        expected = build_concern_graph(self.concern)
+
+        response = self.client.get(reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id}))
+        self.assertTrue(response.streaming)
+        payload = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(payload["version"], self.concern.graph_version)
+        self.assertEqual(payload["nodes"], expected["nodes"])
+
+        def key(link):
+            return link["source"], link["target"]
+        self.assertEqual(sorted(payload["links"], key=key),
+            sorted(expected["links"], key=key))
+
+    @override_settings(GRAPH_STREAM_MIN_NODES=1000, GRAPH_STREAM_MIN_LINKS=3)
+    def test_streamed_graph_is_cached(self):
+        # 接続数でも少しずつ返す
+        create_chain(self.user, self.concern, 4)
+        url = reverse("graph:concern-detail-json",
+            kwargs={"pk": self.concern.id})
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        etag = response["ETag"]
+        content = b"".join(response.streaming_content)
+
+        # 返した内容をキャッシュし、同じ ETag で返す
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, content)
+        self.assertEqual(response["ETag"], etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # 大きすぎるものはキャッシュしない ( ETag は付ける )
+        get_graph_cache().clear()
+        with self.settings(GRAPH_STREAM_CACHE_MAX_BYTES=10):
+            response = self.client.get(url)
+            b"".join(response.streaming_content)
+        self.assertEqual(response["ETag"], etag)
+        self.assertTrue(self.client.get(url).streaming)
+
+    @override_settings(GRAPH_CLOSURE=False)
+    def test_bounded_memory(self):
+        concern, timings = transfer.import_graph(self.user,
+            benchmarks.generate("dag", 2000))
+        concern.refresh_from_db()
+
+        def peak_memory(func):
+            tracemalloc.start()
+            try:
+                result = func()
+                return tracemalloc.get_traced_memory()[1], result
+            finally:
+                tracemalloc.stop()
+
+        def stream():
+            return sum(len(chunk) for chunk in serializers.iter_concern_graph(
+                concern, concern.graph_version, chunk_size=100))
+
+        def whole():
+            adjacency_graphs.clear()
+            return json.dumps(build_concern_graph(concern))
+
+        streamed_peak, size = peak_memory(stream)
+        whole_peak, content = peak_memory(whole)
+
+        # ピークメモリはペイロード全体より小さい
+        self.assertLess(streamed_peak, size / 2)
+        self.assertLess(streamed_peak, whole_peak / 4)
@@ -0,0 +1,421 @@
+# graph/transfer.py
+"""
+関心事のグラフの一括インポート/エクスポート
+
+JSON 形式 ( エクスポートの形式と同じ )
+    {
+        "concern": {"content": "...", "concern_type": 0},
+        "nodes": [{"id": "a", "content": "...", "node_type": 0,
+                   "to_root": true}, ...],
+        "links": [{"source": "b", "target": "a"}, ...]
+    }
+
+CSV 形式 ( 1 行 1 ノード、targets は接続先の id を空白区切り )
+    id,content,node_type,to_root,targets
+
+id は他のツールの ID でよい ( インポート時に Node の ID に置き換える )
+"""
+import csv
+import io
+import json
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Concern, Node
+from .adjacency import get_concern_graph
+from .signals import bump_graph_version
+from .closure import closure_enabled, rebuild_closure, schedule_rebuild
+from . import search, serializers
+
+# 1 回の executemany() で挿入する行数
+BATCH_SIZE = 5000
+
+CSV_FIELDS = ("id", "content", "node_type", "to_root", "targets")
+
+
+class GraphImportError(ValueError):
+    """インポートするデータが不正"""
+
+
+class PhaseTimer(object):
+    """処理の段階ごとの所要時間 ( 秒 ) を記録する"""
+
+    def __init__(self):
+        self.timings = OrderedDict()
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.timings[phase] = round(now - self._last, 4)
+        self._last = now
+
+
+def parse_bool(value):
+    """CSV の真偽値 ( 1/0、true/false、yes/no、空欄は False )"""
+    value = (value or "").strip().lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("", "0", "false", "no"):
+        return False
+    raise ValueError("invalid boolean: %s" % value)
+
+
+def allowed_node_types(concern_type):
+    """
+    関心事の種類で使えるノードタイプ
+    ( NodeFormView.get_form() の選択肢と、node_type のないフォームで
+      作成される NORMAL )
+    """
+    if concern_type == Concern.SET_TARGET:
+        return {Node.NORMAL, Node.PLAN, Node.DONE}
+    return {Node.NORMAL, Node.REVERSE}
+
+
+def parse_csv(text):
+    """CSV を JSON 形式と同じ辞書に変換する"""
+    nodes = []
+    links = []
+    for row in csv.DictReader(io.StringIO(text)):
+        try:
+            external_id = row["id"]
+            nodes.append({
+                "id": external_id,
+                "content": row["content"],
+                "node_type": int(row.get("node_type") or Node.NORMAL),
+                "to_root": parse_bool(row.get("to_root")),
+            })
+        except (KeyError, ValueError) as e:
+            raise GraphImportError("invalid CSV row: %s" % e)
+        for target in (row.get("targets") or "").split():
+            links.append({"source": external_id, "target": target})
+
+    return {"nodes": nodes, "links": links}
+
+
+def external_id_of(value, what):
+    """外部の ID ( 文字列または整数 ) を文字列にする"""
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise GraphImportError("%s must be a string or an integer" % what)
+    return str(value)
+
+
+def list_of_objects(data, name):
+    """data[name] ( オブジェクトの配列、省略時は空 ) を返す"""
+    items = data.get(name, [])
+    if not isinstance(items, list) or \
+        not all(isinstance(item, dict) for item in items):
+        raise GraphImportError("%s must be a list of objects" % name)
+    return items
+
+
+def load_import_data(text, fmt="json"):
+    """インポートするデータ ( JSON / CSV の文字列 ) を辞書にする"""
+    if fmt == "csv":
+        return parse_csv(text)
+    try:
+        data = json.loads(text)
+    except ValueError as e:
+        raise GraphImportError("invalid JSON: %s" % e)
+    if not isinstance(data, dict):
+        raise GraphImportError("JSON object is required")
+    return data
+
+
+def import_graph(user, data, content=None, concern_type=None,
+    closure=None):
+    """
+    グラフを新しい関心事としてインポートする
+    ノードと接続 ( 中間テーブル ) は executemany() で一定数ずつ
+    まとめて作成する ( 全体を 1 つのトランザクションで行う )
+
+    ※シグナルは発行されないので、グラフの
+    バージョンと集計、到達可能性の表と検索用のインデックスは最後にまとめて
+    更新する
+    closure .. 到達可能性の表を作成するかどうか
+        True  .. その場で作成する
+        None  .. GRAPH_CLOSURE が True ならコミット後にバックグラウンドで
+                 作成する ( 行数はノード数の 2 乗に比例し、
+                 2 万ノードで 1 分以上かかるため )
+        False .. 作成しない
+    戻り値は (関心事, 段階ごとの所要時間)
+    """
+    timer = PhaseTimer()
+
+    # 入力の検証 ( 型が違うものも全て GraphImportError にする )
+    if not isinstance(data, dict):
+        raise GraphImportError("JSON object is required")
+    meta = data.get("concern") or {}
+    if not isinstance(meta, dict):
+        raise GraphImportError("concern must be an object")
+    if not isinstance(meta.get("content", ""), str):
+        raise GraphImportError("concern content must be a string")
+    content = content or meta.get("content")
+    if not content or not isinstance(content, str):
+        raise GraphImportError("concern content is required")
+    if concern_type is None:
+        concern_type = meta.get("concern_type", Concern.ANALYZE)
+    if isinstance(concern_type, bool) or \
+        concern_type not in [t for t, label in Concern.NODE_TYPES]:
+        raise GraphImportError("invalid concern_type: %s" % concern_type)
+
+    nodes = list_of_objects(data, "nodes")
+    links = list_of_objects(data, "links")
+
+    valid_types = allowed_node_types(concern_type)
+    external_ids = []
+    seen = set()
+    for node in nodes:
+        if "id" not in node or "content" not in node:
+            raise GraphImportError("node id and content are required")
+        external_id = external_id_of(node["id"], "node id")
+        if external_id in seen:
+            raise GraphImportError("duplicate node id: %s" % external_id)
+        if not isinstance(node["content"], str):
+            raise GraphImportError("node content must be a string: %s" %
+                external_id)
+        node_type = node.get("node_type", Node.NORMAL)
+        if not isinstance(node_type, int) or isinstance(node_type, bool) or \
+            node_type not in valid_types:
+            raise GraphImportError("invalid node_type: %s" % external_id)
+        if not isinstance(node.get("to_root", False), bool):
+            raise GraphImportError("to_root must be a boolean: %s" %
+                external_id)
+        seen.add(external_id)
+        external_ids.append(external_id)
+
+    edges = []
+    for link in links:
+        if "source" not in link or "target" not in link:
+            raise GraphImportError("link source and target are required")
+        source = external_id_of(link["source"], "link source")
+        target = external_id_of(link["target"], "link target")
+        if source not in seen or target not in seen:
+            raise GraphImportError("unknown node in link: %s -> %s" % (
+                source, target))
+        edges.append((source, target))
+    timer.lap("validate")
+
+    with transaction.atomic():
+        concern = Concern.objects.create(
+            user=user,
+            content=content[:40],
+            concern_type=concern_type,
+        )
+
+        # ノードを作成する
+        insert_nodes(user, concern, nodes)
+        timer.lap("nodes")
+
+        # 外部の ID => Node の ID
+        # ( 主キーを返さないデータベースもあるので読み直す。
+        # 挿入した順に ID が振られる )
+        node_ids = Node.objects.filter(
+            concern=concern
+        ).order_by("id").values_list("id", flat=True)
+        id_map = dict(zip(external_ids, node_ids))
+        timer.lap("remap")
+
+        # 接続を作成する ( 重複は除く )
+        # インデックスの更新が局所的になるように並べ替えてから挿入する
+        pairs = sorted(set(
+            (id_map[source], id_map[target]) for source, target in edges))
+        insert_links(pairs)
+        timer.lap("links")
+
+        # 集計 ( graph/counters.py ) も同じ UPDATE で設定する
+        node_types = [node.get("node_type", Node.NORMAL) for node in nodes]
+        bump_graph_version(concern.id, {
+            "node_count": len(node_types),
+            "link_count": len(pairs),
+            "plan_count": node_types.count(Node.PLAN),
+            "done_count": node_types.count(Node.DONE),
+        })
+        if closure is None:
+            if closure_enabled():
+                schedule_rebuild(concern.id)
+        elif closure:
+            rebuild_closure(concern.id)
+            timer.lap("closure")
+        if search.search_enabled():
+            search.index_concern(concern)
+            timer.lap("search")
+
+    return concern, timer.timings
+
+
+def insert_nodes(user, concern, nodes):
+    """
+    ノードを挿入する
+    ※bulk_create() は値ごとの変換に時間がかかる ( 10 万件で数秒 ) ため、
+    変換済みの値を executemany() で一定数ずつ挿入する
+    """
+    fields = [Node._meta.get_field(name) for name in (
+        "user", "concern", "content", "node_type", "to_root",
+        "created_at", "updated_at")]
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+        qn(Node._meta.db_table),
+        ", ".join(qn(field.column) for field in fields),
+        ", ".join(["%s"] * len(fields)),
+    )
+
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    rows = [
+        (
+            user.id,
+            concern.id,
+            node["content"][:40],
+            node.get("node_type", Node.NORMAL),
+            node.get("to_root", False),
+            now,
+            now,
+        ) for node in nodes
+    ]
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            cursor.executemany(sql, rows[start:start + BATCH_SIZE])
+
+
+def insert_links(pairs):
+    """中間テーブル ( Node.targets ) に (接続元 ID, 接続先 ID) を挿入する"""
+    through = Node.targets.through
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s, %s) VALUES (%%s, %%s)" % (
+        qn(through._meta.db_table),
+        qn(through._meta.get_field("from_node").column),
+        qn(through._meta.get_field("to_node").column),
+    )
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), BATCH_SIZE):
+            cursor.executemany(sql, pairs[start:start + BATCH_SIZE])
+
+
+def export_graph(concern):
+    """グラフを JSON 形式の辞書にする ( id は Node の ID )"""
+    graph = get_concern_graph(concern)
+
+    nodes = [
+        {
+            "id": graph.node_ids[i],
+            "content": graph.contents[i],
+            "node_type": graph.node_types[i],
+            "to_root": bool(graph.to_root[i]),
+        } for i in range(len(graph))
+    ]
+    links = [
+        {
+            "source": graph.node_ids[source],
+            "target": graph.node_ids[target],
+        } for source, target in graph.edges()
+    ]
+
+    return {
+        "concern": {
+            "content": concern.content,
+            "concern_type": concern.concern_type,
+        },
+        "nodes": nodes,
+        "links": links,
+    }
+
+
+def export_graph_csv(concern, out):
+    """グラフを CSV 形式で out に書き出す"""
+    graph = get_concern_graph(concern)
+
+    writer = csv.writer(out)
+    writer.writerow(CSV_FIELDS)
+    for i in range(len(graph)):
+        writer.writerow([
+            graph.node_ids[i],
+            graph.contents[i],
+            graph.node_types[i],
+            int(graph.to_root[i]),
+            " ".join(str(graph.node_ids[j]) for j in graph.targets_of(i)),
+        ])
+
+
+def iter_concern_graph(concern, chunk_size=2000):
+    """
+    1 つの関心事のグラフを JSON ( export_graph() と同じ形 ) の
+    断片として少しずつ返す ( graph/serializers.py )
+    """
+    nodes = serializers.iter_values(Node.objects.filter(
+        concern_id=concern.id
+    ).order_by("created_at", "id"), chunk_size=chunk_size)
+
+    links = serializers.iter_values(Node.targets.through.objects.filter(
+        from_node__concern_id=concern.id
+    ).order_by("id"), chunk_size=chunk_size)
+
+    return serializers.iter_object([
+        ("concern", serializers.serialize(concern)),
+        ("nodes", serializers.Fragments(serializers.iter_array(
+            (dict(zip(("id", "content", "node_type", "to_root"), row))
+                for row in nodes),
+            chunk_size=chunk_size))),
+        ("links", serializers.Fragments(serializers.iter_array(
+            links,
+            lambda link: '{"source": %d, "target": %d}' % link,
+            chunk_size=chunk_size))),
+    ])
+
+
+def export_flush_size():
+    """エクスポートで 1 回に返す文字数の目安 ( GRAPH_EXPORT_FLUSH_SIZE )"""
+    return getattr(settings, "GRAPH_EXPORT_FLUSH_SIZE", 64 * 1024)
+
+
+def iter_user_export(user, fmt="ndjson", chunk_size=100, flush_size=None):
+    """
+    ユーザーの全ての関心事のグラフを少しずつ返す
+    ( 関心事も iterator() で読むので、メモリ使用量は関心事の数に
+    よらず一定 )
+    断片は flush_size 文字を超えたら返す ( 小さな関心事はまとめ、
+    大きな関心事は途中でも返すので、関心事の大きさにもよらない )
+
+    ndjson .. 1 行目が見出し、2 行目以降が 1 行 1 関心事
+    json   .. {"user": ..., "concerns": [...]}
+    """
+    flush_size = flush_size or export_flush_size()
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    header = encoder.encode({"user": user.username})
+
+    # 見出しはクエリの前に返す ( すぐに最初のバイトが届くように )
+    if fmt == "ndjson":
+        yield header + "\n"
+    else:
+        yield header[:-1] + ', "concerns": ['
+
+    concerns = Concern.objects.filter(
+        user=user
+    ).order_by("id").iterator(chunk_size=chunk_size)
+
+    def fragments():
+        for i, concern in enumerate(concerns):
+            if i and fmt != "ndjson":
+                yield ", "
+            yield from iter_concern_graph(concern)
+            if fmt == "ndjson":
+                yield "\n"
+        if fmt != "ndjson":
+            yield "]}"
+
+    buffer = []
+    size = 0
+    for fragment in fragments():
+        buffer.append(fragment)
+        size += len(fragment)
+        if size >= flush_size:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield "".join(buffer)
@@ -0,0 +1,174 @@
+# graph/traversal.py
+"""
+ノードの接続をたどる ( 再帰 CTE を使い、1 回のクエリで行う )
+
+Node.targets の向き ( 接続元 => 接続先 ) をルート側とみなす
+    ・ancestors     .. 接続先をたどる ( ルート側 )
+    ・descendants   .. 接続元をたどる ( 末端側 )
+    ・neighborhood  .. 両方向に k 回までたどる
+    ・paths_to_root .. to_root のノードまでの経路をすべて列挙する
+
+SQLite と PostgreSQL の両方で動く SQL だけを使う
+"""
+from django.conf import settings
+from django.db import connection
+
+from .models import Node
+
+
+# 接続元 => 接続先 ( ancestors ) / 接続先 => 接続元 ( descendants )
+UP = "up"
+DOWN = "down"
+BOTH = "both"
+
+
+def max_depth():
+    """たどる深さの上限"""
+    return getattr(settings, "GRAPH_TRAVERSAL_MAX_DEPTH", 50)
+
+
+def _tables():
+    """ノードと中間テーブルのテーブル名/列名"""
+    through = Node.targets.through
+    qn = connection.ops.quote_name
+    return {
+        "node": qn(Node._meta.db_table),
+        "through": qn(through._meta.db_table),
+        "source": qn(through._meta.get_field("from_node").column),
+        "target": qn(through._meta.get_field("to_node").column),
+    }
+
+
+def _step(direction):
+    """再帰部分で次のノードを求める式と結合条件"""
+    if direction == UP:
+        return "t.{target}", "t.{source} = w.node_id"
+    if direction == DOWN:
+        return "t.{source}", "t.{target} = w.node_id"
+    return (
+        "CASE WHEN t.{source} = w.node_id "
+        "THEN t.{target} ELSE t.{source} END",
+        "t.{source} = w.node_id OR t.{target} = w.node_id",
+    )
+
+
+def walk(node, direction, depth=None):
+    """
+    node から direction の向きに depth 回までたどったノードを返す
+    ノードごとに最短の深さを depth として付ける ( node 自身は含まない )
+
+    ※UNION で (ノード, 深さ) の重複を除くので、循環があっても
+    行数は ノード数 x 深さ を超えない
+    """
+    depth = min(depth or max_depth(), max_depth())
+    next_node, condition = _step(direction)
+
+    sql = """
+        WITH RECURSIVE walk(node_id, depth) AS (
+            SELECT %s, 0
+            UNION
+            SELECT {next_node}, w.depth + 1
+            FROM walk w
+            JOIN {through} t ON {condition}
+            WHERE w.depth < %s
+        )
+        SELECT n.id, n.content, n.node_type, n.to_root, w.depth
+        FROM (
+            SELECT node_id, MIN(depth) AS depth
+            FROM walk
+            GROUP BY node_id
+        ) w
+        JOIN {node} n ON n.id = w.node_id
+        WHERE n.concern_id = %s AND n.id <> %s
+        ORDER BY w.depth, n.id
+    """
+    tables = _tables()
+    sql = sql.format(
+        next_node=next_node.format(**tables),
+        condition=condition.format(**tables),
+        **tables
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [node.id, depth, node.concern_id, node.id])
+        rows = cursor.fetchall()
+
+    return [
+        {
+            "nid": nid,
+            "content": content,
+            "node_type": node_type,
+            "to_root": bool(to_root),
+            "depth": d,
+        } for nid, content, node_type, to_root, d in rows
+    ]
+
+
+def ancestors(node, depth=None):
+    """ルート側 ( 接続先 ) のノード"""
+    return walk(node, UP, depth)
+
+
+def descendants(node, depth=None):
+    """末端側 ( 接続元 ) のノード"""
+    return walk(node, DOWN, depth)
+
+
+def neighborhood(node, k=1):
+    """両方向に k 回までたどったノード"""
+    return walk(node, BOTH, k)
+
+
+def max_rows():
+    """経路の列挙で再帰 CTE が作成する行数の上限"""
+    return getattr(settings, "GRAPH_TRAVERSAL_MAX_ROWS", 10000)
+
+
+def paths_to_root(node, depth=None, limit=100):
+    """
+    node からルートに直接接続するノード ( to_root ) までの
+    経路 ( ノードの ID のリスト ) をすべて返す ( 最大 limit 件 )
+    経路の文字列 ( ",1,5,7," ) に含まれるノードには戻らない
+
+    ※経路の数は深さに対して指数的に増えるので、再帰 CTE が作成する
+      途中の経路は max_rows() 行までとする ( 副問い合わせの LIMIT で
+      再帰が打ち切られる。SQLite も PostgreSQL も幅優先で作成するので、
+      短い経路から順に残る )
+      上限に達した場合は、それまでに見つかった経路だけを返す
+    """
+    depth = min(depth or max_depth(), max_depth())
+
+    sql = """
+        WITH RECURSIVE walk(node_id, depth, path) AS (
+            SELECT %s, 0, ',' || CAST(%s AS VARCHAR(20)) || ','
+            UNION ALL
+            SELECT t.{target}, w.depth + 1,
+                w.path || CAST(t.{target} AS VARCHAR(20)) || ','
+            FROM walk w
+            JOIN {through} t ON t.{source} = w.node_id
+            WHERE w.depth < %s
+                AND w.path NOT LIKE
+                    '%%,' || CAST(t.{target} AS VARCHAR(20)) || ',%%'
+        )
+        SELECT w.path
+        FROM (
+            SELECT node_id, depth, path
+            FROM walk
+            LIMIT %s
+        ) w
+        JOIN {node} n ON n.id = w.node_id
+        WHERE n.to_root = %s AND n.concern_id = %s
+        ORDER BY w.depth, w.path
+        LIMIT %s
+    """.format(**_tables())
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [
+            node.id, node.id, depth, max_rows(), True, node.concern_id,
+            limit])
+        rows = cursor.fetchall()
+
+    return [
+        [int(nid) for nid in path.strip(",").split(",")]
+        for path, in rows
+    ]
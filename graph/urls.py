@@ -17,6 +17,13 @@ urlpatterns = [
         name="concern-index"
     ),
 
+    # 関心事の一覧 ( JSON データ、キーセット方式のページ分割 )
+    # ex: /graph/concerns.json/?cursor=...
+    path("concerns.json/",
+        views.concern_index_json,
+        name="concern-index-json"
+    ),
+
     # 関心事の詳細
     # ex: /graph/concerns/42/
     path("concerns/<int:pk>/",
@@ -31,6 +38,55 @@ urlpatterns = [
         name="concern-detail-json"
     ),
 
+    # 関心事の詳細 ( バージョン since 以降の差分、JSON データ )
+    # ex: /graph/concerns/42/delta.json/?since=10
+    path("concerns/<int:pk>/delta.json/",
+        views.concern_delta_json,
+        name="concern-delta-json"
+    ),
+
+    # 関心事のグラフの変更の通知 ( Server-Sent Events )
+    # ex: /graph/concerns/42/events/
+    path("concerns/<int:pk>/events/",
+        views.concern_events,
+        name="concern-events"
+    ),
+
+    # ノードに届くノードの数、到達可能性 ( JSON データ )
+    # ex: /graph/concerns/42/reachability.json/?pairs=7-3,8-3
+    path("concerns/<int:pk>/reachability.json/",
+        views.concern_closure_json,
+        name="concern-reachability-json"
+    ),
+
+    # ノードごとの指標と循環の一覧 ( JSON データ )
+    # ex: /graph/concerns/42/analytics.json/
+    path("concerns/<int:pk>/analytics.json/",
+        views.concern_analytics_json,
+        name="concern-analytics-json"
+    ),
+
+    # グラフのキャッシュの統計情報 ( スタッフのみ、JSON データ )
+    # ex: /graph/cache/stats.json/
+    path("cache/stats.json/",
+        views.graph_cache_stats,
+        name="graph-cache-stats"
+    ),
+
+    # ビューごとのクエリの回数 ( スタッフのみ、JSON データ )
+    # ex: /graph/queries/stats.json/
+    path("queries/stats.json/",
+        views.query_stats_json,
+        name="query-stats"
+    ),
+
+    # ビューごとの所要時間/クエリ数 ( Prometheus のテキスト形式 )
+    # ex: /graph/metrics/
+    path("metrics/",
+        views.metrics_text,
+        name="metrics"
+    ),
+
     # 関心事の新規作成
     # ex: /graph/concerns/new/
     path("concerns/new/",
@@ -38,6 +94,34 @@ urlpatterns = [
         name="concern-new"
     ),
 
+    # グラフのインポート ( 新しい関心事として作成する )
+    # ex: /graph/concerns/import/
+    path("concerns/import/",
+        views.concern_import,
+        name="concern-import"
+    ),
+
+    # 関心事/ノードの全文検索 ( JSON データ )
+    # ex: /graph/search.json/?q=なぜ
+    path("search.json/",
+        views.search_json,
+        name="search-json"
+    ),
+
+    # 全ての関心事のエクスポート ( ストリーミング、NDJSON / JSON )
+    # ex: /graph/concerns/export/?format=json
+    path("concerns/export/",
+        views.concern_export_all,
+        name="concern-export-all"
+    ),
+
+    # グラフのエクスポート ( JSON / CSV )
+    # ex: /graph/concerns/42/export/?format=csv
+    path("concerns/<int:pk>/export/",
+        views.concern_export,
+        name="concern-export"
+    ),
+
     # 関心事の編集
     # ex: /graph/concerns/edit/42/
     path("concerns/edit/<int:pk>/",
@@ -68,6 +152,42 @@ urlpatterns = [
         name="node-edit"
     ),
 
+    # 接続先の候補の検索 ( ID と内容のみ、ページ分割 )
+    # ex: /graph/concerns/42/nodes/42/candidates.json/?q=なぜ
+    path("concerns/<int:concern_id>/nodes/<int:pk>/candidates.json/",
+        views.node_target_candidates_json,
+        name="node-target-candidates"
+    ),
+
+    # ノードからたどれるノード一覧 ( JSON データ )
+    # ex: /graph/concerns/42/nodes/42/ancestors.json/?depth=5
+    path("concerns/<int:concern_id>/nodes/<int:pk>/ancestors.json/",
+        views.node_traversal_json,
+        {"direction": "ancestors"},
+        name="node-ancestors-json"
+    ),
+
+    # ex: /graph/concerns/42/nodes/42/descendants.json/?depth=5
+    path("concerns/<int:concern_id>/nodes/<int:pk>/descendants.json/",
+        views.node_traversal_json,
+        {"direction": "descendants"},
+        name="node-descendants-json"
+    ),
+
+    # ex: /graph/concerns/42/nodes/42/neighborhood.json/?k=2
+    path("concerns/<int:concern_id>/nodes/<int:pk>/neighborhood.json/",
+        views.node_traversal_json,
+        {"direction": "neighborhood"},
+        name="node-neighborhood-json"
+    ),
+
+    # ノードからルートまでの経路一覧 ( JSON データ )
+    # ex: /graph/concerns/42/nodes/42/paths.json/
+    path("concerns/<int:concern_id>/nodes/<int:pk>/paths.json/",
+        views.node_paths_json,
+        name="node-paths-json"
+    ),
+
     # 接続元ノードの作成
     # ex: /graph/concerns/42/nodes/42/new_source/
     path("concerns/<int:concern_id>/nodes/<int:target_id>/new_source/",
@@ -1,16 +1,42 @@
+import json
+import time
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404
 from django.views import generic
-from django.urls import reverse_lazy
-from django.http import HttpResponseRedirect, JsonResponse
-
+from django.urls import reverse, reverse_lazy
+from django.http import HttpResponse, HttpResponseRedirect,\
+HttpResponseNotModified, HttpResponseBadRequest, HttpResponseForbidden,\
+JsonResponse, Http404, StreamingHttpResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_POST
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+
+from . import traversal, closure, analytics, transfer, pagination, search,\
+routers, events, binary, serializers, counters
 from .models import Concern, Node
 from .forms import ConcernForm, NodeEditForm,\
 NodeToRootForm, SourceNodeForm, TargetNodeForm
+from .services import build_concern_graph, build_graph_delta
+from .layout import attach_layout, layout_available
+from .adjacency import get_concern_graph, graphs as adjacency_graphs
+from .instrumentation import views as view_query_stats
+from .metrics import registry as metrics_registry
+from .cache import get_graph_version, graph_etag, etag_matches,\
+get_graph_cache, graph_cache_key, lookup_graph, store_graph,\
+stats as cache_stats
 
 
 # Create your views here.
 class ConcernIndexView(generic.ListView):
-    """関心事一覧"""
+    """
+    関心事一覧
+    ノード数などは関心事の集計 ( graph/counters.py ) を表示する
+    ( ノードを集計しないので、1 ページ 1 回のクエリ )
+    """
 
     # 対象のモデル
     model = Concern
@@ -18,18 +44,134 @@ class ConcernIndexView(generic.ListView):
     # 使用するテンプレート
     template_name = "graph/concerns/concern_list.html"
 
+    # テンプレートで使用する名前 ( 一覧はリストで渡すので明示する )
+    context_object_name = "concern_list"
+
     def get_queryset(self):
-        
-        # 新しい順にソートする
+
+        # 新しい順に 1 ページ分 ( キーセット方式、graph/pagination.py )
         concern_list = Concern.objects.filter(
             user=self.request.user,
-        ).order_by("-created_at")
+        )
+
+        try:
+            concern_list, self.next_cursor = \
+                pagination.paginate_newest_first(
+                    concern_list, self.request.GET.get("cursor"))
+        except pagination.InvalidCursor:
+            raise Http404("invalid cursor")
 
         return concern_list
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["next_cursor"] = self.next_cursor
+        return context
+
+
+def concern_index_page(user, cursor=None):
+    """
+    関心事一覧の 1 ページ分 ( JSON に変換できる辞書 )
+    カーソルが不正なら pagination.InvalidCursor
+    """
+
+    concern_list = Concern.objects.filter(
+        user=user,
+    ).only("id", "content", "concern_type", "created_at",
+        "last_activity_at", *counters.COUNTERS)
+
+    concerns, next_cursor = pagination.paginate_newest_first(
+        concern_list, cursor)
+
+    return {
+        "concerns": [
+            {
+                "id": concern.id,
+                "content": concern.content,
+                "concern_type": concern.concern_type,
+                "created_at": concern.created_at,
+                "last_activity_at": concern.last_activity_at,
+                "node_count": concern.node_count,
+                "link_count": concern.link_count,
+                "plan_count": concern.plan_count,
+                "done_count": concern.done_count,
+            } for concern in concerns
+        ],
+        "next": next_cursor,
+    }
+
+
+def concern_index_json(request):
+    """
+    関心事一覧 (JSONデータ、新しい順に 1 ページ分)
+    next が null でなければ ?cursor=<next> で次のページを取得できる
+    ex: /graph/concerns.json/?cursor=...
+    """
+
+    try:
+        payload = concern_index_page(request.user, request.GET.get("cursor"))
+    except pagination.InvalidCursor:
+        return HttpResponseBadRequest("invalid cursor")
+
+    return JsonResponse(payload)
+
+
+def node_url_format(name, concern_id):
+    """
+    ノードの URL の書式 ( ノードの ID を % で埋める )
+    ※ノードごとに reverse() しないように 1 回だけ reverse() する
+    ( ノードの ID は URL の最後の引数 )
+    """
+    sentinel = "2147483647"
+    url = reverse(name, args=(concern_id, int(sentinel)))
+    head, _, tail = url.rpartition(sentinel)
+    return head.replace("%", "%%") + "%d" + tail.replace("%", "%%")
+
+
+class NodeTableRows(object):
+    """
+    関心事の詳細のノードの表の行
+    反復した時に初めてクエリを発行する
+    ( 表のキャッシュがあればクエリを発行しない )
+    """
+
+    def __init__(self, concern):
+        self.concern = concern
+
+    def __iter__(self):
+        edit, new_source, new_target = [
+            node_url_format(name, self.concern.id) for name in (
+                "graph:node-edit",
+                "graph:node-new-source",
+                "graph:node-new-target",
+            )
+        ]
+
+        # テンプレートで使うフィールドだけを作成順に
+        # ( インデックス ( concern, created_at ) を使う )
+        rows = Node.objects.filter(
+            concern_id=self.concern.id
+        ).order_by(
+            "created_at", "id"
+        ).values_list(
+            "id", "content"
+        )
+
+        for nid, content in rows:
+            yield {
+                "content": content,
+                "edit_url": edit % nid,
+                "new_source_url": new_source % nid,
+                "new_target_url": new_target % nid,
+            }
+
 
 class ConcernDetailView(generic.DetailView):
-    """関心事の詳細"""
+    """
+    関心事の詳細
+    ノードの表はグラフのバージョンごとにキャッシュする
+    ( 変更がなければ表のクエリもテンプレートのループも省く )
+    """
 
     # 対象のモデル
     model = Concern
@@ -37,125 +179,562 @@ class ConcernDetailView(generic.DetailView):
     # 使用するテンプレート
     template_name = "graph/concerns/concern_detail.html"
 
+    def get_queryset(self):
+        # テンプレートで使うフィールドだけ
+        return Concern.objects.only("id", "content", "graph_version")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["node_rows"] = NodeTableRows(self.object)
+        context["graph_cache_alias"] = getattr(
+            settings, "GRAPH_CACHE_ALIAS", "default")
+        return context
+
+
+def encode_concern_graph(concern, version, graph=None, fmt="json"):
+    """
+    concern_detail_json の本体 ( バイト列 ) を作成する
+    fmt .. "json" または "bin" ( graph/binary.py )
+    ※座標が形式によって変わらないように、もう一方の形式も
+      ( キャッシュになければ ) キャッシュしておく
+    """
+    payload = build_concern_graph(concern,
+        metrics=getattr(settings, "GRAPH_ANALYTICS", True), graph=graph)
+
+    # 差分 ( concern_delta_json ) の取得に使用するバージョン
+    payload["version"] = version
+
+    # ノードの座標を計算しておく ( クライアント側の計算を減らす )
+    payload = attach_layout(concern.id, payload)
+
+    contents = {
+        "json": json.dumps(payload, cls=DjangoJSONEncoder).encode(),
+        "bin": binary.encode_graph(payload),
+    }
+    cache = get_graph_cache()
+    for other, content in contents.items():
+        if other != fmt:
+            cache.add(graph_cache_key(concern.id, version, other), content)
+
+    return contents[fmt]
+
+
+def concern_graph_format(request):
+    """concern_detail_json の形式 ( Accept ヘッダーで選ぶ )"""
+    if binary.accepts_binary(request):
+        return "bin", binary.MEDIA_TYPE
+    return "json", "application/json"
+
+
+def streams_concern_graph(concern, fmt):
+    """
+    concern_detail_json を少しずつ返すかどうか
+    ノード数が GRAPH_STREAM_MIN_NODES 以上、または接続数が
+    GRAPH_STREAM_MIN_LINKS 以上 ( 密なグラフもメモリ上に作らない )
+    ( 集計 ( Concern.node_count / link_count、graph/counters.py ) を使う )
+    """
+    if fmt != "json":
+        return False
+    return concern.node_count >= \
+        getattr(settings, "GRAPH_STREAM_MIN_NODES", 10000) or \
+        concern.link_count >= \
+        getattr(settings, "GRAPH_STREAM_MIN_LINKS", 20000)
+
+
+def stream_concern_graph(concern, version):
+    """
+    concern_detail_json を少しずつ返す ( graph/serializers.py )
+    ※座標と指標は付けない
+    返した断片はキャッシュにも保存し ( 最後まで返した場合のみ、
+    GRAPH_STREAM_CACHE_MAX_BYTES まで )、ETag も付ける
+    ( 次からはキャッシュまたは 304 で返す )
+    """
+    max_bytes = getattr(settings, "GRAPH_STREAM_CACHE_MAX_BYTES",
+        8 * 1024 * 1024)
+
+    def content():
+        chunks = []
+        size = 0
+        for chunk in serializers.iter_concern_graph(concern, version):
+            if chunks is not None:
+                size += len(chunk)
+                chunks.append(chunk)
+                if size > max_bytes:
+                    chunks = None    # 大きすぎるものはキャッシュしない
+            yield chunk
+        if chunks is not None:
+            store_graph(concern.id, version, "".join(chunks), "json")
+
+    response = StreamingHttpResponse(content(),
+        content_type="application/json")
+    response["ETag"] = graph_etag(concern.id, version, "json",
+        weak=layout_available())
+    patch_vary_headers(response, ["Accept"])
+    return response
+
+
+def concern_detail_json(request, pk):
+    """
+    ノード一覧とノードの接続情報 (JSONデータ)
+    Accept: application/vnd.mindgraph.graph ( または ?format=bin ) の
+    場合は列指向のバイナリ形式 ( graph/binary.py )
+    大きな関心事 ( streams_concern_graph() ) でキャッシュがなければ
+    少しずつ返す ( stream_concern_graph() )
+    """
+
+    # グラフのバージョンだけを取得する
+    version = get_graph_version(pk)
+    if version is None:
+        raise Http404("No Concern matches the given query.")
+
+    fmt, content_type = concern_graph_format(request)
+
+    # 変更がなければ 304 を返す
+    etag = graph_etag(pk, version, fmt, weak=layout_available())
+    if etag_matches(request, etag):
+        response = HttpResponseNotModified()
+        response["ETag"] = etag
+        patch_vary_headers(response, ["Accept"])
+        return response
+
+    content = lookup_graph(pk, version, fmt)
+    if content is None:
+        concern = get_object_or_404(Concern, pk=pk)
+
+        # 大きな関心事は座標を付けずに少しずつ返す
+        if streams_concern_graph(concern, fmt):
+            return stream_concern_graph(concern, version)
+
+        # ノード数に関係なく一定回数のクエリで作成する
+        content = encode_concern_graph(concern, version, fmt=fmt)
+        store_graph(pk, version, content, fmt)
+
+    response = HttpResponse(content, content_type=content_type)
+    response["ETag"] = etag
+    patch_vary_headers(response, ["Accept"])
+
+    return response
+
+
+def concern_delta_json(request, pk):
+    """
+    バージョン since 以降のグラフの差分 (JSONデータ)
+    ex: /graph/concerns/42/delta.json/?since=10
+    """
+
+    concern = get_object_or_404(Concern, pk=pk)
+
+    try:
+        since = int(request.GET["since"])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest("since is required")
+
+    payload = build_graph_delta(concern, since)
+
+    return JsonResponse(payload)
+
+
+def event_stream_timeout(request):
+    """
+    ストリームを閉じるまでの秒数 ( timeout パラメーター、数値でなければ None )
+    GRAPH_EVENTS_STREAM_SECONDS まで
+    """
+    max_seconds = getattr(settings, "GRAPH_EVENTS_STREAM_SECONDS", 300)
+    try:
+        return min(float(request.GET.get("timeout", max_seconds)),
+            max_seconds)
+    except ValueError:
+        return None
+
+
+def hub_full_response():
+    """購読者が多すぎる場合のレスポンス"""
+    response = HttpResponse("too many subscribers", status=503)
+    response["Retry-After"] = "30"
+    return response
+
+
+def event_stream_response(content):
+    """Server-Sent Events のレスポンス"""
+    response = StreamingHttpResponse(content,
+        content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # プロキシ ( nginx ) にバッファさせない
+    response["X-Accel-Buffering"] = "no"
+    return response
 
-# ※任意のフィールドにアクセスできてしまうのでダメ@180607
-def get_nodes_and_links(queryset, targets_manager_name,
-    *other_fields):
+
+def concern_events(request, pk):
     """
-    多対多の関係のレコードから
-        ・ノード ( id、その他の内容 ) のリスト
-        ・ノード間の接続情報
-    を取り出す
+    グラフの変更の通知 ( Server-Sent Events、graph/events.py )
+    最初に hello ( 現在のバージョン ) を送り、以降は変更ごとに delta
+    ( concern_delta_json と同じ形式 ) を送る
+    timeout .. ストリームを閉じるまでの秒数
+        ( GRAPH_EVENTS_STREAM_SECONDS まで、EventSource は自動で再接続する )
+    ※ASGI では graph/asgi.py の concern_events ( イベントループ上で待つ )
+    ex: /graph/concerns/42/events/
     """
 
-    # ID の変換用テーブルを作成する & ノード情報をまとめる
-    # データベース上のレコードの ID <=> D3.js で使用する ID
-    id2js = {}
-    node_dicts = []
-    for i, record in enumerate(queryset):
+    version = get_graph_version(pk)
+    if version is None:
+        raise Http404("No Concern matches the given query.")
+
+    timeout = event_stream_timeout(request)
+    if timeout is None:
+        return HttpResponseBadRequest("timeout must be a number")
+
+    # レスポンスを返す前に購読する ( その間の変更も受け取る )
+    try:
+        subscription = events.hub.subscribe(pk)
+    except events.HubFull:
+        return hub_full_response()
+
+    heartbeat = getattr(settings, "GRAPH_EVENTS_HEARTBEAT_SECONDS", 15)
+
+    def stream():
+        try:
+            yield from events.stream_preamble(version)
+
+            # 待っている間はデータベースの接続を持たない
+            # ( トランザクションの途中 ( テストなど ) は除く )
+            for connection in connections.all():
+                if not connection.in_atomic_block:
+                    connection.close()
+
+            deadline = time.monotonic() + timeout
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                message = subscription.get(min(heartbeat, remaining))
+                if message is None:
+                    yield b": keepalive\n\n"
+                else:
+                    yield message
+        finally:
+            subscription.close()
+
+    return event_stream_response(stream())
+
+
+def get_int_param(request, name, default=None):
+    """クエリパラメーターを整数として取得する"""
+    try:
+        return int(request.GET[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def node_target_candidates_json(request, concern_id, pk):
+    """
+    接続先の候補の検索 (JSONデータ、ID と内容のみ)
+    q      .. 内容に含まれる文字列 ( match=prefix の場合は前方一致 )
+    after  .. 前のページの next ( ID の順に続きを返す )
+    ex: /graph/concerns/42/nodes/42/candidates.json/?q=なぜ&after=100
+    """
 
-        # テーブルに ID を登録
-        id2js[record.id] = i
+    candidates = Node.objects.filter(
+        user=request.user,
+        concern_id=concern_id,
+    ).exclude(
+        pk=pk
+    )
 
-        # レコードの ID を設定 ( D3.js 側で使用する ID )
-        node_dict = {
-            "id": i,
-        }
+    q = request.GET.get("q", "").strip()
+    if q:
+        if request.GET.get("match") == "prefix":
+            candidates = candidates.filter(content__istartswith=q)
+        else:
+            candidates = candidates.filter(content__icontains=q)
+
+    after = get_int_param(request, "after")
+    if after is not None:
+        candidates = candidates.filter(pk__gt=after)
+
+    # 1 件多く取り出して、次のページがあるかどうかを調べる
+    size = getattr(settings, "GRAPH_AUTOCOMPLETE_PAGE_SIZE", 20)
+    rows = list(candidates.order_by("id").values_list("id", "content")[
+        :size + 1])
+    next_after = rows[size - 1][0] if len(rows) > size else None
+
+    return JsonResponse({
+        "results": [
+            {"id": nid, "content": content}
+            for nid, content in rows[:size]
+        ],
+        "next": next_after,
+    })
+
+
+def node_traversal_json(request, concern_id, pk, direction):
+    """
+    ノードからたどれるノード一覧 (JSONデータ)
+    direction .. ancestors ( ルート側 ) / descendants ( 末端側 ) /
+        neighborhood ( 両方向に k 回まで )
+    ex: /graph/concerns/42/nodes/42/ancestors.json/?depth=5
+    """
 
-        # ノード情報を追加 ( ID 以外のフィールド情報 )
-        for field in other_fields:
-            node_dict[field] = getattr(record, field)
+    node = get_object_or_404(Node, pk=pk, concern_id=concern_id)
 
-        node_dicts.append(node_dict)
+    if direction == "neighborhood":
+        depth = get_int_param(request, "k", 1)
+        nodes = traversal.neighborhood(node, depth)
+    else:
+        depth = get_int_param(request, "depth")
+        walk = getattr(traversal, direction)
+        nodes = walk(node, depth)
 
-    # 接続情報を作成する
-    # 接続情報は id2js ( 変換テーブル ) で変換した後の ID を
-    # 用いるため、再度ループ走査しなおす必要がある
-    links = []
-    for record in queryset:
+    payload = {
+        "nid": node.id,
+        "direction": direction,
+        "depth": depth,
+        "nodes": nodes,
+    }
 
-        # RelatedManager を取得する
-        targets_manager = getattr(record, targets_manager_name)
-        # ※クラスの確認 ( RelatedManager であることを確認 )
+    return JsonResponse(payload)
 
-        for target in targets_manager.all():
 
-            # 接続情報を追加
-            links.append({
+def node_paths_json(request, concern_id, pk):
+    """
+    ノードからルートまでの経路一覧 (JSONデータ)
+    ex: /graph/concerns/42/nodes/42/paths.json/?depth=10&limit=100
+    """
 
-                # 接続元の ID
-                "source": id2js[record.id],
+    node = get_object_or_404(Node, pk=pk, concern_id=concern_id)
 
-                # 接続先の ID
-                "target": id2js[target.id],
+    paths = traversal.paths_to_root(node,
+        depth=get_int_param(request, "depth"),
+        limit=get_int_param(request, "limit", 100))
 
-            })
+    # 経路に含まれるノードの内容
+    nids = set(nid for path in paths for nid in path)
+    rows = Node.objects.filter(id__in=nids).values_list("id", "content")
 
     payload = {
-        "nodes": node_dicts,
-        "links": links,
+        "nid": node.id,
+        "paths": paths,
+        "contents": {nid: content for nid, content in rows},
     }
 
-    return payload
+    return JsonResponse(payload)
+
+
+def concern_closure_json(request, pk):
+    """
+    ノードごとの、そのノードに届くノードの数 (JSONデータ)
+    pairs を指定した場合は、末端側から ルート側に届くかどうかも返す
+    ex: /graph/concerns/42/reachability.json/?pairs=7-3,8-3
+    """
 
+    concern = get_object_or_404(Concern, pk=pk)
 
-def concern_detail_json(request, pk):
-    """ノード一覧とノードの接続情報 (JSONデータ)"""
+    if not closure.closure_enabled():
+        return HttpResponse("The reachability table is disabled "
+            "(GRAPH_CLOSURE)", status=501)
+
+    pairs = []
+    for pair in request.GET.get("pairs", "").split(","):
+        try:
+            descendant, ancestor = pair.split("-")
+            pairs.append((int(descendant), int(ancestor)))
+        except ValueError:
+            continue
+
+    payload = {
+        "subtree_sizes": closure.subtree_sizes(concern.id),
+        "reachable": [
+            {"descendant": d, "ancestor": a, "reachable": reachable}
+            for (d, a), reachable in zip(
+                pairs, closure.reachable_pairs(concern.id, pairs))
+        ],
+    }
+
+    return JsonResponse(payload)
+
+
+def concern_analytics_json(request, pk):
+    """
+    ノードごとの指標 ( ルートまでの距離、次数、部分木のサイズ、
+    影響度、強連結成分 ) と循環の一覧 (JSONデータ)
+    ex: /graph/concerns/42/analytics.json/
+    """
 
     concern = get_object_or_404(Concern, pk=pk)
 
-    # 関連するノード一覧
-    nodes = concern.node_set.all().order_by("created_at")
-
-    # ノード ID <=> D3.js が使用するノード ID
-    # concern 自体を 1 個目のノードとするため 1 からスタート
-    id2js = {}
-    for i, node in enumerate(nodes):
-        id2js[node.id] = i + 1
-
-    # ノード情報を作成 ( concern 自体)
-    node_dicts = [{
-        "id": 0,
-        "content": concern.content,
-        "is_root": True,
-        "node_type": 0,
-    }]
-
-    # ノード情報を作成 ( ノード全体 )
-    node_dicts += [
-        {
-            "id": id2js[node.id],
-            "content": node.content,
-            "is_root": False,
-            "nid": node.id,
-            "node_type": node.node_type,
-        } for node in nodes
-    ]
-
-    # 接続情報を作成する
-    links = []
-    for node in nodes:
-        if node.to_root:
-            links.append({
-                "source": id2js[node.id],
-                "target": 0,    # ルートに接続
-                "node_type": 0,
-            })
-        for target in node.targets.all():
-            links.append({
-                "source": id2js[node.id],
-                "target": id2js[target.id],
-                "node_type": node.node_type,
-            })
+    if not analytics.available():
+        return HttpResponse("NumPy and SciPy are required", status=501)
+
+    graph = get_concern_graph(concern)
+
+    payload = {
+        "version": graph.version,
+        "metrics": analytics.metrics_as_lists(graph),
+        "cycles": analytics.cycles(graph),
+    }
+
+    return JsonResponse(payload)
+
+
+@require_POST
+def concern_import(request):
+    """
+    グラフを新しい関心事としてインポートする (JSONデータを返す)
+    file .. JSON または CSV ( 拡張子、または format で指定 )
+    content .. 関心事の内容 ( JSON に含まれていれば省略可 )
+    """
+
+    # 関心事はログイン中のユーザーのものとして作成する
+    if not request.user.is_authenticated:
+        return HttpResponseForbidden()
+
+    upload = request.FILES.get("file")
+    if upload is None:
+        return HttpResponseBadRequest("file is required")
+
+    fmt = request.POST.get("format") or \
+        ("csv" if upload.name.lower().endswith(".csv") else "json")
+
+    try:
+        data = transfer.load_import_data(
+            upload.read().decode("utf-8-sig"), fmt)
+        concern, timings = transfer.import_graph(request.user, data,
+            content=request.POST.get("content"))
+    except (transfer.GraphImportError, UnicodeDecodeError) as e:
+        return HttpResponseBadRequest(str(e))
+
+    routers.pin_to_primary(request)
 
     payload = {
-        "nodes": node_dicts,
-        "links": links,
+        "concern_id": concern.id,
+        "nodes": len(data.get("nodes", [])),
+        "links": len(data.get("links", [])),
+        "timings": timings,
     }
 
+    return JsonResponse(payload, status=201)
+
+
+def concern_export(request, pk):
+    """
+    グラフをエクスポートする ( JSON / CSV )
+    ex: /graph/concerns/42/export/?format=csv
+    """
+
+    # 自分の関心事のみ
+    concern = get_object_or_404(Concern, pk=pk, user=request.user)
+    filename = "concern-%d" % concern.id
+
+    if request.GET.get("format") == "csv":
+        response = HttpResponse(content_type="text/csv; charset=utf-8")
+        response["Content-Disposition"] = \
+            'attachment; filename="%s.csv"' % filename
+        transfer.export_graph_csv(concern, response)
+        return response
+
+    response = JsonResponse(transfer.export_graph(concern))
+    response["Content-Disposition"] = \
+        'attachment; filename="%s.json"' % filename
+
+    return response
+
+
+def search_json(request):
+    """
+    関心事/ノードの全文検索 (JSONデータ、関連度の高い順)
+    ex: /graph/search.json/?q=なぜ&limit=20
+    """
+
+    q = request.GET.get("q", "")
+    limit = max(1, min(get_int_param(request, "limit", 20), 100))
+
+    return JsonResponse({
+        "results": search.search(request.user, q, limit),
+    })
+
+
+def concern_export_all(request):
+    """
+    ユーザーの全ての関心事のグラフをストリーミングでエクスポートする
+    ex: /graph/concerns/export/?format=json ( 既定は NDJSON )
+    """
+
+    fmt = "json" if request.GET.get("format") == "json" else "ndjson"
+    content_type = "application/json" if fmt == "json" else \
+        "application/x-ndjson"
+
+    response = StreamingHttpResponse(
+        transfer.iter_user_export(request.user, fmt),
+        content_type="%s; charset=utf-8" % content_type)
+    response["Content-Disposition"] = \
+        'attachment; filename="concerns.%s"' % fmt
+
+    return response
+
+
+@staff_member_required
+def graph_cache_stats(request):
+    """
+    グラフのキャッシュのヒット/ミス/破棄の回数と、
+    プロセス内にキャッシュしている隣接リストのメモリ使用量 (JSONデータ)
+    """
+    payload = cache_stats.as_dict()
+    payload["adjacency"] = adjacency_graphs.info()
     return JsonResponse(payload)
 
 
+def metrics_client_ip(request):
+    """
+    メトリクスを取得するクライアントの IP アドレス
+    GRAPH_METRICS_TRUSTED_PROXIES からの接続であれば X-Forwarded-For を
+    右から辿り、信頼するプロキシ以外の最初のアドレスを使う
+    ※それ以外の接続の X-Forwarded-For は使わない ( 偽装できるため )
+    """
+    proxies = getattr(settings, "GRAPH_METRICS_TRUSTED_PROXIES", [])
+    address = request.META.get("REMOTE_ADDR")
+    if address not in proxies:
+        return address
+
+    forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "")
+    for address in reversed([a.strip() for a in forwarded.split(",")
+        if a.strip()]):
+        if address not in proxies:
+            return address
+    return request.META.get("REMOTE_ADDR")
+
+
+def metrics_text(request):
+    """
+    ビューごとの所要時間/クエリ数 ( Prometheus のテキスト形式 )
+    GRAPH_METRICS_TOKEN があれば Authorization: Bearer <トークン> が必要
+    無ければ GRAPH_METRICS_ALLOWED_IPS からのみ取得できる ( ローカルの収集用 )
+    ( プロキシの後ろでは metrics_client_ip() のアドレスで判定する )
+    ex: /graph/metrics/
+    """
+
+    token = getattr(settings, "GRAPH_METRICS_TOKEN", None)
+    if token:
+        given = request.META.get("HTTP_AUTHORIZATION", "")
+        if not constant_time_compare(given, "Bearer %s" % token):
+            return HttpResponseForbidden()
+    else:
+        allowed = getattr(settings, "GRAPH_METRICS_ALLOWED_IPS",
+            ["127.0.0.1", "::1"])
+        if metrics_client_ip(request) not in allowed:
+            return HttpResponseForbidden()
+
+    return HttpResponse(metrics_registry.exposition(),
+        content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@staff_member_required
+def query_stats_json(request):
+    """
+    ビューごとのクエリの回数と N+1 の疑いのある SQL (JSONデータ)
+    ( settings.GRAPH_QUERY_INSTRUMENTATION が True の場合に集計する )
+    """
+    return JsonResponse({"views": view_query_stats.as_dict()})
+
+
 class ConcernFormView(object):
     """関心事の新規作成/編集"""
 
@@ -171,7 +750,12 @@ class ConcernFormView(object):
     def form_valid(self, form):
         """フォームの値が正常な場合の処理"""
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        response = super().form_valid(form)
+
+        # 一覧にすぐ反映されるように、しばらく primary から読む
+        routers.pin_to_primary(self.request)
+
+        return response
 
 
 class ConcernCreateView(ConcernFormView, generic.CreateView):
@@ -190,6 +774,10 @@ class ConcernCreateView(ConcernFormView, generic.CreateView):
 class ConcernEditView(ConcernFormView, generic.UpdateView):
     """関心事の編集"""
 
+    def get_queryset(self):
+        # 自分の関心事のみ
+        return Concern.objects.filter(user=self.request.user)
+
     def get_context_data(self, **kwargs):
         """埋め込み変数を設定する"""
         context = super().get_context_data(**kwargs)
@@ -253,6 +841,21 @@ class NodeFormView(object):
 
         return context
 
+    def post(self, request, *args, **kwargs):
+        response = super().post(request, *args, **kwargs)
+
+        # 書き込んだ内容がすぐに見えるように、しばらく primary から読む
+        # ( graph/routers.py )
+        if response.status_code == 302:
+            routers.pin_to_primary(request)
+
+        # モーダルダイアログ ( Ajax ) から送信された場合は
+        # リダイレクトせず、差分の取得はクライアントに任せる
+        if request.is_ajax() and response.status_code == 302:
+            return HttpResponse(status=204)
+
+        return response
+
     def set_user_and_concern(self, form):
         """ユーザーと関心事をフォームにセットする"""
 
@@ -331,19 +934,34 @@ class NodeEditView(NodeFormView, generic.UpdateView):
         
         # 選択肢を関連するものだけに絞り込む
         # ただし、自身以外のノードであること
-        form.fields["targets"].queryset = \
-            self.model.objects.select_related().filter(
-                user=self.request.user,
-                # concern=self.object.concern    # ※クエリが一つ減る
-                concern__id=self.kwargs["concern_id"]
-            ).exclude(
-                pk=self.kwargs["pk"]
-            )
+        # ※送信された ID の検証にだけ使う ( 全件は描画しない )
+        candidates = self.model.objects.filter(
+            user=self.request.user,
+            # concern=self.object.concern    # ※クエリが一つ減る
+            concern__id=self.kwargs["concern_id"]
+        ).exclude(
+            pk=self.kwargs["pk"]
+        )
+        field = form.fields["targets"]
+        field.queryset = candidates
+
+        # 選択済みのノードだけを描画する
+        # ( 入力エラーで表示し直す場合は送信された ID )
+        if form.is_bound:
+            selected = candidates.filter(
+                pk__in=[pk for pk in form.data.getlist("targets")
+                    if pk.isdigit()])
+        else:
+            selected = self.object.targets.all()
+        selected = list(selected.values_list("id", "content"))
+        field.widget.choices = selected
+        field.widget.search_url = reverse(
+            "graph:node-target-candidates",
+            kwargs={"concern_id": self.kwargs["concern_id"],
+                "pk": self.kwargs["pk"]})
 
         # 接続先を選択しておく
-        form.fields["targets"].initial = tuple(
-            self.object.targets.values_list("id", flat=True)
-        )
+        field.initial = tuple(pk for pk, content in selected)
 
         return form
 
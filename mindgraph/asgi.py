@@ -0,0 +1,20 @@
+"""
+ASGI config for mindgraph project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+( ex: uvicorn mindgraph.asgi:application )
+
+Django 2.2 has no ASGI support, so the handler lives in graph/asgi.py.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mindgraph.settings")
+
+django.setup(set_prefix=False)
+
+from graph.asgi import ASGIHandler  # noqa: E402
+
+application = ASGIHandler()
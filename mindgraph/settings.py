@@ -48,8 +48,12 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'graph.middleware.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'graph.middleware.RequestMetricsMiddleware',
+    'graph.middleware.QueryInstrumentationMiddleware',
+    'graph.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'mindgraph.urls'
@@ -83,6 +87,176 @@ DATABASES = {
     }
 }
 
+# 読み取り用のレプリカ ( graph/routers.py )
+# ローカルでは GRAPH_SQLITE_REPLICAS=2 のように指定すると、SQLite の
+# ファイル ( db.replica1.sqlite3, ... ) をレプリカの代わりに使う
+# ( 内容は manage.py sync_sqlite_replicas で primary から複製する )
+for i in range(1, int(os.environ.get('GRAPH_SQLITE_REPLICAS', 0)) + 1):
+    DATABASES['replica%d' % i] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'db.replica%d.sqlite3' % i),
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['graph.routers.ReplicaRouter']
+
+# graph アプリの読み取りを振り分けるレプリカ ( DATABASES のキー )
+GRAPH_REPLICA_DATABASES = [
+    alias for alias in DATABASES if alias.startswith('replica')]
+
+# ユーザーの書き込みの後、primary から読む秒数
+GRAPH_REPLICA_STICKY_SECONDS = 5
+
+# 接続できなかったレプリカを再び試すまでの秒数
+GRAPH_REPLICA_RETRY_SECONDS = 30
+
+# 接続済みのレプリカに接続できるかを確かめ直す間隔 ( 秒 )
+GRAPH_REPLICA_CHECK_SECONDS = 10
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # グラフ ( JSON ) のキャッシュ
+    # キーにグラフのバージョンを含むため期限は設けない
+    # ( LocMemCache は MAX_ENTRIES を超えると LRU で破棄する )
+    'graph': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'graph',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 256,
+        },
+    },
+}
+
+# グラフのキャッシュに使用するキャッシュ ( CACHES のキー )
+GRAPH_CACHE_ALIAS = 'graph'
+
+# 関心事の一覧の 1 ページの件数 ( graph/pagination.py )
+GRAPH_CONCERN_PAGE_SIZE = 50
+
+# 接続先の候補の検索 ( node_target_candidates_json ) の 1 ページの件数
+GRAPH_AUTOCOMPLETE_PAGE_SIZE = 20
+
+# グラフの変更履歴を保持するバージョン数
+# ( これより古いバージョンからの差分は全体を返す )
+GRAPH_HISTORY_SIZE = 100
+
+# プロセスごとにキャッシュする隣接リスト ( graph/adjacency.py ) の数
+GRAPH_ADJACENCY_CACHE_SIZE = 64
+
+# ノードをたどる ( graph/traversal.py ) 深さの上限
+GRAPH_TRAVERSAL_MAX_DEPTH = 50
+
+# ルートまでの経路の列挙 ( paths_to_root() ) で作成する途中の経路の数の上限
+# ( 経路の数は深さに対して指数的に増えるため )
+GRAPH_TRAVERSAL_MAX_ROWS = 10000
+
+# ノード間の到達可能性の表 ( NodeClosure ) を更新するかどうか
+# ( 既存のデータは manage.py rebuild_closure で作成する )
+# ※行数はノード数の 2 乗に比例して増え、書き込みのたびに更新するので、
+#   到達可能性 ( reachability.json ) を使う場合のみ有効にする
+GRAPH_CLOSURE = False
+
+# 接続/ノードの削除時に、リクエストの中で到達可能性の表を作り直す
+# ノードの数の上限 ( 超える場合はコミット後にバックグラウンドで作り直す )
+GRAPH_CLOSURE_MAX_REBUILD = 200
+
+# リクエストごとのクエリを記録し、ビューごとに集計するかどうか
+# ( graph/middleware.py、/graph/queries/stats.json/ で確認できる )
+GRAPH_QUERY_INSTRUMENTATION = DEBUG
+
+# 同じ形のクエリが 1 リクエストで何回以上なら N+1 の疑いとするか
+GRAPH_QUERY_REPEAT_THRESHOLD = 5
+
+# ログに出すクエリの所要時間の閾値 ( ミリ秒、graph/metrics.py )
+GRAPH_SLOW_QUERY_MS = 100
+
+# /graph/metrics/ ( Prometheus のテキスト形式 ) を取得できる IP アドレス
+GRAPH_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# /graph/metrics/ の前にあるプロキシの IP アドレス
+# ( この接続からは X-Forwarded-For のアドレスで GRAPH_METRICS_ALLOWED_IPS を判定する )
+GRAPH_METRICS_TRUSTED_PROXIES = ['127.0.0.1', '::1']
+
+# /graph/metrics/ の Bearer トークン
+# ( 設定すると IP アドレスではなくトークンで判定する )
+GRAPH_METRICS_TOKEN = os.environ.get('GRAPH_METRICS_TOKEN')
+
+# リクエストのプロファイル ( graph/profiling.py ) を保存するディレクトリ
+GRAPH_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# 保存するプロファイルの上限 ( 件数とバイト数、超えたら古いものから削除する )
+GRAPH_PROFILE_MAX_FILES = 500
+GRAPH_PROFILE_MAX_BYTES = 100 * 1024 * 1024
+
+# N 回に 1 回のリクエストをプロファイルする ( 0 の場合はスタッフの
+# 指定 ( X-Graph-Profile ヘッダー / ?profile=1 ) があった場合のみ )
+GRAPH_PROFILE_SAMPLE_RATE = 0
+
+# 開いている関心事のページにグラフの変更を通知するかどうか
+# ( graph/events.py、Server-Sent Events )
+GRAPH_EVENTS = True
+
+# 通知を受け取るストリームの数の上限 ( プロセスごと )
+GRAPH_EVENTS_MAX_SUBSCRIBERS = 1000
+
+# ストリームごとに溜めておく通知の数 ( 溢れたら差分を取得し直させる )
+GRAPH_EVENTS_QUEUE_SIZE = 100
+
+# ストリームを閉じるまでの秒数 ( ブラウザーは自動で再接続する )
+GRAPH_EVENTS_STREAM_SECONDS = 300
+
+# 通知がない場合にコメント行を送る間隔 ( 秒 )
+GRAPH_EVENTS_HEARTBEAT_SECONDS = 15
+
+# これ以上のノード数の関心事は、キャッシュになければ座標を付けずに
+# 少しずつ返す ( concern_detail_json、graph/serializers.py )
+GRAPH_STREAM_MIN_NODES = 10000
+
+# 接続数がこれ以上の関心事も同じように少しずつ返す
+GRAPH_STREAM_MIN_LINKS = 20000
+
+# 少しずつ返したグラフをキャッシュに保存する大きさの上限 ( 文字数 )
+GRAPH_STREAM_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+# 少しずつ返す際に 1 つの断片にまとめる件数
+GRAPH_STREAM_CHUNK_SIZE = 2000
+
+# 全ての関心事のエクスポート ( graph/transfer.py ) で 1 回に返す文字数の目安
+GRAPH_EXPORT_FLUSH_SIZE = 64 * 1024
+
+# ASGI ( mindgraph/asgi.py ) で ORM を呼び出すスレッドの数の上限
+GRAPH_ASYNC_WORKERS = 8
+
+# 関心事ごとの集計 ( graph/counters.py ) を数え直す際に
+# 1 トランザクションで扱う関心事の数 ( manage.py reconcile_counters )
+GRAPH_COUNTERS_BATCH_SIZE = 500
+
+# 全文検索用のインデックス ( graph/search.py ) を更新するかどうか
+# ( 既存のデータは manage.py rebuild_search_index で登録する )
+GRAPH_SEARCH = True
+
+# concern_detail_json にノードごとの指標 ( graph/analytics.py ) を
+# 含めるかどうか ( NumPy と SciPy が必要 )
+GRAPH_ANALYTICS = True
+
+# ノードの座標をサーバー側で計算するかどうか ( NumPy が必要 )
+GRAPH_LAYOUT = True
+
+# レイアウトの計算の反復回数
+GRAPH_LAYOUT_ITERATIONS = 50
+
+# これより多いノードの関心事は座標を計算しない
+# ( concern_detail_json のキャッシュがない場合にリクエストの中で計算するため、
+#   3000 ノードで約 1.7 秒かかる。クライアント側で計算する )
+GRAPH_LAYOUT_MAX_NODES = 2000
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
@@ -138,9 +312,16 @@ LOGGING = {
         },
     },
     "loggers": {
-        "django.db.backends": {
+        # 全ての SQL は出さず、GRAPH_SLOW_QUERY_MS を超えたものだけ
+        # ( graph/metrics.py )
+        "graph.slow_queries": {
             "handlers": ["console"],
-            "level": "DEBUG",
+            "level": "WARNING",
+        },
+        # N+1 の疑い ( graph/instrumentation.py )
+        "graph.queries": {
+            "handlers": ["console"],
+            "level": "WARNING",
         },
     },
 }